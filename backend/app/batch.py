@@ -0,0 +1,397 @@
+"""
+Offline batch export of archived theses, without the HTTP API
+
+    python -m app.batch /archive/2019 --output /srv/vkr-data --workers 8 --memory-budget-mb 8192
+
+Every folder under the input root that holds a metadata.json is one export.
+metadata.json has the metadata fields of /api/prepare (title, author, year,
+...) and may add "finishing" (as in /api/prepare) and "order", a list of
+file names, {"file": ..., "pages": ..., "rotate": ...} selections and
+{"blank": n} entries. Without an order all files of the folder are merged
+in name order.
+
+Folders are exported in parallel worker processes, largest first, as long
+as their estimated memory fits in the budget. Each export is written as
+exports/export_<id>.pdf and .json under --output, the layout of the storage
+root; the ID is derived from the folder path, so a rerun overwrites rather
+than duplicates. Finished folders are appended to a checkpoint file, and a
+rerun skips those that are done.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import logging
+import statistics
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .services.admission import get_available_memory_bytes
+from .services.converter import convert_docx_to_pdf, convert_image_to_pdf, get_file_type
+from .services.finishing import FinishingSpec, expand_footer
+from .services.imageopt import optimize_pdf_images
+from .services.memory import MemoryProbe
+from .services.merger import MergePart
+from .services.pdfengine import get_engine
+from .services.validator import validate_files, validate_metadata, validate_file_order
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = "metadata.json"
+CHECKPOINT_FILE = "batch-checkpoint.jsonl"
+# Memory estimate of one export: the worker and a LibreOffice process, plus
+# this many times its input size for decoded images and PDF objects
+BASE_MEMORY_MB = 300
+MEMORY_PER_INPUT_MB = 4
+# Keep at least this much memory free while starting exports
+MIN_FREE_MEMORY_MB = 256
+# Folder IDs are derived from their path under the input root
+BATCH_NAMESPACE = uuid.UUID("6f1d3c52-8e4b-4b7e-9a55-0c6a3f0e2b17")
+
+def _export_pdf_path(output: Path, export_id: str) -> Path:
+    return output / "exports" / f"export_{export_id}.pdf"
+
+def _export_metadata_path(output: Path, export_id: str) -> Path:
+    return output / "exports" / f"export_{export_id}.json"
+
+def discover(root: Path) -> List[Path]:
+    """Folders under root holding a metadata file, in path order"""
+    return sorted(path.parent for path in root.rglob(METADATA_FILE) if path.is_file())
+
+def folder_id(root: Path, folder: Path) -> str:
+    return str(uuid.uuid5(BATCH_NAMESPACE, folder.relative_to(root).as_posix()))
+
+def folder_size(folder: Path) -> int:
+    return sum(path.stat().st_size for path in folder.iterdir() if path.is_file())
+
+def estimate_memory_mb(input_bytes: int) -> float:
+    return BASE_MEMORY_MB + MEMORY_PER_INPUT_MB * input_bytes / (1024 * 1024)
+
+def _folder_files(folder: Path) -> List[dict]:
+    """The convertible files of a folder, as the validator sees uploads"""
+    files = []
+    for path in sorted(folder.iterdir()):
+        if not path.is_file() or path.name == METADATA_FILE or path.name.startswith("."):
+            continue
+        file_type = get_file_type(str(path))
+        if file_type in ("docx", "pdf", "image"):
+            files.append({"id": path.name, "name": path.name, "type": file_type, "path": str(path)})
+    return files
+
+def _folder_order(spec: Optional[list], files: List[dict]) -> List[dict]:
+    """Order entries with file names as file IDs"""
+    if not spec:
+        return [{"file_id": f["id"]} for f in files]
+    order = []
+    for entry in spec:
+        if isinstance(entry, str):
+            order.append({"file_id": entry})
+        elif entry.get("blank"):
+            order.append({"blank": entry["blank"]})
+        else:
+            order.append({"file_id": entry.get("file"), "pages": entry.get("pages"), "rotate": entry.get("rotate", 0)})
+    return order
+
+def _finishing(metadata: dict, options: Optional[dict]) -> FinishingSpec:
+    if not options:
+        return FinishingSpec(metadata=metadata)
+    return FinishingSpec(
+        metadata=metadata,
+        footer=expand_footer(options["footer"], metadata) if options.get("footer") else None,
+        page_numbers=options.get("page_numbers", False),
+        first_numbered_page=options.get("first_numbered_page", 2),
+        page_labels=options.get("page_labels") or []
+    )
+
+def export_folder(folder: str, root: str, output: str, settings: dict) -> dict:
+    """
+    Convert, merge and write the export of one folder (runs in a worker process)
+
+    Returns:
+        Checkpoint record: folder, export_id, status (done or failed) and
+        error, warnings, pages, input and output sizes, seconds and peak RSS growth
+    """
+    started = time.monotonic()
+    probe = MemoryProbe()
+    folder, root, output = Path(folder), Path(root), Path(output)
+    export_id = folder_id(root, folder)
+    record = {"folder": folder.relative_to(root).as_posix(), "export_id": export_id, "input_bytes": folder_size(folder)}
+    work_dir = Path(tempfile.mkdtemp(prefix=f"batch-{export_id}-", dir=settings["work_dir"]))
+    try:
+        with open(folder / METADATA_FILE, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        files = _folder_files(folder)
+        order = _folder_order(spec.pop("order", None), files)
+        finishing_options = spec.pop("finishing", None)
+        metadata = spec
+
+        metadata_warnings, errors = validate_metadata(metadata)
+        order_warnings, order_errors = validate_file_order(order, files)
+        file_warnings, file_errors = validate_files(files)
+        errors += order_errors + file_errors
+        if errors:
+            raise ValueError("; ".join(errors))
+        warnings = order_warnings + metadata_warnings + file_warnings
+
+        # Each file is converted once, however many selections use it
+        id_to_file = {f["id"]: f for f in files}
+        converted = {}
+        for file_id in dict.fromkeys(entry["file_id"] for entry in order if not entry.get("blank")):
+            file_info = id_to_file[file_id]
+            if file_info["type"] == "pdf":
+                converted[file_id] = file_info["path"]
+            elif file_info["type"] == "docx":
+                converted[file_id] = convert_docx_to_pdf(
+                    file_info["path"], str(work_dir / f"docx-{len(converted)}"), timeout=settings["timeout"],
+                    media_dpi=settings["media_dpi"] or None
+                )
+            else:
+                converted[file_id] = convert_image_to_pdf(
+                    file_info["path"], str(work_dir / f"image-{len(converted)}.pdf"), settings["image_dpi"]
+                )
+
+        parts = [
+            MergePart(blank=entry["blank"]) if entry.get("blank")
+            else MergePart(converted[entry["file_id"]], pages=entry.get("pages"), rotate=entry.get("rotate") or 0)
+            for entry in order
+        ]
+        engine = get_engine(settings["engine"])
+        pdf_path = _export_pdf_path(output, export_id)
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written to scratch space and moved into place, so an interrupted run never leaves a partial export
+        partial = work_dir / "export.pdf"
+        engine.merge(
+            parts, str(partial),
+            memory_budget_bytes=settings["merge_budget_mb"] * 1024 * 1024,
+            finishing=_finishing(metadata, finishing_options)
+        )
+        # One thread per export: the pool already runs an export per core
+        if settings["optimize_dpi"] > 0:
+            optimized = work_dir / "export.optimized.pdf"
+            optimize_pdf_images(
+                str(partial), str(optimized),
+                target_dpi=settings["optimize_dpi"],
+                target_size_bytes=int(settings["target_mb"] * 1024 * 1024) if settings["target_mb"] > 0 else None,
+                workers=1
+            )
+            partial = optimized
+        shutil.move(str(partial), str(pdf_path))
+
+        metadata_record = {
+            "export_id": export_id,
+            "session_id": None,
+            "source": record["folder"],
+            "metadata": metadata,
+            "finishing": finishing_options,
+            "files": [id_to_file[entry["file_id"]]["name"] for entry in order if not entry.get("blank")],
+            "order": [{k: v for k, v in entry.items() if v} for entry in order],
+            "warnings": warnings,
+            "fingerprint": None,
+            "draft": False,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        with open(_export_metadata_path(output, export_id), "w", encoding="utf-8") as f:
+            json.dump(metadata_record, f, ensure_ascii=False, indent=2)
+
+        record.update(
+            status="done",
+            warnings=warnings,
+            pages=engine.page_count(str(pdf_path)),
+            output_bytes=pdf_path.stat().st_size
+        )
+    except Exception as e:
+        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    record["seconds"] = round(time.monotonic() - started, 3)
+    record["peak_delta_mb"] = probe.deltas()["peak_delta_mb"]
+    return record
+
+def load_checkpoint(path: Path) -> Dict[str, dict]:
+    """Last record per folder; a torn final line from a killed run is ignored"""
+    records = {}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["folder"]] = record
+    return records
+
+class Checkpoint:
+    """Append-only JSONL log of finished folders, flushed to disk after each one"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+def _fits(estimate_mb: float, reserved_mb: float, budget_mb: float) -> bool:
+    if reserved_mb + estimate_mb > budget_mb:
+        return False
+    available = get_available_memory_bytes()
+    return available is None or available - estimate_mb * 1024 * 1024 >= MIN_FREE_MEMORY_MB * 1024 * 1024
+
+def run_batch(
+    root: Path,
+    output: Path,
+    workers: int,
+    memory_budget_mb: float,
+    settings: dict,
+    checkpoint_path: Path,
+    retry_failed: bool = False
+) -> Tuple[List[dict], float]:
+    """
+    Export every pending folder under root
+
+    Returns:
+        Tuple of (records of this run, wall seconds)
+    """
+    done = load_checkpoint(checkpoint_path)
+    pending = []
+    for folder in discover(root):
+        previous = done.get(folder.relative_to(root).as_posix())
+        if previous and (previous["status"] == "done" or not retry_failed):
+            continue
+        pending.append((folder, folder_size(folder)))
+    # Largest first, so the long exports don't end up alone at the tail of the run
+    pending.sort(key=lambda item: item[1], reverse=True)
+    total = len(pending)
+    print(f"{total} folder(s) to export, {len(done)} in the checkpoint, {workers} worker(s), {memory_budget_mb:.0f} MB budget")
+
+    records = []
+    running: Dict[Future, Tuple[Path, float]] = {}
+    reserved_mb = 0.0
+    checkpoint = Checkpoint(checkpoint_path)
+    started = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                # The first pending folder that fits; an oversized one runs alone
+                while pending and len(running) < workers:
+                    index = next(
+                        (i for i, (_, size) in enumerate(pending)
+                         if _fits(estimate_memory_mb(size), reserved_mb, memory_budget_mb)),
+                        0 if not running else None
+                    )
+                    if index is None:
+                        break
+                    folder, size = pending.pop(index)
+                    estimate = estimate_memory_mb(size)
+                    future = executor.submit(export_folder, str(folder), str(root), str(output), settings)
+                    running[future] = (folder, estimate)
+                    reserved_mb += estimate
+
+                finished, _ = wait(running, timeout=5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    folder, estimate = running.pop(future)
+                    reserved_mb -= estimate
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # The worker process died (killed for memory, say)
+                        record = {
+                            "folder": folder.relative_to(root).as_posix(),
+                            "export_id": folder_id(root, folder),
+                            "status": "failed",
+                            "error": f"{type(e).__name__}: {e}",
+                            "input_bytes": folder_size(folder),
+                        }
+                    checkpoint.write(record)
+                    records.append(record)
+                    detail = f"{record.get('pages', 0)} pages, {record.get('seconds', 0):.1f}s"
+                    if record["status"] != "done":
+                        detail = record["error"]
+                    print(f"[{len(records)}/{total}] {record['status']:6} {record['folder']}  {detail}", flush=True)
+    finally:
+        checkpoint.close()
+    return records, time.monotonic() - started
+
+def summarize(records: List[dict], wall_seconds: float) -> str:
+    """Throughput summary of a run"""
+    exported = [r for r in records if r["status"] == "done"]
+    failed = len(records) - len(exported)
+    pages = sum(r.get("pages", 0) for r in exported)
+    input_mb = sum(r.get("input_bytes", 0) for r in exported) / (1024 * 1024)
+    output_mb = sum(r.get("output_bytes", 0) for r in exported) / (1024 * 1024)
+    wall = max(wall_seconds, 1e-9)
+    lines = [
+        f"Exported {len(exported)} folder(s), {failed} failed, in {wall_seconds:.1f}s",
+        f"  {len(exported) / wall * 60:.1f} folders/min, {pages / wall:.1f} pages/s, {input_mb / wall:.2f} MB/s in",
+        f"  {pages} pages, {input_mb:.1f} MB in, {output_mb:.1f} MB out",
+    ]
+    seconds = sorted(r["seconds"] for r in exported if r.get("seconds") is not None)
+    if seconds:
+        p95 = seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))]
+        lines.append(f"  per folder: median {statistics.median(seconds):.1f}s, p95 {p95:.1f}s, max {seconds[-1]:.1f}s")
+    peaks = [r["peak_delta_mb"] for r in records if r.get("peak_delta_mb") is not None]
+    if peaks:
+        lines.append(f"  worker peak RSS growth: max {max(peaks):.0f} MB")
+    return "\n".join(lines)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description="Export thesis folders in bulk")
+    parser.add_argument("root", type=Path, help="Directory tree with one folder per thesis")
+    parser.add_argument("--output", type=Path, required=True, help="Storage root to write exports/ into")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="Estimated memory of concurrent exports at most (default: available memory)")
+    parser.add_argument("--checkpoint", type=Path, default=None, help=f"Progress file (default: <output>/{CHECKPOINT_FILE})")
+    parser.add_argument("--retry-failed", action="store_true", help="Run folders that failed before again")
+    parser.add_argument("--engine", default=os.environ.get("PDF_ENGINE", "pypdf"), help="pypdf, pikepdf or auto")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds per DOCX conversion")
+    parser.add_argument("--image-dpi", type=float, default=float(os.environ.get("IMAGE_TARGET_DPI", 300)))
+    parser.add_argument("--media-dpi", type=float, default=float(os.environ.get("DOCX_MEDIA_DPI", 300)),
+                        help="Downsample images inside DOCX files to this before rendering (0 disables)")
+    parser.add_argument("--optimize-dpi", type=float, default=float(os.environ.get("OPTIMIZE_IMAGE_DPI", 0)),
+                        help="Downsample embedded images drawn at more than this (0 disables)")
+    parser.add_argument("--target-mb", type=float, default=float(os.environ.get("OPTIMIZE_TARGET_MB", 0)),
+                        help="With --optimize-dpi, lower the resolution until each export fits this size")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not args.root.is_dir():
+        parser.error(f"{args.root} is not a directory")
+    budget = args.memory_budget_mb
+    if budget is None:
+        available = get_available_memory_bytes()
+        budget = (available / (1024 * 1024) - MIN_FREE_MEMORY_MB) if available else BASE_MEMORY_MB * args.workers
+    workers = max(1, args.workers)
+    work_dir = args.output / "work"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    settings = {
+        "engine": args.engine,
+        "timeout": args.timeout,
+        "image_dpi": args.image_dpi,
+        "media_dpi": args.media_dpi,
+        "optimize_dpi": args.optimize_dpi,
+        "target_mb": args.target_mb,
+        "work_dir": str(work_dir),
+        # Large inputs a worker keeps mapped while merging: its share of the budget
+        "merge_budget_mb": max(64, int(budget / workers)),
+    }
+    records, wall_seconds = run_batch(
+        args.root.resolve(), args.output, workers, budget, settings,
+        args.checkpoint or args.output / CHECKPOINT_FILE, args.retry_failed
+    )
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(summarize(records, wall_seconds))
+    return 1 if any(r["status"] != "done" for r in records) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
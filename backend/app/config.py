@@ -0,0 +1,34 @@
+import os
+from pathlib import Path
+
+# Ensure BASE_DIR points to the application root (i.e., /app inside the container)
+# Previously this used parent.parent.parent which resolved to '/', causing path issues.
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_ROOT = Path(os.environ.get("DATA_ROOT", BASE_DIR / "data"))
+
+# Database shared by all replicas (SQLite file by default)
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./data/vkr_exports.db")
+
+# Storage for uploads, intermediates and exports: "local" or "s3"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").lower()
+STORAGE_ROOT = Path(os.environ.get("STORAGE_ROOT", DATA_ROOT))
+
+# S3-compatible object storage (AWS, MinIO, Yandex Object Storage, ...)
+S3_BUCKET = os.environ.get("S3_BUCKET", "vkr-exports")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_REGION = os.environ.get("S3_REGION")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+
+# Replica-local scratch space for conversions and cached object copies
+WORK_ROOT = Path(os.environ.get("WORK_ROOT", DATA_ROOT / "work"))
+
+# Uploads and metadata untouched for TIERING_AFTER_DAYS are moved to compressed
+# storage by a background job every TIERING_INTERVAL_HOURS (0 days disables it)
+TIERING_AFTER_DAYS = float(os.environ.get("TIERING_AFTER_DAYS", 7))
+TIERING_INTERVAL_HOURS = float(os.environ.get("TIERING_INTERVAL_HOURS", 6))
+# zstd or gzip; zstd is used when the zstandard package is installed
+TIERING_CODEC = os.environ.get("TIERING_CODEC", "").lower()
+# Objects compressed per run at most
+TIERING_BATCH = int(os.environ.get("TIERING_BATCH", 200))
@@ -1,17 +1,20 @@
 import os
 import logging
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel, create_engine, Session
 from typing import Generator
 
+from .config import DATABASE_URL
+
 logger = logging.getLogger(__name__)
 
 # Database configuration
-DATABASE_URL = "sqlite:///./data/vkr_exports.db"
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
 # Create engine
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},  # Needed for SQLite
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},  # Needed for SQLite
     echo=False  # Set to True for SQL query logging
 )
 
@@ -19,15 +22,34 @@ def create_db_and_tables():
     """Create database tables"""
     try:
         # Ensure data directory exists
-        os.makedirs("data", exist_ok=True)
+        if IS_SQLITE:
+            os.makedirs("data", exist_ok=True)
         
         # Create all tables
         SQLModel.metadata.create_all(engine)
+        migrate_columns()
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.error(f"Error creating database tables: {str(e)}")
         raise
 
+def migrate_columns():
+    """Add columns and indexes introduced after a table was first created"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
 def get_session() -> Generator[Session, None, None]:
     """Get database session"""
     with Session(engine) as session:
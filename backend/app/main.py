@@ -1,24 +1,55 @@
+import io
 import os
+import hmac
+import hashlib
 import uuid
+import shutil
 import json
+import time
+import asyncio
 import logging
-from typing import List, Dict
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import func, or_, update
 from sqlmodel import Session, select
 
 from .models import (
-    UploadResponse, PrepareRequest, PrepareResponse, 
-    Session as SessionModel, Export, ProcessingStatus
+    UploadResponse, PrepareRequest, PrepareResponse, PageSelection,
+    Session as SessionModel, Export, ProcessingStatus, TenantPriority, TenantPriorityRequest, Blob,
+    ExportSummary, ExportSearchResponse, TextSignature, QueuedJob
 )
-from .db import get_session, init_db
-from .services.converter import convert_docx_to_pdf, convert_image_to_pdf, get_file_type
-from .services.merger import merge_pdfs
+from . import config
+from .db import get_session, init_db, engine
+from .services.converter import (
+    convert_docx_to_pdf, convert_image_to_pdf, get_file_type, check_image, ImageTooLargeError, get_docx_media_stats,
+    set_pixel_limit, MEDIA_SHRINK_VERSION
+)
+from .services.merger import MergePart, PageRangeError, PdfSource, select_pages
+from .services.pdfengine import get_engine
+from .services.finishing import FinishingSpec, FinishingError, expand_footer
+from .services.imageopt import StorageImageCache, optimize_pdf_images, get_image_optimization_stats
 from .services.validator import validate_files, validate_metadata, validate_file_order
+from .services.blobstore import BlobStore, ingest_uploads, release_session, compute_file_digest
+from .services.fingerprint import compute_export_fingerprint
+from .services.admission import AdmissionController, AdmissionRejected, ClientRateLimiter, get_available_memory_bytes
+from .services.cancellation import CancelToken, ConversionCancelled, get_cancellation_stats
+from .services.storage import create_storage
+from .services.readiness import LoopLagMonitor, free_disk_bytes, ping_database, check
+from .services.memory import MemoryProbe, MemoryRecorder, SnapshotStore, gauges
+from .services.catalogue import setup_search_index, catalogue_fields, search_exports, index_export_text
+from .services.textlayer import extract_pdf_text, join_pages
+from .services.similarity import text_signature, find_similar, add_signature, get_similarity_stats
+from .services.tiering import TieredStorage, forget_restored, tier_objects, get_tiering_stats
+from .services.costmodel import CostModel, extract_features
+from .services.scheduler import FairShareScheduler, Job, TenantPolicy, DEFAULT_TENANT
+from .services.jobqueue import JobQueue
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -36,6 +67,53 @@ app = FastAPI(
     version="1.0.0"
 )
 
+class UploadAdmissionMiddleware:
+    """
+    Shed uploads before their body is read.
+
+    Plain ASGI rather than @app.middleware so that request.is_disconnected()
+    keeps working in the endpoints behind it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/upload":
+            request = Request(scope)
+            try:
+                content_length = int(request.headers.get("content-length") or 0)
+                upload_limiter.check(_client_key(request), content_length)
+                export_admission.check_memory()
+            except AdmissionRejected as e:
+                logger.warning(f"Upload rejected for {_client_key(request)}: {e.reason}")
+                response = JSONResponse(status_code=e.status_code, content={"detail": e.reason}, headers=e.headers)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class MemoryDeltaMiddleware:
+    """Record the RSS growth of each request under its route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        probe = MemoryProbe()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                memory_recorder.record(f"{scope['method']} {route.path}", probe.deltas())
+
+# Registered before CORS so that rejections still carry CORS headers
+app.add_middleware(UploadAdmissionMiddleware)
+app.add_middleware(MemoryDeltaMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -56,12 +134,27 @@ async def startup_event():
     logger.info("=== STARTUP EVENT TRIGGERED ===")
     logger.info("Starting VKR Export System...")
     logger.info(f"Data root: {DATA_ROOT}")
-    logger.info(f"Upload root: {UPLOAD_ROOT}")
-    logger.info(f"Export root: {EXPORT_ROOT}")
+    logger.info(f"Storage backend: {type(storage.inner).__name__}")
+    logger.info(f"Work root: {WORK_ROOT}")
     
     try:
         init_db()
         logger.info("Database initialized successfully")
+        setup_search_index(engine)
+
+        # Drop blobs that lost their last session reference
+        with Session(engine) as db:
+            blob_store.collect_garbage(db)
+            cost_model.fit(db)
+            for priority in db.exec(select(TenantPriority)).all():
+                _apply_tenant_priority(priority)
+
+        if config.TIERING_AFTER_DAYS > 0:
+            asyncio.create_task(_tiering_loop())
+        asyncio.create_task(loop_lag.run())
+        if SIMILARITY_THRESHOLD > 0:
+            asyncio.get_running_loop().run_in_executor(None, _index_existing_texts)
+
         logger.info("VKR Export System started successfully")
         logger.info("=== STARTUP COMPLETE ===")
     except Exception as e:
@@ -69,18 +162,342 @@ async def startup_event():
         raise
 
 # Configuration
-# Ensure BASE_DIR points to the application root (i.e., /app inside the container)
-# Previously this used parent.parent.parent which resolved to '/', causing path issues.
-BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_ROOT = BASE_DIR / "data"
-UPLOAD_ROOT = DATA_ROOT / "uploads"
-EXPORT_ROOT = DATA_ROOT / "exports"
+DATA_ROOT = config.DATA_ROOT
+WORK_ROOT = config.WORK_ROOT
 MAX_FILE_SIZE_MB = 100
+# Uploads are spooled to WORK_ROOT in chunks of this size while they are hashed
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Admission control for conversion-heavy endpoints
+MAX_ACTIVE_EXPORTS = int(os.environ.get("MAX_ACTIVE_EXPORTS", 2))
+MAX_QUEUED_EXPORTS = int(os.environ.get("MAX_QUEUED_EXPORTS", 8))
+MIN_FREE_MEMORY_MB = int(os.environ.get("MIN_FREE_MEMORY_MB", 256))
+PREPARES_PER_MINUTE = float(os.environ.get("PREPARES_PER_MINUTE", 6))
+PREPARE_BURST = int(os.environ.get("PREPARE_BURST", 3))
+UPLOAD_MB_PER_MINUTE = float(os.environ.get("UPLOAD_MB_PER_MINUTE", 200))
+UPLOAD_BURST_MB = int(os.environ.get("UPLOAD_BURST_MB", 300))
+# Proxies in front of the app that append to X-Forwarded-For; the client is the
+# address the outermost of them saw (0 ignores the header)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+
+# /ready answers 503 past these limits so the load balancer routes around the replica
+READY_MAX_QUEUED = int(os.environ.get("READY_MAX_QUEUED", MAX_QUEUED_EXPORTS))
+READY_MAX_BACKLOG_SECONDS = float(os.environ.get("READY_MAX_BACKLOG_SECONDS", 300))
+READY_MAX_LOOP_LAG_MS = float(os.environ.get("READY_MAX_LOOP_LAG_MS", 500))
+READY_MIN_FREE_DISK_MB = int(os.environ.get("READY_MIN_FREE_DISK_MB", 1024))
+READY_DB_TIMEOUT_SECONDS = 2.0
+
+# Queued exports run shortest predicted first; each second of waiting takes
+# SCHEDULER_AGING seconds off a job's predicted cost so large ones still run
+SCHEDULER_AGING = float(os.environ.get("SCHEDULER_AGING", 1.0))
+# Faculties share the export workers by weight, e.g. "fit=2,law=1" (others weigh 1);
+# operators can boost a faculty for a while or ahead of its defence deadline
+TENANT_WEIGHTS = os.environ.get("TENANT_WEIGHTS", "")
+MAX_EXPORTS_PER_TENANT = int(os.environ.get("MAX_EXPORTS_PER_TENANT", 6))
+DEADLINE_WINDOW_HOURS = float(os.environ.get("DEADLINE_WINDOW_HOURS", 24))
+DEADLINE_BOOST = float(os.environ.get("DEADLINE_BOOST", 4))
+# Token for the /api/admin endpoints; they are disabled without it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Stack depth tracemalloc records once an admin takes the first memory snapshot
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", 10))
+# Processes extracting the text layer of finished exports (0 disables it)
+TEXT_WORKERS = int(os.environ.get("TEXT_WORKERS", 2))
+# Estimated share of five-word runs an export must have in common with an
+# earlier one from another session to get a near-duplicate warning (0 disables;
+# needs TEXT_WORKERS)
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", 0.5))
+# Files of one export converted in parallel
+CONVERSIONS_PER_EXPORT = 3
+# Finished or failed exports whose status stays queryable
+EXPORT_STATUS_HISTORY = 1000
+
+# PDF library used to merge exports: pypdf, pikepdf, or auto (pikepdf when installed)
+PDF_ENGINE = os.environ.get("PDF_ENGINE", "pypdf")
+# Bytes of large PDF inputs one export may keep mapped while merging
+MERGE_MEMORY_BUDGET_MB = int(os.environ.get("MERGE_MEMORY_BUDGET_MB", 256))
+# Exports of PDFs and images (or DOCX already converted) totalling at most this
+# are converted and merged in memory, without scratch files (0 disables)
+IN_MEMORY_MAX_MB = float(os.environ.get("IN_MEMORY_MAX_MB", 16))
+# Images are downsampled to fit an A4 page at IMAGE_TARGET_DPI; larger ones
+# than MAX_IMAGE_PIXELS, or whose decoding takes more than
+# IMAGE_MEMORY_BUDGET_MB, are rejected at upload
+IMAGE_TARGET_DPI = float(os.environ.get("IMAGE_TARGET_DPI", 300))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 150_000_000))
+IMAGE_MEMORY_BUDGET_MB = int(os.environ.get("IMAGE_MEMORY_BUDGET_MB", 512))
+# Draft exports: images at DRAFT_IMAGE_DPI, DOCX media capped at DRAFT_DOCX_DPI
+# (75, 150 or 300), no stamps or page labels, DRAFT_WATERMARK across every page.
+# An identical draft built within DRAFT_CACHE_SECONDS is returned again (0 disables)
+DRAFT_IMAGE_DPI = float(os.environ.get("DRAFT_IMAGE_DPI", 72))
+DRAFT_DOCX_DPI = int(os.environ.get("DRAFT_DOCX_DPI", 75))
+DRAFT_WATERMARK = os.environ.get("DRAFT_WATERMARK", "ЧЕРНОВИК")
+DRAFT_CACHE_SECONDS = float(os.environ.get("DRAFT_CACHE_SECONDS", 3600))
+# Images inside a DOCX are downsampled to DOCX_MEDIA_DPI at the size they are
+# displayed at before LibreOffice renders it (0 renders the upload as it is)
+DOCX_MEDIA_DPI = float(os.environ.get("DOCX_MEDIA_DPI", 300))
+# Optional pass over finished exports: embedded images drawn at more than
+# OPTIMIZE_IMAGE_DPI are downsampled and recompressed as JPEG (0 disables);
+# with OPTIMIZE_TARGET_MB the resolution is lowered further until the export fits
+OPTIMIZE_IMAGE_DPI = float(os.environ.get("OPTIMIZE_IMAGE_DPI", 0))
+OPTIMIZE_TARGET_MB = float(os.environ.get("OPTIMIZE_TARGET_MB", 0))
+OPTIMIZE_WORKERS = int(os.environ.get("OPTIMIZE_WORKERS", 4))
 
-# Ensure directories exist (create DATA_ROOT and subdirs)
+# Time limits and cancellation
+CONVERSION_TIMEOUT_SECONDS = float(os.environ.get("CONVERSION_TIMEOUT_SECONDS", 60))
+EXPORT_TIMEOUT_SECONDS = float(os.environ.get("EXPORT_TIMEOUT_SECONDS", 300))
+DISCONNECT_GRACE_SECONDS = float(os.environ.get("DISCONNECT_GRACE_SECONDS", 10))
+DISCONNECT_POLL_SECONDS = 1.0
+
+# Where exports are built: "inline" in this process, or "database" to queue them
+# in the database for worker processes (python -m app.worker), which leaves the
+# web processes only HTTP
+EXPORT_QUEUE = os.environ.get("EXPORT_QUEUE", "inline")
+# A worker's claim on a job lapses QUEUE_LEASE_SECONDS after its last heartbeat
+# and the job goes back to the queue; failed tries are retried with exponential
+# backoff, QUEUE_MAX_ATTEMPTS tries in all
+QUEUE_LEASE_SECONDS = float(os.environ.get("QUEUE_LEASE_SECONDS", 60))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get("QUEUE_MAX_ATTEMPTS", 3))
+QUEUE_RETRY_BASE_SECONDS = float(os.environ.get("QUEUE_RETRY_BASE_SECONDS", 5))
+QUEUE_RETRY_MAX_SECONDS = float(os.environ.get("QUEUE_RETRY_MAX_SECONDS", 300))
+# New exports are rejected with 503 past this many queued jobs
+QUEUE_MAX_DEPTH = int(os.environ.get("QUEUE_MAX_DEPTH", 200))
+# Finished and failed jobs stay queryable this long
+QUEUE_HISTORY_DAYS = float(os.environ.get("QUEUE_HISTORY_DAYS", 7))
+QUEUE_POLL_SECONDS = 0.5
+# Last access of sessions, exports and blobs, which tiering goes by, is
+# written at most once per LAST_ACCESS_RESOLUTION for each of them
+LAST_ACCESS_RESOLUTION = timedelta(hours=1)
+
+# Ensure directories exist (create DATA_ROOT and scratch space)
 DATA_ROOT.mkdir(parents=True, exist_ok=True)
-UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
-EXPORT_ROOT.mkdir(parents=True, exist_ok=True)
+WORK_ROOT.mkdir(parents=True, exist_ok=True)
+
+# Uploads, intermediates and exports live in the configured storage backend,
+# so any replica sharing it (and the database) can serve any step
+storage: TieredStorage = create_storage()
+
+# Uploads are stored once by content hash and referenced from sessions
+blob_store = BlobStore(storage)
+# Recompressed images by source stream hash, so re-exports don't redo the work
+image_cache = StorageImageCache(storage)
+
+# Pillow's own bomb check, set once for every thread; conversions check their limits themselves
+set_pixel_limit(MAX_IMAGE_PIXELS)
+
+def _record_access(key_column, access_column, keys: List[str]) -> None:
+    """Move the last access time of the rows whose key_column is in keys to now"""
+    if not keys:
+        return
+    now = datetime.utcnow()
+    with Session(engine) as db:
+        db.execute(
+            update(key_column.class_)
+            .where(
+                key_column.in_(keys),
+                or_(access_column.is_(None), access_column < now - LAST_ACCESS_RESOLUTION)
+            )
+            .values({access_column.key: now})
+        )
+        db.commit()
+
+def _record_restore(key: str) -> None:
+    """A restored object is in use again, so tiering leaves it alone for another TIERING_AFTER_DAYS"""
+    parts = key.split("/")
+    if parts[0] == "blobs":
+        _record_access(Blob.digest, Blob.last_used_at, [parts[-1]])
+    elif parts[0] == "uploads" and parts[-1] == "index.json":
+        _record_access(SessionModel.session_id, SessionModel.last_accessed_at, [parts[1]])
+    elif parts[0] == "exports" and parts[-1].startswith("export_") and parts[-1].endswith(".json"):
+        _record_access(Export.export_id, Export.last_accessed_at, [parts[-1][len("export_"):-len(".json")]])
+
+storage.on_restore = _record_restore
+
+def _session_index_key(session_id: str) -> str:
+    return f"uploads/{session_id}/index.json"
+
+def _export_pdf_key(export_id: str) -> str:
+    return f"exports/export_{export_id}.pdf"
+
+def _export_metadata_key(export_id: str) -> str:
+    return f"exports/export_{export_id}.json"
+
+def _export_text_key(export_id: str) -> str:
+    return f"exports/export_{export_id}.txt"
+
+def _draft_fingerprint_key(fingerprint: str) -> str:
+    return f"exports/drafts/{fingerprint}.json"
+
+def _intermediate_key(digest: str, file_type: str) -> str:
+    return f"intermediates/{digest}/{_settings_tag(_part_settings(file_type))}/part.pdf"
+
+def _part_text_key(digest: str) -> str:
+    return f"intermediates/{digest}/text.json"
+
+def _draft_part_key(digest: str, file_type: str) -> str:
+    return f"intermediates/{digest}/draft/{_settings_tag(_part_settings(file_type, draft=True))}/part.pdf"
+
+def _part_pages_key(digest: str) -> str:
+    return f"intermediates/{digest}/pages.json"
+
+def _load_session_index(session_id: str) -> Optional[dict]:
+    """Read a session's file index from storage, or None if there is no such session"""
+    key = _session_index_key(session_id)
+    if not storage.exists(key):
+        return None
+    return json.loads(storage.get_bytes(key).decode("utf-8"))
+
+def _input_path(file_info: dict) -> str:
+    """Local path of an uploaded file for the converters"""
+    if file_info.get("key"):
+        return str(storage.local_path(file_info["key"]))
+    # Sessions uploaded before the storage backend recorded a plain path
+    return file_info["path"]
+
+def _stream_object(key: str, filename: str, media_type: str):
+    """Serve a stored object, streaming it when it isn't on the local disk or is compressed"""
+    path = storage.direct_path(key)
+    if path is not None:
+        return FileResponse(path=str(path), filename=filename, media_type=media_type)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if not storage.is_cold(key):
+        # Compressed objects are decompressed on the fly, so their length isn't known upfront
+        headers["Content-Length"] = str(storage.size(key))
+    return StreamingResponse(storage.iter_chunks(key), media_type=media_type, headers=headers)
+
+class InflightExport:
+    """A running build and the requests waiting on it"""
+
+    def __init__(self, export_id: str, task: asyncio.Task, token: CancelToken, job: Job):
+        self.export_id = export_id
+        self.task = task
+        self.token = token
+        self.job = job
+        self.waiters = 0
+        # Set once a client asked not to wait; the build then outlives its waiters
+        self.detached = False
+
+# Exports currently being built, keyed by fingerprint
+inflight_exports: Dict[str, InflightExport] = {}
+# Recent builds by export ID, for the status endpoint
+export_builds: "OrderedDict[str, InflightExport]" = OrderedDict()
+# Background work nobody awaits, referenced until it finishes
+background_tasks = set()
+
+# Conversion times learnt from history, used to order the queue and for ETAs
+cost_model = CostModel()
+loop_lag = LoopLagMonitor()
+# Memory growth per route and per kind of work, and tracemalloc snapshots for leak hunting
+memory_recorder = MemoryRecorder()
+memory_snapshots = SnapshotStore(frames=MEMORY_TRACE_FRAMES)
+pdf_engine = get_engine(PDF_ENGINE)
+
+# Heavy work runs on its own workers so downloads and other cheap endpoints
+# keep the default threadpool to themselves
+export_scheduler = FairShareScheduler(
+    workers=MAX_ACTIVE_EXPORTS,
+    aging=SCHEDULER_AGING,
+    name="export",
+    deadline_window=DEADLINE_WINDOW_HOURS * 3600,
+    deadline_boost=DEADLINE_BOOST
+)
+export_admission = AdmissionController(
+    max_active=MAX_ACTIVE_EXPORTS,
+    max_queued=MAX_QUEUED_EXPORTS,
+    min_free_memory=MIN_FREE_MEMORY_MB * 1024 * 1024,
+    max_per_tenant=MAX_EXPORTS_PER_TENANT
+)
+prepare_limiter = ClientRateLimiter(rate=PREPARES_PER_MINUTE / 60, capacity=PREPARE_BURST)
+# Durable queue of exports for the worker processes (EXPORT_QUEUE=database)
+job_queue = JobQueue(
+    engine,
+    lease_seconds=QUEUE_LEASE_SECONDS,
+    max_attempts=QUEUE_MAX_ATTEMPTS,
+    retry_base_seconds=QUEUE_RETRY_BASE_SECONDS,
+    retry_max_seconds=QUEUE_RETRY_MAX_SECONDS,
+    aging=SCHEDULER_AGING
+)
+upload_limiter = ClientRateLimiter(
+    rate=UPLOAD_MB_PER_MINUTE * 1024 * 1024 / 60,
+    capacity=UPLOAD_BURST_MB * 1024 * 1024
+)
+
+def _tenant_key(faculty: Optional[str], header: Optional[str] = None) -> str:
+    """Scheduling tenant of a request: the X-Faculty header, else the metadata faculty"""
+    name = header or faculty
+    name = " ".join(name.split()).casefold()[:64] if name else ""
+    return name or DEFAULT_TENANT
+
+def _parse_tenant_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, weight = item.rsplit("=", 1)
+        try:
+            weights[_tenant_key(name)] = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring invalid tenant weight: {item}")
+    return weights
+
+tenant_weights = _parse_tenant_weights(TENANT_WEIGHTS)
+for _tenant, _weight in tenant_weights.items():
+    export_scheduler.set_policy(_tenant, TenantPolicy(weight=_weight))
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    """Epoch seconds of a naive UTC datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else None
+
+def _apply_tenant_priority(priority: TenantPriority) -> None:
+    export_scheduler.set_policy(priority.tenant, TenantPolicy(
+        weight=priority.weight,
+        boost=priority.boost,
+        boost_until=_epoch(priority.boost_until),
+        deadline=_epoch(priority.deadline)
+    ))
+
+def _require_admin(token: Optional[str] = Header(default=None, alias="X-Admin-Token")) -> None:
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def _client_key(request: Request) -> str:
+    """
+    Identify the client, honouring X-Forwarded-For as far as our own proxies wrote it
+
+    Entries left of those appended by the TRUSTED_PROXY_HOPS trusted proxies
+    come from the client and could be anything, so they are never used.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+async def _spool_upload(file: UploadFile, path: str) -> Tuple[str, int]:
+    """
+    Copy an upload to path chunk by chunk, hashing it on the way
+
+    Returns:
+        Digest and size of the upload
+
+    Raises:
+        HTTPException: If the upload exceeds MAX_FILE_SIZE_MB
+    """
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as out:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File {file.filename} exceeds size limit of {MAX_FILE_SIZE_MB}MB"
+                )
+            sha.update(chunk)
+            out.write(chunk)
+    return sha.hexdigest(), size
 
 @app.post("/api/upload", response_model=UploadResponse)
 async def upload_files(
@@ -94,48 +511,69 @@ async def upload_files(
         
         # Create new session
         session_id = str(uuid.uuid4())
-        session_dir = UPLOAD_ROOT / session_id
-        session_dir.mkdir(exist_ok=True)
-        
-        # Create session record in database
-        db_session = SessionModel(session_id=session_id)
-        db.add(db_session)
-        db.commit()
+        spool_dir = WORK_ROOT / f"upload-{session_id}"
+        spool_dir.mkdir(parents=True, exist_ok=True)
         
+        # Every file is checked before anything is stored, so a rejected
+        # upload leaves no blobs or references behind. Each one is spooled
+        # to disk as it arrives, so only one chunk is held in memory
         file_records = []
+        uploads = []
         
-        for file in files:
-            # Save file
-            file_path = session_dir / file.filename
-            content = await file.read()
+        try:
+            for index, file in enumerate(files):
+                filename = Path(file.filename).name
+                file_key = f"uploads/{session_id}/{filename}"
+                spool_path = str(spool_dir / str(index))
+                digest, size = await _spool_upload(file, spool_path)
 
-            # Validate file size
-            if len(content) > MAX_FILE_SIZE_MB * 1024 * 1024:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File {file.filename} exceeds size limit of {MAX_FILE_SIZE_MB}MB"
-                )
+                # Determine file type
+                file_type = get_file_type(filename)
 
-            with open(file_path, "wb") as buffer:
-                buffer.write(content)
-            
-            # Determine file type
-            file_type = get_file_type(str(file_path))
+                # Reject image bombs before anything is stored; only the header is read
+                if file_type == "image":
+                    try:
+                        check_image(spool_path, IMAGE_TARGET_DPI, MAX_IMAGE_PIXELS, IMAGE_MEMORY_BUDGET_MB)
+                    except ImageTooLargeError as e:
+                        raise HTTPException(status_code=400, detail=f"File {file.filename}: {str(e)}")
+                    except Exception:
+                        # Unreadable images are reported when they are converted
+                        pass
+
+                uploads.append((spool_path, digest, file_key))
+                
+                # Create file record
+                file_record = {
+                    "id": str(uuid.uuid4()),
+                    "name": file.filename,
+                    "type": file_type,
+                    "key": blob_store.key_for(digest),
+                    "size": size,
+                    "sha256": digest,
+                    "features": extract_features(spool_path, file_type, size)
+                }
+                file_records.append(file_record)
             
-            # Create file record
-            file_record = {
-                "id": str(uuid.uuid4()),
-                "name": file.filename,
-                "type": file_type,
-                "path": str(file_path),
-                "size": len(content)
-            }
-            file_records.append(file_record)
-        
+            # Store each content once and reference it from the session; the
+            # session record is committed together with the references
+            db_session = SessionModel(session_id=session_id)
+            db.add(db_session)
+            try:
+                ingest_uploads(blob_store, db, uploads)
+            except Exception:
+                # The session record may already be committed with the references
+                db.rollback()
+                stale = db.exec(select(SessionModel).where(SessionModel.session_id == session_id)).first()
+                if stale is not None:
+                    db.delete(stale)
+                    db.commit()
+                raise
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
         # Save file index
-        index_path = session_dir / "index.json"
-        with open(index_path, "w", encoding="utf-8") as f:
-            json.dump({"files": file_records}, f, ensure_ascii=False, indent=2)
+        index_data = json.dumps({"files": file_records}, ensure_ascii=False, indent=2)
+        storage.put_bytes(_session_index_key(session_id), index_data.encode("utf-8"))
         
         logger.info(f"Uploaded {len(files)} files for session {session_id}")
         
@@ -144,6 +582,8 @@ async def upload_files(
             files=[{"id": r["id"], "name": r["name"], "type": r["type"]} for r in file_records]
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -152,43 +592,870 @@ async def upload_files(
 async def get_files(session_id: str):
     """Get files for a session"""
     try:
-        session_dir = UPLOAD_ROOT / session_id
-        index_path = session_dir / "index.json"
+        data = _load_session_index(session_id)
         
-        if not index_path.exists():
+        if data is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        with open(index_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
+        _record_access(SessionModel.session_id, SessionModel.last_accessed_at, [session_id])
         return data
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get files error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/api/session/{session_id}")
+async def delete_session(session_id: str, db: Session = Depends(get_session)):
+    """Delete a session and release its blob references"""
+    try:
+        data = _load_session_index(session_id)
+
+        if data is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        released = release_session(blob_store, db, data.get("files", []), f"uploads/{session_id}")
+        removed = blob_store.collect_garbage(db)
+
+        logger.info(f"Deleted session {session_id}: released {released} blobs, removed {len(removed)}")
+
+        return {"session_id": session_id, "released": released, "removed_blobs": len(removed)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Delete session error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _normalize_order(order: List) -> List[PageSelection]:
+    """Turn plain file IDs in an order into page selections"""
+    return [PageSelection(file_id=entry) if isinstance(entry, str) else entry for entry in order]
+
+def _cached_part_key(file_info: dict, draft: bool = False) -> Optional[str]:
+    """
+    Storage key of an already converted part usable for a file, or None
+
+    Draft parts are kept apart from final-quality ones. A draft can use a
+    final-quality DOCX part, which saves a LibreOffice run; images are
+    cheap to convert and their final parts large, so drafts convert them.
+    """
+    digest = file_info.get("sha256")
+    if not digest:
+        return None
+    file_type = file_info["type"]
+    keys = [_draft_part_key(digest, file_type) if draft else _intermediate_key(digest, file_type)]
+    if draft and file_type == "docx":
+        keys.append(_intermediate_key(digest, file_type))
+    return next((key for key in keys if storage.exists(key)), None)
+
+def _record_part_pages(file_info: dict, source: PdfSource) -> None:
+    """
+    Remember the page count of a converted DOCX part
+
+    Draft and final parts have the same pages, so a count learnt from
+    either lets page selections be checked before the other is built.
+    """
+    digest = file_info.get("sha256")
+    if digest and file_info["type"] == "docx":
+        pages = pdf_engine.page_count(source)
+        if pages:
+            storage.put_bytes(_part_pages_key(digest), json.dumps({"pages": pages}).encode("utf-8"))
+
+def _known_page_count(file_info: dict) -> Optional[int]:
+    """Page count of a file's PDF part if it is known without converting anything"""
+    if file_info["type"] == "image":
+        return 1
+    if file_info["type"] == "pdf":
+        pages = int((file_info.get("features") or {}).get("pages", 0))
+        return pages or None
+    digest = file_info.get("sha256")
+    if digest and storage.exists(_part_pages_key(digest)):
+        return json.loads(storage.get_bytes(_part_pages_key(digest)).decode("utf-8"))["pages"]
+    return None
+
+def _check_page_selections(order: List[PageSelection], id_to_file: Dict[str, dict]) -> None:
+    """
+    Check page selections against known page counts before anything is built
+
+    Raises:
+        PageRangeError: If a selection is past the end of its document
+    """
+    for entry in order:
+        if entry.blank or not entry.pages:
+            continue
+        pages = _known_page_count(id_to_file[entry.file_id])
+        if pages is not None:
+            select_pages(entry.pages, pages)
+
+def _convert_part(file_info: dict, work_dir: Path, token: CancelToken, draft: bool = False) -> str:
+    """Return a PDF for an uploaded file, converting it unless a converted part is cached"""
+    token.check()
+    file_id = file_info["id"]
+    file_path = _input_path(file_info)
+    file_type = file_info["type"]
+    
+    if file_type == "pdf":
+        return file_path
+
+    # Converted parts are kept per content hash and shared by all exports
+    cached_key = _cached_part_key(file_info, draft)
+    if cached_key:
+        logger.info(f"Reusing converted part for {file_info['name']}")
+        return str(storage.local_path(cached_key))
+
+    started = time.monotonic()
+    probe = MemoryProbe()
+    if file_type == "docx":
+        # Convert DOCX to PDF
+        pdf_path = convert_docx_to_pdf(
+            file_path, str(work_dir / file_id), token=token, timeout=CONVERSION_TIMEOUT_SECONDS,
+            max_image_dpi=DRAFT_DOCX_DPI if draft else None,
+            media_dpi=DRAFT_DOCX_DPI if draft else DOCX_MEDIA_DPI
+        )
+    elif file_type == "image":
+        # Convert image to PDF
+        pdf_path = str(work_dir / f"{file_id}.pdf")
+        convert_image_to_pdf(
+            file_path, pdf_path, DRAFT_IMAGE_DPI if draft else IMAGE_TARGET_DPI, MAX_IMAGE_PIXELS, IMAGE_MEMORY_BUDGET_MB
+        )
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    _record_cost(_conversion_kind(file_type, draft), _file_features(file_info), time.monotonic() - started, probe.deltas())
+
+    digest = file_info.get("sha256")
+    if digest:
+        storage.put_file(_draft_part_key(digest, file_type) if draft else _intermediate_key(digest, file_type), pdf_path)
+        _record_part_pages(file_info, pdf_path)
+    return pdf_path
+
+def _load_part(file_info: dict, token: CancelToken, draft: bool = False) -> bytes:
+    """Return a PDF for an uploaded file as bytes, converting images in memory"""
+    token.check()
+    file_type = file_info["type"]
+    if file_type == "pdf":
+        return storage.get_bytes(file_info["key"])
+
+    cached_key = _cached_part_key(file_info, draft)
+    if cached_key:
+        logger.info(f"Reusing converted part for {file_info['name']}")
+        return storage.get_bytes(cached_key)
+    if file_type != "image":
+        raise ValueError(f"{file_info['name']} has to be converted on disk")
+
+    started = time.monotonic()
+    probe = MemoryProbe()
+    output = io.BytesIO()
+    convert_image_to_pdf(
+        io.BytesIO(storage.get_bytes(file_info["key"])), output,
+        DRAFT_IMAGE_DPI if draft else IMAGE_TARGET_DPI, MAX_IMAGE_PIXELS, IMAGE_MEMORY_BUDGET_MB
+    )
+    _record_cost(_conversion_kind(file_type, draft), _file_features(file_info), time.monotonic() - started, probe.deltas())
+
+    digest = file_info.get("sha256")
+    if digest:
+        storage.put_bytes(_draft_part_key(digest, file_type) if draft else _intermediate_key(digest, file_type), output.getvalue())
+    return output.getvalue()
+
+def _fits_in_memory(files: List[dict], draft: bool = False) -> bool:
+    """Whether an export can be built in memory: small, and nothing needs LibreOffice"""
+    if IN_MEMORY_MAX_MB <= 0 or any(not file_info.get("key") for file_info in files):
+        return False
+    if sum(file_info.get("size", 0) for file_info in files) > IN_MEMORY_MAX_MB * 1024 * 1024:
+        return False
+    return all(
+        file_info["type"] in ("pdf", "image") or not _needs_conversion(file_info, draft) for file_info in files
+    )
+
+def _needs_conversion(file_info: dict, draft: bool = False) -> bool:
+    return file_info["type"] != "pdf" and _cached_part_key(file_info, draft) is None
+
+def _conversion_kind(file_type: str, draft: bool = False) -> str:
+    """Cost model kind of a conversion; draft conversions are much cheaper and learnt apart"""
+    return f"{file_type}-draft" if draft else file_type
+
+def _file_features(file_info: dict) -> Dict[str, float]:
+    """Cost model features of an uploaded file"""
+    if file_info.get("features"):
+        return file_info["features"]
+    # Sessions uploaded before the cost model have no recorded features
+    path = _input_path(file_info)
+    return extract_features(path, file_info["type"], file_info.get("size") or os.path.getsize(path))
+
+def _conversion_cost(file_info: dict, draft: bool = False) -> float:
+    """Predicted seconds to get a PDF part for a file; nothing for PDFs and cached parts"""
+    if not _needs_conversion(file_info, draft):
+        return 0.0
+    return cost_model.predict(_conversion_kind(file_info["type"], draft), _file_features(file_info))
+
+def _merge_features(id_to_file: Dict[str, dict], order: List[PageSelection]) -> Dict[str, float]:
+    """Cost model features of merging an order: total input size and pages"""
+    features = {"size_mb": 0.0, "pages": 0.0, "media_mb": 0.0}
+    for entry in order:
+        if entry.blank:
+            features["pages"] += entry.blank
+            continue
+        file_features = _file_features(id_to_file[entry.file_id])
+        features["size_mb"] += file_features.get("size_mb", 0.0)
+        features["pages"] += file_features.get("pages", 0.0)
+    return features
+
+def _predict_export_cost(id_to_file: Dict[str, dict], order: List[PageSelection], draft: bool = False) -> float:
+    """Predicted seconds to build an export once it starts"""
+    file_ids = dict.fromkeys(entry.file_id for entry in order if not entry.blank)
+    costs = [_conversion_cost(id_to_file[file_id], draft) for file_id in file_ids]
+    # Conversions run CONVERSIONS_PER_EXPORT at a time, but never faster than the longest
+    conversion = max(max(costs, default=0.0), sum(costs) / CONVERSIONS_PER_EXPORT)
+    return conversion + cost_model.predict("merge", _merge_features(id_to_file, order))
+
+def _record_cost(
+    kind: str,
+    features: Dict[str, float],
+    duration: float,
+    memory: Optional[Dict[str, Optional[float]]] = None
+) -> None:
+    """Add an observed duration and memory growth to the cost model; failures only cost accuracy"""
+    if memory:
+        memory_recorder.record(kind, memory)
+    try:
+        with Session(engine) as db:
+            cost_model.record(db, kind, features, duration, memory)
+    except Exception as e:
+        logger.warning(f"Failed to record {kind} duration: {str(e)}")
+
+def _finishing_spec(request: PrepareRequest) -> FinishingSpec:
+    """Finishing for an export: metadata is always embedded, stamps on request"""
+    metadata = request.metadata.dict()
+    options = request.finishing
+    if options is None:
+        return FinishingSpec(metadata=metadata)
+    return FinishingSpec(
+        metadata=metadata,
+        footer=expand_footer(options.footer, metadata) if options.footer else None,
+        page_numbers=options.page_numbers,
+        first_numbered_page=options.first_numbered_page,
+        page_labels=[label.dict() for label in options.page_labels]
+    )
+
+def _draft_finishing(request: PrepareRequest) -> FinishingSpec:
+    """Finishing for a draft: metadata and the draft watermark, none of the requested stamps"""
+    return FinishingSpec(metadata=request.metadata.dict(), watermark=DRAFT_WATERMARK)
+
+def _settings_tag(settings: Dict[str, object]) -> str:
+    """Short stable hash of settings, for storage keys and fingerprints"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def _part_settings(file_type: str, draft: bool = False) -> Dict[str, object]:
+    """What a converted part depends on besides its input, so changing it doesn't reuse old parts"""
+    if file_type == "image":
+        return {
+            "image_dpi": DRAFT_IMAGE_DPI if draft else IMAGE_TARGET_DPI,
+            "max_pixels": MAX_IMAGE_PIXELS,
+            "memory_budget_mb": IMAGE_MEMORY_BUDGET_MB,
+        }
+    if file_type == "docx":
+        return {
+            "max_image_dpi": DRAFT_DOCX_DPI if draft else None,
+            "media_dpi": DRAFT_DOCX_DPI if draft else DOCX_MEDIA_DPI,
+            "media_shrink": MEDIA_SHRINK_VERSION,
+        }
+    return {}
+
+def _pipeline_version() -> str:
+    """Engine version plus the settings that change an export's bytes, for fingerprints"""
+    version = pdf_engine.version()
+    version += f"+parts-{_settings_tag({t: _part_settings(t) for t in ('docx', 'image')})}"
+    if OPTIMIZE_IMAGE_DPI > 0:
+        version += f"+images-{OPTIMIZE_IMAGE_DPI:g}dpi"
+        if OPTIMIZE_TARGET_MB > 0:
+            version += f"-{OPTIMIZE_TARGET_MB:g}mb"
+    return version
+
+def _draft_settings() -> Dict[str, object]:
+    """What a draft's output depends on besides its inputs, for its fingerprint"""
+    return {"image_dpi": DRAFT_IMAGE_DPI, "docx_dpi": DRAFT_DOCX_DPI, "watermark": DRAFT_WATERMARK}
+
+def _build_export(
+    export_id: str,
+    id_to_file: Dict[str, dict],
+    order: List[PageSelection],
+    finishing: FinishingSpec,
+    token: CancelToken,
+    draft: bool = False
+) -> Tuple[str, Optional[Tuple[List[int], int]]]:
+    """
+    Convert the ordered files and merge them into the export PDF
+
+    With the near-duplicate check on, the text of the converted parts is
+    extracted while they are merged. Small exports that need no LibreOffice
+    run are built from buffers without touching the scratch directory.
+    Drafts are built from low-resolution parts and skip the near-duplicate
+    check.
+
+    Returns:
+        Tuple of (PDF storage key, text signature and shingle count or None)
+    """
+    # Conversion stage; a failing file stops its siblings too
+    stage = token.child()
+    work_dir = WORK_ROOT / export_id
+    job = export_scheduler.current_job()
+    export_probe = MemoryProbe()
+    text_executor = None
+    text_future = None
+
+    # Each file is converted once, however many page selections use it
+    file_ids = list(dict.fromkeys(entry.file_id for entry in order if not entry.blank))
+    for file_id in file_ids:
+        if file_id not in id_to_file:
+            raise ValueError(f"File ID {file_id} not found")
+    in_memory = _fits_in_memory([id_to_file[file_id] for file_id in file_ids], draft)
+    if not in_memory:
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+    def process_file(file_id: str) -> PdfSource:
+        if in_memory:
+            return _load_part(id_to_file[file_id], stage, draft)
+        return _convert_part(id_to_file[file_id], work_dir, stage, draft)
+    
+    try:
+
+        # Progress is reported as the predicted share of the work that is done
+        costs = {file_id: _conversion_cost(id_to_file[file_id], draft) for file_id in file_ids}
+        merge_features = _merge_features(id_to_file, order)
+        total_cost = sum(costs.values()) + cost_model.predict("merge", merge_features)
+        done_cost = 0.0
+
+        with ThreadPoolExecutor(max_workers=CONVERSIONS_PER_EXPORT) as executor:
+            futures = {file_id: executor.submit(process_file, file_id) for file_id in file_ids}
+            try:
+                converted = {}
+                for file_id, future in futures.items():
+                    converted[file_id] = future.result()
+                    done_cost += costs.get(file_id, 0.0)
+                    if job:
+                        job.report("converting", done_cost / total_cost)
+            except Exception:
+                if any(not future.done() for future in futures.values()):
+                    stage.cancel("another file in the export failed")
+                raise
+        
+        if SIMILARITY_THRESHOLD > 0 and TEXT_WORKERS > 0 and not draft:
+            text_executor = ThreadPoolExecutor(max_workers=1)
+            text_future = text_executor.submit(_signature_of_parts, id_to_file, order, converted, token)
+
+        # Merge page references into the converted parts, keeping the requested order
+        token.check()
+        if job:
+            job.report("merging", done_cost / total_cost)
+        parts = [
+            MergePart(blank=entry.blank) if entry.blank
+            else MergePart(converted[entry.file_id], pages=entry.pages, rotate=entry.rotate)
+            for entry in order
+        ]
+        output_pdf = io.BytesIO() if in_memory else work_dir / f"export_{export_id}.pdf"
+        started = time.monotonic()
+        merge_probe = MemoryProbe()
+        pdf_engine.merge(
+            parts,
+            output_pdf if in_memory else str(output_pdf),
+            memory_budget_bytes=MERGE_MEMORY_BUDGET_MB * 1024 * 1024,
+            finishing=finishing
+        )
+        _record_cost("merge", merge_features, time.monotonic() - started, merge_probe.deltas())
+
+        if OPTIMIZE_IMAGE_DPI > 0 and not draft:
+            token.check()
+            if job:
+                job.report("optimizing images", done_cost / total_cost)
+            merged = output_pdf.getvalue() if in_memory else str(output_pdf)
+            output_pdf = io.BytesIO() if in_memory else work_dir / f"export_{export_id}.optimized.pdf"
+            optimize_pdf_images(
+                merged,
+                output_pdf if in_memory else str(output_pdf),
+                target_dpi=OPTIMIZE_IMAGE_DPI,
+                target_size_bytes=int(OPTIMIZE_TARGET_MB * 1024 * 1024) if OPTIMIZE_TARGET_MB > 0 else None,
+                workers=OPTIMIZE_WORKERS,
+                cache=image_cache
+            )
+
+        if job:
+            job.report("storing", 0.99)
+        pdf_key = _export_pdf_key(export_id)
+        if in_memory:
+            storage.put_bytes(pdf_key, output_pdf.getvalue())
+        else:
+            storage.put_file(pdf_key, str(output_pdf))
+
+        signature = None
+        if text_future is not None:
+            try:
+                signature = text_future.result()
+            except Exception as e:
+                # The export itself is fine; it just goes unchecked
+                logger.warning(f"Near-duplicate check skipped for export {export_id}: {str(e)}")
+
+        memory = export_probe.deltas()
+        memory_recorder.record("export", memory)
+        if memory["rss_delta_mb"] is not None:
+            logger.info(
+                f"Export {export_id} memory: RSS {memory['rss_delta_mb']:+.1f}MB, peak {memory['peak_delta_mb']:+.1f}MB"
+            )
+        return pdf_key, signature
+    finally:
+        # The text thread reads converted parts from the work directory
+        if text_executor is not None:
+            text_executor.shutdown(wait=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+async def _run_export(
+    export_id: str,
+    job: Job,
+    tenant: str,
+    fingerprint: str,
+    idempotency_key: Optional[str],
+    request: PrepareRequest,
+    order: List[PageSelection],
+    id_to_file: Dict[str, dict],
+    all_warnings: List[str]
+) -> PrepareResponse:
+    """Wait for a scheduled build off the event loop and record it"""
+    started = time.monotonic()
+    try:
+        pdf_key, signature = await asyncio.wrap_future(job.future)
+    finally:
+        export_admission.release(time.monotonic() - started, tenant)
+
+    response = _record_export(
+        export_id, fingerprint, idempotency_key, request, order, id_to_file, all_warnings, pdf_key, signature
+    )
+
+    if TEXT_WORKERS > 0 and not request.draft:
+        task = asyncio.create_task(_extract_export_text(export_id, id_to_file, order))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    return response
+
+def _record_export(
+    export_id: str,
+    fingerprint: str,
+    idempotency_key: Optional[str],
+    request: PrepareRequest,
+    order: List[PageSelection],
+    id_to_file: Dict[str, dict],
+    all_warnings: List[str],
+    pdf_key: str,
+    signature: Optional[tuple]
+) -> PrepareResponse:
+    """Store the metadata of a built export and catalogue it"""
+    session_id = request.session_id
+
+    if signature is not None:
+        all_warnings = all_warnings + _similarity_warnings(session_id, signature[0])
+    
+    # Create metadata record
+    metadata_record = {
+        "export_id": export_id,
+        "session_id": session_id,
+        "metadata": request.metadata.dict(),
+        "finishing": request.finishing.dict() if request.finishing else None,
+        "files": [id_to_file[entry.file_id]["name"] for entry in order if not entry.blank],
+        "order": [entry.dict(exclude_defaults=True) for entry in order],
+        "warnings": all_warnings,
+        "fingerprint": fingerprint,
+        "pipeline": _pipeline_version(),
+        "draft": request.draft,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    
+    # Save metadata
+    metadata_json = json.dumps(metadata_record, ensure_ascii=False, indent=2)
+    storage.put_bytes(_export_metadata_key(export_id), metadata_json.encode("utf-8"))
+
+    if request.draft:
+        # Drafts are downloadable but not catalogued, indexed or text-extracted;
+        # a pointer by fingerprint lets an identical preview reuse this one
+        pointer = {"export_id": export_id, "created_at": time.time()}
+        storage.put_bytes(_draft_fingerprint_key(fingerprint), json.dumps(pointer).encode("utf-8"))
+        logger.info(f"Draft export created successfully: {export_id}")
+        return _export_response(export_id, all_warnings)
+    
+    # Save to database (the request's own session may be gone if the client left)
+    with Session(engine) as db:
+        export_record = Export(
+            export_id=export_id,
+            session_id=session_id,
+            pdf_path=pdf_key,
+            metadata_json=json.dumps(metadata_record, ensure_ascii=False),
+            warnings=json.dumps(all_warnings, ensure_ascii=False) if all_warnings else None,
+            fingerprint=fingerprint,
+            idempotency_key=idempotency_key,
+            text_status="pending" if TEXT_WORKERS > 0 else None,
+            **catalogue_fields(request.metadata.dict())
+        )
+        db.add(export_record)
+        db.commit()
+        if signature is not None:
+            add_signature(db, export_id, session_id, *signature)
+    
+    logger.info(f"Export created successfully: {export_id}")
+    return _export_response(export_id, all_warnings)
+
+def _part_text(file_info: dict, work_dir: Path, token: CancelToken, pdf_path: Optional[PdfSource] = None) -> List[str]:
+    """Page texts of an uploaded file, extracted once per content hash (from pdf_path if converted already)"""
+    digest = file_info.get("sha256")
+    cache_key = _part_text_key(digest) if digest else None
+    if cache_key and storage.exists(cache_key):
+        return json.loads(storage.get_bytes(cache_key).decode("utf-8"))
+
+    if file_info["type"] == "image":
+        # Scans have no text layer (there is no OCR); an image is one page
+        pages = [""]
+    else:
+        # For DOCX this is the PDF LibreOffice produced for the export, whose text layer is reused
+        pages = extract_pdf_text(pdf_path or _convert_part(file_info, work_dir, token), TEXT_WORKERS)
+
+    if cache_key:
+        storage.put_compressed(cache_key, json.dumps(pages, ensure_ascii=False).encode("utf-8"))
+    return pages
+
+def _export_pages(parts: Dict[str, List[str]], order: List[PageSelection]) -> List[str]:
+    """Page texts of an export from the page texts of its parts"""
+    pages = []
+    for entry in order:
+        if entry.blank:
+            pages.extend([""] * entry.blank)
+            continue
+        part = parts[entry.file_id]
+        indices = select_pages(entry.pages, len(part)) if entry.pages else range(len(part))
+        pages.extend(part[index] for index in indices)
+    return pages
+
+def _signature_of_parts(
+    id_to_file: Dict[str, dict],
+    order: List[PageSelection],
+    converted: Dict[str, PdfSource],
+    token: CancelToken
+) -> Optional[Tuple[List[int], int]]:
+    """Text signature of an export from its converted parts; fills the part text cache"""
+    parts = {
+        file_id: _part_text(id_to_file[file_id], WORK_ROOT, token, pdf_path)
+        for file_id, pdf_path in converted.items()
+    }
+    return text_signature(join_pages(_export_pages(parts, order)))
+
+def _similarity_warnings(session_id: str, signature: List[int]) -> List[str]:
+    """Warnings about earlier exports from other sessions with nearly the same text"""
+    with Session(engine) as db:
+        matches = find_similar(db, signature, SIMILARITY_THRESHOLD, exclude_session=session_id)
+    warnings = []
+    for export, score in matches:
+        described = ", ".join(str(value) for value in (export.author, export.title, export.year) if value)
+        warnings.append(
+            f"Text is about {round(score * 100)}% similar to export {export.export_id}"
+            + (f" ({described})" if described else "")
+        )
+    return warnings
+
+def _index_existing_texts() -> int:
+    """
+    Add exports whose text was extracted before the near-duplicate index existed
+
+    Returns:
+        Number of indexed exports
+    """
+    indexed = 0
+    with Session(engine) as db:
+        known = set(db.exec(select(TextSignature.export_id)).all())
+        for export in db.exec(select(Export).where(Export.text_status == "ready").order_by(Export.id)).all():
+            if export.export_id in known:
+                continue
+            try:
+                text = storage.get_bytes(_export_text_key(export.export_id)).decode("utf-8")
+            except Exception as e:
+                logger.warning(f"Text of export {export.export_id} unavailable: {str(e)}")
+                continue
+            signature = text_signature(text)
+            if signature is not None:
+                add_signature(db, export.export_id, export.session_id, *signature)
+                indexed += 1
+    if indexed:
+        logger.info(f"Added {indexed} earlier exports to the near-duplicate index")
+    return indexed
+
+def _build_export_text(export_id: str, id_to_file: Dict[str, dict], order: List[PageSelection]) -> str:
+    """Assemble the text of an export from its parts, in export page order"""
+    # Only created if a part has to be converted again (its cached text is usually there)
+    work_dir = WORK_ROOT / f"text-{export_id}"
+    token = CancelToken.with_timeout(EXPORT_TIMEOUT_SECONDS)
+    try:
+        parts = {
+            file_id: _part_text(id_to_file[file_id], work_dir, token)
+            for file_id in dict.fromkeys(entry.file_id for entry in order if not entry.blank)
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = join_pages(_export_pages(parts, order))
+    storage.put_compressed(_export_text_key(export_id), text.encode("utf-8"))
+    return text
+
+async def _extract_export_text(export_id: str, id_to_file: Dict[str, dict], order: List[PageSelection]) -> None:
+    await asyncio.get_running_loop().run_in_executor(None, _store_export_text, export_id, id_to_file, order)
+
+def _store_export_text(export_id: str, id_to_file: Dict[str, dict], order: List[PageSelection]) -> None:
+    """Extract, store and index the text of a finished export"""
+    try:
+        text = _build_export_text(export_id, id_to_file, order)
+        status = "ready"
+    except Exception as e:
+        logger.error(f"Text extraction failed for export {export_id}: {str(e)}")
+        text, status = None, "failed"
+
+    with Session(engine) as db:
+        export = db.exec(select(Export).where(Export.export_id == export_id)).first()
+        if export is None:
+            return
+        export.text_status = status
+        db.add(export)
+        db.commit()
+        if text is not None:
+            index_export_text(engine, export.id, text)
+            logger.info(f"Extracted {len(text)} characters of text for export {export_id}")
+
+def _queued_payload(
+    export_id: str,
+    fingerprint: str,
+    idempotency_key: Optional[str],
+    request: PrepareRequest,
+    id_to_file: Dict[str, dict],
+    all_warnings: List[str]
+) -> dict:
+    """Everything a worker needs to build and record an export"""
+    return {
+        "export_id": export_id,
+        "fingerprint": fingerprint,
+        "idempotency_key": idempotency_key,
+        "request": request.dict(),
+        "id_to_file": id_to_file,
+        "warnings": all_warnings,
+    }
+
+def run_queued_export(payload: dict, token: CancelToken) -> dict:
+    """
+    Build and record an export claimed from the job queue (runs in a worker)
+
+    Returns:
+        The PrepareResponse of the export, as a dict
+    """
+    request = PrepareRequest.parse_obj(payload["request"])
+    export_id = payload["export_id"]
+    id_to_file = payload["id_to_file"]
+    order = _normalize_order(request.order)
+    finishing = _draft_finishing(request) if request.draft else _finishing_spec(request)
+    pdf_key, signature = _build_export(export_id, id_to_file, order, finishing, token, request.draft)
+    response = _record_export(
+        export_id, payload["fingerprint"], payload["idempotency_key"], request, order, id_to_file,
+        payload["warnings"], pdf_key, signature
+    )
+    return response.dict()
+
+def extract_queued_text(payload: dict) -> None:
+    """Text extraction of an export built by run_queued_export (runs in a worker)"""
+    request = PrepareRequest.parse_obj(payload["request"])
+    if TEXT_WORKERS > 0 and not request.draft:
+        _store_export_text(payload["export_id"], payload["id_to_file"], _normalize_order(request.order))
+
+def queued_error_status(error: BaseException) -> Optional[int]:
+    """HTTP status of an error another try can't fix, or None if the job should be retried"""
+    if isinstance(error, (PageRangeError, FinishingError, ImageTooLargeError)):
+        return 400
+    if isinstance(error, ConversionCancelled):
+        return 504
+    return None
+
+def _queued_response(queued: QueuedJob, warnings: List[str]) -> PrepareResponse:
+    """Response for a queued export the client doesn't wait for"""
+    response = _export_response(queued.job_id, warnings)
+    response.status = "running" if queued.state == "completed" else queued.state
+    response.eta_seconds = round(job_queue.estimate(queued), 1)
+    response.status_url = f"/api/status/{queued.job_id}"
+    return response
+
+def _queued_failure(queued: QueuedJob) -> HTTPException:
+    status_code = json.loads(queued.result or "{}").get("status_code", 500)
+    return HTTPException(status_code=status_code, detail=queued.error or "Export failed")
+
+async def _wait_for_queued_export(job_id: str, http_request: Request) -> PrepareResponse:
+    """
+    Poll a queued export until a worker has finished it.
+
+    A client that leaves doesn't cancel the job: it is durable, and a retry
+    attaches to it (or finds the finished export) by fingerprint.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        queued = await loop.run_in_executor(None, job_queue.get, job_id)
+        if queued is None:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        if queued.state == "completed":
+            return PrepareResponse.parse_raw(queued.result)
+        if queued.state == "failed":
+            raise _queued_failure(queued)
+        if await http_request.is_disconnected():
+            logger.info("Client disconnected while waiting for queued export")
+            raise ConversionCancelled("client disconnected")
+        await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+async def _prepare_queued(
+    request: PrepareRequest,
+    http_request: Request,
+    faculty: Optional[str],
+    fingerprint: str,
+    idempotency_key: Optional[str],
+    order: List[PageSelection],
+    id_to_file: Dict[str, dict],
+    all_warnings: List[str],
+    wait: bool
+) -> PrepareResponse:
+    """Queue an export for the workers, or attach to an identical queued one"""
+    queued = job_queue.find_active(fingerprint)
+    if queued is None:
+        prepare_limiter.check(_client_key(http_request))
+        stats = job_queue.stats()
+        if stats["queued"] >= QUEUE_MAX_DEPTH:
+            backlog = stats["queued_cost_seconds"] / max(stats["running"], 1)
+            raise AdmissionRejected(503, "Server is busy, export queue is full", min(300.0, max(1.0, backlog)))
+        tenant = _tenant_key(request.metadata.faculty, faculty)
+        export_id = str(uuid.uuid4())
+        queued = job_queue.enqueue(
+            export_id,
+            _queued_payload(export_id, fingerprint, idempotency_key, request, id_to_file, all_warnings),
+            tenant=tenant,
+            cost=_predict_export_cost(id_to_file, order, request.draft),
+            fingerprint=fingerprint
+        )
+    else:
+        logger.info(f"Attaching to queued export {fingerprint[:12]}")
+
+    if not wait:
+        return _queued_response(queued, all_warnings)
+    return await _wait_for_queued_export(queued.job_id, http_request)
+
+def _export_response(export_id: str, warnings: List[str]) -> PrepareResponse:
+    return PrepareResponse(
+        export_id=export_id,
+        pdf_url=f"/api/download/{export_id}",
+        metadata_url=f"/api/metadata/{export_id}",
+        warnings=warnings
+    )
+
+def _pending_response(entry: InflightExport, warnings: List[str]) -> PrepareResponse:
+    """Response for a build the client doesn't wait for"""
+    response = _export_response(entry.export_id, warnings)
+    response.status = "running" if entry.job.state == "completed" else entry.job.state
+    response.eta_seconds = round(export_scheduler.estimate(entry.job), 1)
+    response.status_url = f"/api/status/{entry.export_id}"
+    return response
+
+def _forget_build(fingerprint: str, task: asyncio.Task) -> None:
+    inflight_exports.pop(fingerprint, None)
+    # Nobody may be awaiting a detached build; its failure is reported by the status endpoint
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Export build failed: {str(task.exception())}")
+
+def _find_existing_export(db: Session, column, value: str) -> Optional[Export]:
+    """Return the newest export matching column == value whose PDF still exists"""
+    for export in db.exec(select(Export).where(column == value).order_by(Export.id.desc())).all():
+        if storage.exists(_export_pdf_key(export.export_id)):
+            return export
+    return None
+
+def _find_recent_draft(fingerprint: str) -> Optional[str]:
+    """Return the ID of an identical draft built within DRAFT_CACHE_SECONDS whose PDF still exists"""
+    if DRAFT_CACHE_SECONDS <= 0:
+        return None
+    key = _draft_fingerprint_key(fingerprint)
+    if not storage.exists(key):
+        return None
+    try:
+        pointer = json.loads(storage.get_bytes(key))
+    except Exception as e:
+        logger.warning(f"Unreadable draft pointer {key}: {str(e)}")
+        return None
+    if time.time() - pointer["created_at"] > DRAFT_CACHE_SECONDS:
+        return None
+    if not storage.exists(_export_pdf_key(pointer["export_id"])):
+        return None
+    return pointer["export_id"]
+
+async def _wait_for_export(entry: InflightExport, http_request: Request) -> PrepareResponse:
+    """
+    Wait for a build while watching the client connection.
+
+    The build is shielded so one client leaving doesn't cancel it for the
+    others. Once the last waiter is gone for DISCONNECT_GRACE_SECONDS (long
+    enough for a retry to re-attach) the build is cancelled.
+    """
+    entry.waiters += 1
+    shielded = asyncio.shield(entry.task)
+    try:
+        while True:
+            done, _ = await asyncio.wait({shielded}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return shielded.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected while waiting for export")
+                raise ConversionCancelled("client disconnected")
+    finally:
+        entry.waiters -= 1
+        if entry.waiters == 0 and not entry.task.done() and not entry.detached:
+            def cancel_if_abandoned():
+                if entry.waiters == 0 and not entry.task.done() and not entry.detached:
+                    entry.token.cancel("all clients disconnected")
+            asyncio.get_running_loop().call_later(DISCONNECT_GRACE_SECONDS, cancel_if_abandoned)
+
 @app.post("/api/prepare", response_model=PrepareResponse)
 async def prepare_export(
     request: PrepareRequest,
-    db: Session = Depends(get_session)
+    http_request: Request,
+    db: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    faculty: Optional[str] = Header(default=None, alias="X-Faculty"),
+    wait: bool = True
 ):
-    """Prepare and generate the final PDF export"""
+    """
+    Prepare and generate the final PDF export.
+
+    With wait=false the response comes back as soon as the build is queued,
+    with an ETA and a status URL to poll.
+    """
     try:
+        # A retried request with the same key gets the original export back,
+        # unless settings that change an export's bytes have changed since
+        if idempotency_key:
+            existing = _find_existing_export(db, Export.idempotency_key, idempotency_key)
+            if existing and json.loads(existing.metadata_json).get("pipeline") != _pipeline_version():
+                logger.info(f"Idempotency key {idempotency_key} matches an export of another pipeline, rebuilding")
+                existing = None
+            if existing:
+                logger.info(f"Idempotency key hit, returning export {existing.export_id}")
+                return _export_response(existing.export_id, json.loads(existing.warnings or "[]"))
+
         session_id = request.session_id
-        session_dir = UPLOAD_ROOT / session_id
-        
-        if not session_dir.exists():
-            raise HTTPException(status_code=404, detail="Session not found")
         
         # Load file index
-        index_path = session_dir / "index.json"
-        with open(index_path, "r", encoding="utf-8") as f:
-            index_data = json.load(f)
+        index_data = _load_session_index(session_id)
+        if index_data is None:
+            raise HTTPException(status_code=404, detail="Session not found")
         
         files = index_data["files"]
+        _record_access(SessionModel.session_id, SessionModel.last_accessed_at, [session_id])
+        _record_access(Blob.digest, Blob.last_used_at, [f["sha256"] for f in files if f.get("sha256")])
         
-        # Validate file order
-        file_order_warnings, file_order_errors = validate_file_order(request.order, files)
+        # Validate file order and page selections
+        order = _normalize_order(request.order)
+        file_order_warnings, file_order_errors = validate_file_order([entry.dict() for entry in order], files)
         if file_order_errors:
             raise HTTPException(status_code=400, detail=f"File order validation failed: {file_order_errors}")
         
@@ -207,104 +1474,245 @@ async def prepare_export(
         
         # Create file ID to file mapping
         id_to_file = {f["id"]: f for f in files}
-        
-        # Process files in parallel
-        export_id = str(uuid.uuid4())
-        temp_pdf_paths = []
-        
-        def process_file(file_id: str) -> str:
-            if file_id not in id_to_file:
-                raise ValueError(f"File ID {file_id} not found")
-            
-            file_info = id_to_file[file_id]
-            file_path = file_info["path"]
-            file_type = file_info["type"]
-            
-            if file_type == "pdf":
-                return file_path
-            elif file_type == "docx":
-                # Convert DOCX to PDF
-                pdf_path = convert_docx_to_pdf(file_path, str(session_dir))
-                return pdf_path
-            elif file_type == "image":
-                # Convert image to PDF
-                pdf_path = file_path + ".pdf"
-                convert_image_to_pdf(file_path, pdf_path)
-                return pdf_path
+
+        # Page counts learnt from earlier conversions (a draft, say) catch bad ranges before the build
+        _check_page_selections(order, id_to_file)
+
+        # Identical inputs, page selections, metadata and engine always produce the same export
+        content_hashes = []
+        for entry in order:
+            if entry.blank:
+                content_hashes.append({"blank": entry.blank})
+                continue
+            file_info = id_to_file[entry.file_id]
+            digest = file_info.get("sha256") or compute_file_digest(_input_path(file_info))
+            if entry.pages or entry.rotate % 360:
+                pages = entry.pages.replace(" ", "") if entry.pages else None
+                content_hashes.append({"sha256": digest, "pages": pages, "rotate": entry.rotate % 360})
             else:
-                raise ValueError(f"Unsupported file type: {file_type}")
-        
-        # Process files in parallel
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_file = {executor.submit(process_file, file_id): file_id for file_id in request.order}
-            
-            for future in as_completed(future_to_file):
-                try:
-                    pdf_path = future.result()
-                    temp_pdf_paths.append(pdf_path)
-                except Exception as e:
-                    logger.error(f"File processing failed: {str(e)}")
-                    raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
-        
-        # Merge PDFs
-        output_pdf = EXPORT_ROOT / f"export_{export_id}.pdf"
-        merge_pdfs(temp_pdf_paths, str(output_pdf))
-        
-        # Create metadata record
-        metadata_record = {
-            "export_id": export_id,
-            "session_id": session_id,
-            "metadata": request.metadata.dict(),
-            "files": [id_to_file[fid]["name"] for fid in request.order],
-            "warnings": all_warnings,
-            "created_at": str(uuid.uuid4())  # This should be datetime, but keeping simple for now
-        }
-        
-        # Save metadata
-        metadata_path = EXPORT_ROOT / f"export_{export_id}.json"
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            json.dump(metadata_record, f, ensure_ascii=False, indent=2)
-        
-        # Save to database
-        export_record = Export(
-            export_id=export_id,
-            session_id=session_id,
-            pdf_path=str(output_pdf),
-            metadata_json=json.dumps(metadata_record, ensure_ascii=False),
-            warnings=json.dumps(all_warnings, ensure_ascii=False) if all_warnings else None
-        )
-        db.add(export_record)
-        db.commit()
-        
-        logger.info(f"Export created successfully: {export_id}")
-        
-        return PrepareResponse(
-            export_id=export_id,
-            pdf_url=f"/api/download/{export_id}",
-            metadata_url=f"/api/metadata/{export_id}",
-            warnings=all_warnings
+                content_hashes.append(digest)
+        if request.draft:
+            finishing = _draft_finishing(request)
+            finishing_options = {"draft": _draft_settings()}
+        else:
+            finishing = _finishing_spec(request)
+            finishing_options = request.finishing.dict() if request.finishing else None
+        fingerprint = compute_export_fingerprint(
+            content_hashes,
+            request.metadata.dict(),
+            _pipeline_version(),
+            finishing_options
         )
+
+        existing = _find_existing_export(db, Export.fingerprint, fingerprint)
+        if existing:
+            logger.info(f"Fingerprint hit, returning export {existing.export_id}")
+            return _export_response(existing.export_id, all_warnings)
+        # Drafts have no Export row, so they are found through their pointer
+        draft_id = _find_recent_draft(fingerprint) if request.draft else None
+        if draft_id:
+            logger.info(f"Draft fingerprint hit, returning export {draft_id}")
+            return _export_response(draft_id, all_warnings)
+
+        if EXPORT_QUEUE == "database":
+            return await _prepare_queued(
+                request, http_request, faculty, fingerprint, idempotency_key, order, id_to_file, all_warnings, wait
+            )
+
+        # Attach to an identical export that is already running
+        entry = inflight_exports.get(fingerprint)
+        if entry is None:
+            # Only new builds cost anything, so only they are rate limited and admitted
+            prepare_limiter.check(_client_key(http_request))
+            tenant = _tenant_key(request.metadata.faculty, faculty)
+            export_admission.admit(tenant)
+            # _run_export releases the slot; until it exists, a failure has to
+            try:
+                export_id = str(uuid.uuid4())
+                token = CancelToken.with_timeout(EXPORT_TIMEOUT_SECONDS)
+                cost = _predict_export_cost(id_to_file, order, request.draft)
+                job = export_scheduler.submit(
+                    export_id, cost, _build_export, export_id, id_to_file, order, finishing, token, request.draft,
+                    tenant=tenant
+                )
+                logger.info(f"Export {export_id} queued for {tenant} with predicted cost {cost:.1f}s")
+                task = asyncio.create_task(_run_export(
+                    export_id, job, tenant, fingerprint, idempotency_key, request, order, id_to_file, all_warnings
+                ))
+            except Exception:
+                export_admission.release(tenant=tenant)
+                raise
+            entry = InflightExport(export_id, task, token, job)
+            inflight_exports[fingerprint] = entry
+            export_builds[export_id] = entry
+            while len(export_builds) > EXPORT_STATUS_HISTORY:
+                export_builds.popitem(last=False)
+            task.add_done_callback(lambda t: _forget_build(fingerprint, t))
+        else:
+            logger.info(f"Attaching to in-flight export {fingerprint[:12]}")
+
+        if not wait:
+            entry.detached = True
+            return _pending_response(entry, all_warnings)
+
+        return await _wait_for_export(entry, http_request)
         
+    except ConversionCancelled as e:
+        raise HTTPException(status_code=504, detail=f"Export cancelled: {str(e)}")
+    except (PageRangeError, FinishingError, ImageTooLargeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        logger.warning(f"Prepare rejected for {_client_key(http_request)}: {e.reason}")
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers=e.headers)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Prepare export error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _build_preview(file_info: dict, pages: Optional[str], rotate: int, token: CancelToken) -> bytes:
+    """Cut a page range out of a file's converted part"""
+    output = io.BytesIO()
+    if _fits_in_memory([file_info]):
+        pdf_engine.merge([MergePart(_load_part(file_info, token), pages=pages, rotate=rotate)], output)
+        return output.getvalue()
+
+    work_dir = WORK_ROOT / f"preview-{uuid.uuid4()}"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        pdf_path = _convert_part(file_info, work_dir, token)
+        pdf_engine.merge([MergePart(pdf_path, pages=pages, rotate=rotate)], output)
+        return output.getvalue()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+@app.get("/api/preview/{session_id}/{file_id}")
+async def preview_pages(
+    session_id: str,
+    file_id: str,
+    http_request: Request,
+    pages: Optional[str] = None,
+    rotate: int = 0,
+    faculty: Optional[str] = Header(default=None, alias="X-Faculty")
+):
+    """
+    Preview a page selection of an uploaded file as a small PDF.
+
+    Uses the cached converted part, so only the first preview of a DOCX or
+    image pays for a conversion.
+    """
+    try:
+        data = _load_session_index(session_id)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        file_info = next((f for f in data["files"] if f["id"] == file_id), None)
+        if file_info is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        _record_access(SessionModel.session_id, SessionModel.last_accessed_at, [session_id])
+        if file_info.get("sha256"):
+            _record_access(Blob.digest, Blob.last_used_at, [file_info["sha256"]])
+
+        _, errors = validate_file_order([{"file_id": file_id, "pages": pages, "rotate": rotate}], data["files"])
+        if errors:
+            raise HTTPException(status_code=400, detail=f"Invalid page selection: {errors}")
+
+        loop = asyncio.get_running_loop()
+        token = CancelToken.with_timeout(CONVERSION_TIMEOUT_SECONDS)
+        if _needs_conversion(file_info):
+            # A first preview converts the file, which costs as much as an export
+            prepare_limiter.check(_client_key(http_request))
+            tenant = _tenant_key(None, faculty)
+            export_admission.admit(tenant)
+            started = time.monotonic()
+            try:
+                job = export_scheduler.submit(
+                    f"preview-{file_id}", _conversion_cost(file_info), _build_preview, file_info, pages, rotate, token,
+                    tenant=tenant
+                )
+                content = await asyncio.wrap_future(job.future)
+            finally:
+                export_admission.release(time.monotonic() - started, tenant)
+        else:
+            content = await loop.run_in_executor(None, _build_preview, file_info, pages, rotate, token)
+
+        return Response(
+            content=content,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'inline; filename="preview_{file_id}.pdf"'}
+        )
+
+    except ConversionCancelled as e:
+        raise HTTPException(status_code=504, detail=f"Preview cancelled: {str(e)}")
+    except (PageRangeError, ImageTooLargeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers=e.headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Preview error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _queued_status(queued: QueuedJob) -> dict:
+    status = {
+        "export_id": queued.job_id,
+        "status": queued.state,
+        "stage": queued.stage,
+        "progress": round(queued.progress, 3),
+        "eta_seconds": round(job_queue.estimate(queued), 1),
+        "attempts": queued.attempts,
+    }
+    if queued.state == "failed":
+        status["error"] = queued.error
+    elif queued.state == "queued" and queued.attempts:
+        # Waiting out the backoff before its next try
+        status["retry_at"] = queued.available_at.isoformat() + "Z"
+        status["last_error"] = queued.error
+    return status
+
+@app.get("/api/status/{export_id}")
+async def export_status(export_id: str):
+    """Progress and ETA of an export started with wait=false"""
+    entry = export_builds.get(export_id)
+    if entry is None:
+        queued = job_queue.get(export_id)
+        if queued is not None:
+            return _queued_status(queued)
+        if storage.exists(_export_pdf_key(export_id)):
+            return {"export_id": export_id, "status": "completed", "progress": 1.0, "eta_seconds": 0.0}
+        raise HTTPException(status_code=404, detail="Export not found")
+
+    job = entry.job
+    status = {
+        "export_id": export_id,
+        "status": job.state,
+        "stage": job.stage,
+        "progress": round(job.progress, 3),
+        "eta_seconds": round(export_scheduler.estimate(job), 1),
+        "queue_position": export_scheduler.queue_position(job),
+    }
+    if entry.task.done():
+        error = None if entry.task.cancelled() else entry.task.exception()
+        if entry.task.cancelled() or error is not None:
+            status.update(status="failed", error=str(error) if error else "cancelled")
+        else:
+            status.update(status="completed", stage="completed", progress=1.0)
+    elif job.state == "completed":
+        # The PDF is stored, its metadata record is being written
+        status.update(status="running", stage="storing")
+    return status
+
 @app.get("/api/download/{export_id}")
 async def download_pdf(export_id: str):
     """Download the generated PDF"""
     try:
-        pdf_path = EXPORT_ROOT / f"export_{export_id}.pdf"
+        pdf_key = _export_pdf_key(export_id)
         
-        if not pdf_path.exists():
+        if not storage.exists(pdf_key):
             raise HTTPException(status_code=404, detail="Export not found")
         
-        return FileResponse(
-            path=str(pdf_path),
-            filename=f"export_{export_id}.pdf",
-            media_type="application/pdf"
-        )
+        return _stream_object(pdf_key, f"export_{export_id}.pdf", "application/pdf")
         
     except HTTPException:
         raise
@@ -312,20 +1720,41 @@ async def download_pdf(export_id: str):
         logger.error(f"Download error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/text/{export_id}")
+async def get_text(export_id: str, db: Session = Depends(get_session)):
+    """Get the extracted text of an export, pages separated by form feeds"""
+    try:
+        text_key = _export_text_key(export_id)
+
+        if not storage.exists(text_key):
+            export = db.exec(select(Export).where(Export.export_id == export_id)).first()
+            if export is not None and export.text_status == "pending":
+                return JSONResponse(status_code=202, content={"export_id": export_id, "text_status": "pending"})
+            raise HTTPException(status_code=404, detail="Text not found")
+
+        return StreamingResponse(
+            storage.iter_chunks(text_key),
+            media_type="text/plain; charset=utf-8",
+            headers={"Content-Disposition": f'inline; filename="export_{export_id}.txt"'}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Text error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/metadata/{export_id}")
 async def get_metadata(export_id: str):
     """Get metadata for an export"""
     try:
-        metadata_path = EXPORT_ROOT / f"export_{export_id}.json"
+        metadata_key = _export_metadata_key(export_id)
         
-        if not metadata_path.exists():
+        if not storage.exists(metadata_key):
             raise HTTPException(status_code=404, detail="Metadata not found")
         
-        return FileResponse(
-            path=str(metadata_path),
-            filename=f"export_{export_id}.json",
-            media_type="application/json"
-        )
+        _record_access(Export.export_id, Export.last_accessed_at, [export_id])
+        return _stream_object(metadata_key, f"export_{export_id}.json", "application/json")
         
     except HTTPException:
         raise
@@ -333,6 +1762,216 @@ async def get_metadata(export_id: str):
         logger.error(f"Metadata error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/exports", response_model=ExportSearchResponse, dependencies=[Depends(_require_admin)])
+async def list_exports(
+    q: Optional[str] = None,
+    faculty: Optional[str] = None,
+    year: Optional[int] = None,
+    form: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    fulltext: Optional[str] = None,
+    db: Session = Depends(get_session)
+):
+    """
+    Search the export catalogue, newest first.
+
+    q matches words (as prefixes) in title, author and supervisor, fulltext
+    in the extracted text of the work; faculty, year and form filter
+    exactly. Pass next_cursor back as cursor for the next page.
+    """
+    try:
+        last_id = int(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    exports, next_id = search_exports(db, q, faculty, year, form, last_id, limit, fulltext)
+    return ExportSearchResponse(
+        exports=[
+            ExportSummary(
+                export_id=export.export_id,
+                title=export.title,
+                author=export.author,
+                supervisor=export.supervisor,
+                year=export.year,
+                faculty=export.faculty,
+                form=export.form,
+                created_at=export.created_at,
+                pdf_url=f"/api/download/{export.export_id}",
+                metadata_url=f"/api/metadata/{export.export_id}",
+                text_url=f"/api/text/{export.export_id}" if export.text_status == "ready" else None
+            )
+            for export in exports
+        ],
+        next_cursor=str(next_id) if next_id is not None else None
+    )
+
+@app.get("/api/stats")
+async def get_stats(db: Session = Depends(get_session)):
+    """Load and admission statistics"""
+    return {
+        "exports": export_admission.stats(),
+        "inflight_fingerprints": len(inflight_exports),
+        "cancellation": get_cancellation_stats(),
+        "scheduler": export_scheduler.stats(),
+        "job_queue": job_queue.stats() if EXPORT_QUEUE == "database" else None,
+        "cost_model": cost_model.stats(),
+        "tiering": get_tiering_stats(db),
+        "similarity": get_similarity_stats(db),
+        "memory": gauges(),
+        "pdf_engine": pdf_engine.version(),
+        "image_optimization": get_image_optimization_stats(),
+        "docx_media": get_docx_media_stats()
+    }
+
+@app.get("/api/admin/tenants", dependencies=[Depends(_require_admin)])
+async def list_tenants(db: Session = Depends(get_session)):
+    """Per-faculty queue statistics and operator-set priorities"""
+    return {
+        "tenants": export_scheduler.tenant_stats(),
+        "priorities": [priority.dict() for priority in db.exec(select(TenantPriority)).all()]
+    }
+
+@app.put("/api/admin/tenants/{tenant}", dependencies=[Depends(_require_admin)])
+async def set_tenant_priority(tenant: str, request: TenantPriorityRequest, db: Session = Depends(get_session)):
+    """Set a faculty's weight, a temporary boost or a deadline"""
+    tenant = _tenant_key(tenant)
+    if (request.weight is not None and request.weight <= 0) or (request.boost is not None and request.boost <= 0):
+        raise HTTPException(status_code=400, detail="Weight and boost must be positive")
+
+    priority = db.exec(select(TenantPriority).where(TenantPriority.tenant == tenant)).first()
+    if priority is None:
+        priority = TenantPriority(tenant=tenant, weight=tenant_weights.get(tenant, 1.0))
+    if request.weight is not None:
+        priority.weight = request.weight
+    if request.boost is not None:
+        priority.boost = request.boost
+    if request.boost_hours is not None:
+        priority.boost_until = datetime.utcnow() + timedelta(hours=request.boost_hours)
+    if request.deadline is not None:
+        deadline = request.deadline
+        if deadline.tzinfo is not None:
+            deadline = deadline.astimezone(timezone.utc).replace(tzinfo=None)
+        priority.deadline = deadline
+    priority.updated_at = datetime.utcnow()
+    db.add(priority)
+    db.commit()
+    db.refresh(priority)
+
+    _apply_tenant_priority(priority)
+    logger.info(f"Tenant priority set for {tenant}: weight={priority.weight} boost={priority.boost} "
+                f"until={priority.boost_until} deadline={priority.deadline}")
+    return priority.dict()
+
+@app.delete("/api/admin/tenants/{tenant}", dependencies=[Depends(_require_admin)])
+async def reset_tenant_priority(tenant: str, db: Session = Depends(get_session)):
+    """Drop a faculty's operator-set priority, back to its configured weight"""
+    tenant = _tenant_key(tenant)
+    priority = db.exec(select(TenantPriority).where(TenantPriority.tenant == tenant)).first()
+    if priority is None:
+        raise HTTPException(status_code=404, detail="No priority set for this tenant")
+    db.delete(priority)
+    db.commit()
+
+    if tenant in tenant_weights:
+        export_scheduler.set_policy(tenant, TenantPolicy(weight=tenant_weights[tenant]))
+    else:
+        export_scheduler.clear_policy(tenant)
+    return {"tenant": tenant, "reset": True}
+
+def _run_tiering() -> Dict[str, int]:
+    """Compress uploads and metadata that have gone cold"""
+    cutoff = datetime.utcnow() - timedelta(days=config.TIERING_AFTER_DAYS)
+    with Session(engine) as db:
+        forget_restored(storage, db)
+        cold_digests = set(db.exec(select(Blob.digest).where(Blob.last_used_at < cutoff)).all())
+
+        # DOCX and image uploads compress; PDFs already are, so they stay as they are
+        keys = []
+        links = []
+        # Sessions and exports go by their last access; rows from before it was recorded by creation
+        session_accessed = func.coalesce(SessionModel.last_accessed_at, SessionModel.created_at)
+        for session in db.exec(select(SessionModel).where(session_accessed < cutoff)).all():
+            index_key = _session_index_key(session.session_id)
+            index = _load_session_index(session.session_id)
+            if index is None:
+                continue
+            keys.append(index_key)
+            for record in index.get("files", []):
+                if record.get("type") in ("docx", "image") and record.get("key") and record.get("sha256") in cold_digests:
+                    keys.append(record["key"])
+                    links.append((record["key"], f"uploads/{session.session_id}/{Path(record['name']).name}"))
+        export_accessed = func.coalesce(Export.last_accessed_at, Export.created_at)
+        for export in db.exec(select(Export).where(export_accessed < cutoff)).all():
+            keys.append(_export_metadata_key(export.export_id))
+
+        result = tier_objects(storage, db, keys, config.TIERING_CODEC or None, config.TIERING_BATCH)
+
+    # A session's hardlink would keep the raw bytes of a compressed blob on disk
+    for blob_key, link_key in links:
+        if storage.inner.exists(link_key) and storage.is_cold(blob_key):
+            storage.inner.delete(link_key)
+    return result
+
+async def _tiering_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, _run_tiering)
+        except Exception as e:
+            logger.error(f"Tiering failed: {str(e)}")
+        await asyncio.sleep(config.TIERING_INTERVAL_HOURS * 3600)
+
+@app.post("/api/admin/tiering", dependencies=[Depends(_require_admin)])
+async def run_tiering():
+    """Run the tiering job now"""
+    return await asyncio.get_running_loop().run_in_executor(None, _run_tiering)
+
+@app.get("/api/admin/memory", dependencies=[Depends(_require_admin)])
+async def memory_overview():
+    """RSS, open descriptors, child processes and memory growth per route and kind of work"""
+    return {
+        "gauges": gauges(),
+        "tracing": memory_snapshots.tracing,
+        "snapshots": memory_snapshots.names(),
+        "deltas": memory_recorder.stats(),
+    }
+
+@app.post("/api/admin/memory/snapshots/{name}", dependencies=[Depends(_require_admin)])
+async def take_memory_snapshot(name: str):
+    """
+    Take a named tracemalloc snapshot, grouped by module.
+
+    The first snapshot starts tracing, which slows the server down until
+    DELETE /api/admin/memory/snapshots stops it.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, memory_snapshots.take, name)
+
+@app.get("/api/admin/memory/diff", dependencies=[Depends(_require_admin)])
+async def diff_memory_snapshots(before: str, after: Optional[str] = None):
+    """Memory growth from snapshot before to snapshot after (a fresh one if omitted), by module"""
+    loop = asyncio.get_running_loop()
+    old = memory_snapshots.get(before)
+    if old is None:
+        raise HTTPException(status_code=404, detail=f"Snapshot not found: {before}")
+    if after is None:
+        after = "latest"
+        await loop.run_in_executor(None, memory_snapshots.take, after)
+    new = memory_snapshots.get(after)
+    if new is None:
+        raise HTTPException(status_code=404, detail=f"Snapshot not found: {after}")
+    return {
+        "before": before,
+        "after": after,
+        "modules": await loop.run_in_executor(None, memory_snapshots.diff, old, new),
+    }
+
+@app.delete("/api/admin/memory/snapshots", dependencies=[Depends(_require_admin)])
+async def stop_memory_tracing():
+    """Stop tracemalloc and drop all snapshots"""
+    memory_snapshots.stop()
+    return {"tracing": False}
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -351,3 +1990,63 @@ async def health_check():
         "service": "vkr-export-api",
         "version": "1.0.0"
     }
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 while this replica shouldn't be sent new work.
+
+    Checks the export queue and its predicted backlog, event loop lag, free
+    disk and memory, and that the database answers. /health stays a plain
+    liveness probe.
+    """
+    if EXPORT_QUEUE == "database":
+        # Exports are built by the workers; their shared queue is what this replica would add to
+        scheduler = await asyncio.get_running_loop().run_in_executor(None, job_queue.stats)
+        # Worker capacity isn't known here; the jobs running now are its best measure
+        parallelism = max(scheduler["running"], 1)
+    else:
+        scheduler = export_scheduler.stats()
+        parallelism = export_scheduler.workers
+    backlog = (scheduler["queued_cost_seconds"] + scheduler["running_remaining_seconds"]) / parallelism
+    lag_ms = loop_lag.lag * 1000
+    free_disk = free_disk_bytes(DATA_ROOT)
+    free_memory = get_available_memory_bytes()
+    try:
+        db_ok = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(None, ping_database, engine),
+            READY_DB_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        db_ok = False
+
+    checks = {
+        "queue_depth": check(scheduler["queued"], READY_MAX_QUEUED, scheduler["queued"] < READY_MAX_QUEUED),
+        "backlog_seconds": check(round(backlog, 1), READY_MAX_BACKLOG_SECONDS, backlog <= READY_MAX_BACKLOG_SECONDS),
+        "loop_lag_ms": check(round(lag_ms, 1), READY_MAX_LOOP_LAG_MS, lag_ms <= READY_MAX_LOOP_LAG_MS),
+        "free_disk_mb": check(
+            free_disk // (1024 * 1024) if free_disk is not None else None,
+            READY_MIN_FREE_DISK_MB,
+            free_disk is None or free_disk >= READY_MIN_FREE_DISK_MB * 1024 * 1024
+        ),
+        "free_memory_mb": check(
+            free_memory // (1024 * 1024) if free_memory is not None else None,
+            MIN_FREE_MEMORY_MB,
+            free_memory is None or free_memory >= MIN_FREE_MEMORY_MB * 1024 * 1024
+        ),
+        "database": check(db_ok, True, db_ok),
+    }
+    ready = all(result["ok"] for result in checks.values())
+    body = {
+        "status": "ready" if ready else "not ready",
+        "pool": {
+            "workers": scheduler["workers"],
+            "running": scheduler["running"],
+            "saturation": round(scheduler["running"] / scheduler["workers"], 2) if EXPORT_QUEUE != "database" else None,
+        },
+        "checks": checks,
+    }
+    if not ready:
+        failing = [name for name, result in checks.items() if not result["ok"]]
+        logger.warning(f"Not ready: {', '.join(failing)}")
+    return JSONResponse(status_code=200 if ready else 503, content=body)
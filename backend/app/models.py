@@ -1,5 +1,6 @@
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 from enum import Enum
 
@@ -29,16 +30,126 @@ class Session(SQLModel, table=True):
     session_id: str = Field(unique=True, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Read by tiering; NULL for sessions created before it was recorded
+    last_accessed_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
     status: ProcessingStatus = Field(default=ProcessingStatus.PENDING)
 
 class Export(SQLModel, table=True):
+    # Catalogue filters, newest first: WHERE faculty = ? AND year = ? AND id < ? ORDER BY id DESC
+    __table_args__ = (
+        Index("ix_export_faculty_year_id", "faculty", "year", "id"),
+        Index("ix_export_year_id", "year", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     export_id: str = Field(unique=True, index=True)
     session_id: str
     pdf_path: str
     metadata_json: str
     warnings: Optional[str] = None
+    fingerprint: Optional[str] = Field(default=None, index=True)
+    idempotency_key: Optional[str] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Read by tiering; NULL for exports created before it was recorded
+    last_accessed_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    # MetadataRequest fields, copied out of metadata_json for search
+    title: Optional[str] = None
+    author: Optional[str] = None
+    supervisor: Optional[str] = None
+    year: Optional[int] = None
+    faculty: Optional[str] = None
+    form: Optional[str] = Field(default=None, index=True)
+    text_status: Optional[str] = None  # pending, ready or failed
+
+class Blob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    digest: str = Field(unique=True, index=True)
+    size: int
+    ref_count: int = Field(default=0)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ConversionStat(SQLModel, table=True):
+    """One observed conversion or merge, used to fit the cost model"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(index=True)  # docx, image, pdf or merge
+    size_mb: float
+    pages: float = 0
+    media_mb: float = 0
+    duration_seconds: float
+    predicted_seconds: Optional[float] = None
+    # Process RSS and peak RSS growth while it ran (other work overlaps)
+    rss_delta_mb: Optional[float] = None
+    peak_delta_mb: Optional[float] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TieredObject(SQLModel, table=True):
+    """A storage object moved to the compressed tier"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(unique=True, index=True)
+    codec: str  # zstd or gzip, or none if compression didn't pay off
+    raw_size: int
+    stored_size: int
+    tiered_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TextSignature(SQLModel, table=True):
+    """MinHash signature of the text of an export, for near-duplicate checks"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    export_id: str = Field(unique=True, index=True)
+    session_id: str
+    shingles: int
+    signature: bytes
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LshBand(SQLModel, table=True):
+    """LSH bucket of one band of a TextSignature"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: int = Field(index=True)  # band number in the top bits, bucket hash below
+    signature_id: int
+
+class TenantPriority(SQLModel, table=True):
+    """Operator-set scheduling weight and boosts of a tenant (faculty)"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tenant: str = Field(unique=True, index=True)
+    weight: float = 1.0
+    boost: float = 1.0
+    boost_until: Optional[datetime] = None  # UTC
+    deadline: Optional[datetime] = None  # UTC; the tenant is boosted in the window before it
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class QueuedJob(SQLModel, table=True):
+    """A durable export job, claimed and run by a worker process (python -m app.worker)"""
+    # Claims scan available jobs: WHERE state = 'queued' AND available_at <= ?
+    # At most one queued or running job per fingerprint, across every replica
+    __table_args__ = (
+        Index("ix_queuedjob_state_available", "state", "available_at"),
+        Index(
+            "ux_queuedjob_active_fingerprint", "fingerprint", unique=True,
+            sqlite_where=text("state IN ('queued', 'running')"),
+            postgresql_where=text("state IN ('queued', 'running')"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(unique=True, index=True)  # the export ID
+    kind: str = "export"
+    tenant: str
+    fingerprint: Optional[str] = Field(default=None, index=True)
+    payload: str  # JSON arguments of the job
+    cost: float = 0.0  # predicted seconds
+    state: str = "queued"  # queued, running, completed or failed
+    attempts: int = 0
+    max_attempts: int = 3
+    available_at: datetime = Field(default_factory=datetime.utcnow)  # UTC; later while backing off
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None  # UTC
+    stage: Optional[str] = None
+    progress: float = 0.0
+    result: Optional[str] = None  # JSON PrepareResponse, or the HTTP status of a failure
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 class MetadataRequest(SQLModel):
     title: str
@@ -48,10 +159,56 @@ class MetadataRequest(SQLModel):
     faculty: Optional[str] = None
     form: Optional[str] = None
 
+class PageSelection(SQLModel):
+    """An order entry: pages of an uploaded file, or inserted blank pages"""
+    file_id: Optional[str] = None
+    pages: Optional[str] = None  # 1-based ranges, e.g. "3-7" or "1,4,10-"; all pages if omitted
+    rotate: int = 0  # clockwise degrees, a multiple of 90
+    blank: int = 0  # number of blank pages to insert instead of a file
+
+class PageLabelRange(SQLModel):
+    start_page: int = 1  # 1-based page where the range begins
+    style: str = "decimal"  # decimal, roman, Roman, letters, Letters or none
+    prefix: Optional[str] = None
+    first: int = 1
+
+class FinishingOptions(SQLModel):
+    """Stamps and page labels applied while the export is written"""
+    page_numbers: bool = False
+    first_numbered_page: int = 2  # the title page is counted but not numbered
+    footer: Optional[str] = None  # may use {title}, {author}, {supervisor}, {year}, {faculty}, {form}
+    page_labels: List[PageLabelRange] = []
+
 class PrepareRequest(SQLModel):
     session_id: str
-    order: List[str]
+    order: List[Union[str, PageSelection]]
     metadata: MetadataRequest
+    finishing: Optional[FinishingOptions] = None
+    # Quick low-resolution preview: watermarked, no stamps, not catalogued
+    draft: bool = False
+
+class TenantPriorityRequest(SQLModel):
+    weight: Optional[float] = None
+    boost: Optional[float] = None  # weight factor for boost_hours
+    boost_hours: Optional[float] = None
+    deadline: Optional[datetime] = None
+
+class ExportSummary(SQLModel):
+    export_id: str
+    title: Optional[str] = None
+    author: Optional[str] = None
+    supervisor: Optional[str] = None
+    year: Optional[int] = None
+    faculty: Optional[str] = None
+    form: Optional[str] = None
+    created_at: datetime
+    pdf_url: str
+    metadata_url: str
+    text_url: Optional[str] = None
+
+class ExportSearchResponse(SQLModel):
+    exports: List[ExportSummary]
+    next_cursor: Optional[str] = None  # pass as cursor for the next page
 
 class UploadResponse(SQLModel):
     session_id: str
@@ -62,4 +219,7 @@ class PrepareResponse(SQLModel):
     pdf_url: str
     metadata_url: str
     warnings: List[str] = []
+    status: str = "completed"  # queued, running or completed
+    eta_seconds: Optional[float] = None
+    status_url: Optional[str] = None
 
@@ -0,0 +1,223 @@
+"""
+Conformance checks and benchmark for the PDF engines
+
+    python -m app.pdfbench check
+    python -m app.pdfbench bench --documents 20 --pages 50 --runs 3
+
+check runs the same merges through every installed engine and verifies
+the results with pypdf; it exits non-zero if any engine fails a check.
+bench times merges of generated documents and prints one line per engine.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from typing import Callable, List, Tuple
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from .services.finishing import FinishingSpec
+from .services.memory import MemoryProbe
+from .services.merger import MergePart, PageRangeError
+from .services.pdfengine import PdfEngine, available_engines
+
+def make_document(path: str, name: str, pages: int, size: Tuple[float, float] = (595, 842), filler: int = 0) -> str:
+    """
+    A text PDF whose page i reads "<name>-p<i>", with a bookmark and a named destination per page
+
+    Args:
+        filler: Extra lines of text per page, to give the benchmark some content to copy
+    """
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for i in range(1, pages + 1):
+        page = writer.add_blank_page(*size)
+        lines = [f"({name}-p{i}) Tj"] + [f"T* (filler line {n} of page {i} of {name}) Tj" for n in range(filler)]
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 14 TL 40 {size[1] - 60} Td {' '.join(lines)} ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        writer.add_outline_item(f"{name} page {i}", i - 1)
+        writer.add_named_destination(f"{name}-{i}", i - 1)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+def _markers(data: bytes) -> List[str]:
+    reader = PdfReader(io.BytesIO(data))
+    return [(page.extract_text() or "").split("\n")[0].strip() for page in reader.pages]
+
+def _merge(engine: PdfEngine, parts, **kwargs) -> bytes:
+    out = io.BytesIO()
+    engine.merge(parts, out, **kwargs)
+    return out.getvalue()
+
+def conformance_checks(work_dir: str) -> List[Tuple[str, Callable[[PdfEngine], None]]]:
+    """Named checks, each taking an engine and raising AssertionError on a mismatch"""
+    a = make_document(os.path.join(work_dir, "a.pdf"), "a", 3)
+    b = make_document(os.path.join(work_dir, "b.pdf"), "b", 4)
+    landscape = make_document(os.path.join(work_dir, "c.pdf"), "c", 1, size=(842, 595))
+
+    def whole_documents(engine):
+        assert _markers(_merge(engine, [a, b])) == ["a-p1", "a-p2", "a-p3", "b-p1", "b-p2", "b-p3", "b-p4"]
+
+    def page_selection(engine):
+        data = _merge(engine, [MergePart(b, pages="3-4,1"), MergePart(a, pages="2")])
+        assert _markers(data) == ["b-p3", "b-p4", "b-p1", "a-p2"]
+
+    def repeated_pages(engine):
+        assert _markers(_merge(engine, [MergePart(a, pages="1,1"), MergePart(a, pages="1")])) == ["a-p1"] * 3
+
+    def rotation(engine):
+        once = _merge(engine, [MergePart(a, pages="1", rotate=90)])
+        twice = _merge(engine, [MergePart(once, rotate=270)])
+        assert [page.rotation for page in PdfReader(io.BytesIO(once)).pages] == [90]
+        assert [page.rotation for page in PdfReader(io.BytesIO(twice)).pages] == [0]
+
+    def blank_pages(engine):
+        reader = PdfReader(io.BytesIO(_merge(engine, [landscape, MergePart(blank=2), a])))
+        assert len(reader.pages) == 6
+        sizes = [(round(float(p.mediabox.width)), round(float(p.mediabox.height))) for p in reader.pages[:3]]
+        assert sizes == [(842, 595)] * 3, sizes
+
+    def leading_blank_page(engine):
+        reader = PdfReader(io.BytesIO(_merge(engine, [MergePart(blank=1), a])))
+        box = reader.pages[0].mediabox
+        assert (round(float(box.width)), round(float(box.height))) == (595, 842)
+
+    def bad_page_range(engine):
+        try:
+            _merge(engine, [MergePart(a, pages="2-9")])
+        except PageRangeError:
+            return
+        raise AssertionError("no PageRangeError for a range past the last page")
+
+    def missing_input(engine):
+        assert _markers(_merge(engine, [os.path.join(work_dir, "missing.pdf"), a])) == ["a-p1", "a-p2", "a-p3"]
+
+    def bytes_input_and_file_output(engine):
+        with open(a, "rb") as f:
+            data = f.read()
+        out_path = os.path.join(work_dir, "out", f"{engine.name}.pdf")
+        assert engine.merge([data, MergePart(b, pages="4")], out_path) == out_path
+        with open(out_path, "rb") as f:
+            assert _markers(f.read()) == ["a-p1", "a-p2", "a-p3", "b-p4"]
+
+    def outlines(engine):
+        # Links to a page go to its first copy, even one from an earlier partial selection
+        reader = PdfReader(io.BytesIO(_merge(engine, [a, MergePart(b, pages="1"), b])))
+        titles = [(item.title, reader.get_destination_page_number(item)) for item in reader.outline]
+        assert titles == [
+            ("a page 1", 0), ("a page 2", 1), ("a page 3", 2),
+            ("b page 1", 3), ("b page 2", 5), ("b page 3", 6), ("b page 4", 7),
+        ], titles
+
+    def named_destinations(engine):
+        reader = PdfReader(io.BytesIO(_merge(engine, [a, b])))
+        dests = {name: reader.get_destination_page_number(dest) for name, dest in reader.named_destinations.items()}
+        assert dests.get("a-2") == 1 and dests.get("b-4") == 6, dests
+
+    def finishing(engine):
+        spec = FinishingSpec(
+            metadata={"title": "Выпускная работа", "author": "Иванов И. И.", "year": 2024},
+            page_numbers=True,
+            first_numbered_page=2,
+            page_labels=[{"start_page": 1, "style": "roman"}, {"start_page": 3, "style": "decimal"}],
+        )
+        reader = PdfReader(io.BytesIO(_merge(engine, [a, MergePart(blank=1)], finishing=spec)))
+        assert reader.metadata.title == "Выпускная работа"
+        assert reader.metadata.author == "Иванов И. И."
+        assert reader.xmp_metadata is not None
+        assert list(reader.page_labels) == ["i", "ii", "1", "2"], list(reader.page_labels)
+        texts = [page.extract_text() for page in reader.pages]
+        assert "1" not in texts[0].replace("a-p1", "")
+        assert texts[1].rstrip().endswith("2") and texts[3].strip() == "4", texts
+
+    def watermark_and_footer(engine):
+        spec = FinishingSpec(footer="Москва 2024", watermark="ЧЕРНОВИК")
+        reader = PdfReader(io.BytesIO(_merge(engine, [MergePart(a, rotate=90), MergePart(blank=1)], finishing=spec)))
+        for page in reader.pages:
+            xobjects = page["/Resources"]["/XObject"]
+            assert "/StampWatermark" in xobjects and "/StampFooter" in xobjects, list(xobjects)
+            assert b"/StampWatermark Do" in page.get_contents().get_data()
+
+    def page_count_and_validate(engine):
+        garbage = os.path.join(work_dir, "garbage.pdf")
+        with open(garbage, "wb") as f:
+            f.write(b"%PDF-1.4\nnot really a pdf")
+        assert engine.page_count(b) == 4
+        assert engine.validate(a) and not engine.validate(garbage)
+
+    return [(check.__name__, check) for check in (
+        whole_documents, page_selection, repeated_pages, rotation, blank_pages, leading_blank_page,
+        bad_page_range, missing_input, bytes_input_and_file_output, outlines, named_destinations,
+        finishing, watermark_and_footer, page_count_and_validate,
+    )]
+
+def run_checks() -> int:
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="pdfbench-") as work_dir:
+        checks = conformance_checks(work_dir)
+        for engine in available_engines():
+            print(f"{engine.name} ({engine.version()})")
+            for name, check in checks:
+                try:
+                    check(engine)
+                    print(f"  ok    {name}")
+                except Exception as e:
+                    failures += 1
+                    print(f"  FAIL  {name}: {type(e).__name__}: {e}")
+    return 1 if failures else 0
+
+def run_benchmark(documents: int, pages: int, runs: int) -> int:
+    with tempfile.TemporaryDirectory(prefix="pdfbench-") as work_dir:
+        inputs = [
+            make_document(os.path.join(work_dir, f"doc{i}.pdf"), f"doc{i}", pages, filler=40)
+            for i in range(documents)
+        ]
+        input_mb = sum(os.path.getsize(path) for path in inputs) / (1024 * 1024)
+        finishing = FinishingSpec(metadata={"title": "Benchmark"}, page_numbers=True)
+        print(f"{documents} documents x {pages} pages, {input_mb:.1f} MB in, {runs} runs")
+        print(f"{'engine':10} {'median s':>9} {'pages/s':>9} {'out MB':>8} {'peak +MB':>9}")
+        for engine in available_engines():
+            timings = []
+            peak = 0.0
+            out_path = os.path.join(work_dir, f"out-{engine.name}.pdf")
+            for _ in range(runs):
+                probe = MemoryProbe()
+                started = time.perf_counter()
+                engine.merge(inputs, out_path, finishing=finishing)
+                timings.append(time.perf_counter() - started)
+                peak = max(peak, probe.deltas()["peak_delta_mb"] or 0.0)
+            median = statistics.median(timings)
+            print(
+                f"{engine.name:10} {median:9.3f} {documents * pages / median:9.0f} "
+                f"{os.path.getsize(out_path) / (1024 * 1024):8.1f} {peak:9.1f}"
+            )
+    return 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.pdfbench", description="PDF engine conformance and benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("check", help="Run the conformance checks against every installed engine")
+    bench = commands.add_parser("bench", help="Time merges with every installed engine")
+    bench.add_argument("--documents", type=int, default=20)
+    bench.add_argument("--pages", type=int, default=50)
+    bench.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+    if args.command == "check":
+        return run_checks()
+    return run_benchmark(args.documents, args.pages, args.runs)
+
+if __name__ == "__main__":
+    sys.exit(main())
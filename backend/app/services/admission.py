@@ -0,0 +1,217 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being admitted"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, int(round(self.retry_after))))}
+
+def get_available_memory_bytes() -> Optional[int]:
+    """
+    Estimate memory still available to this container
+
+    Uses the cgroup v2 limit when one is set, otherwise MemAvailable from
+    /proc/meminfo. Returns None when neither can be read.
+    """
+    available = None
+
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current", "r") as f:
+                current = int(f.read().strip())
+            cgroup_available = int(limit) - current
+            available = cgroup_available if available is None else min(available, cgroup_available)
+    except (OSError, ValueError):
+        pass
+
+    return available
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount: float) -> float:
+        """
+        Take tokens from the bucket
+
+        Args:
+            amount: Number of tokens (capped at the bucket capacity)
+
+        Returns:
+            0 if the tokens were taken, otherwise seconds until they will be available
+        """
+        amount = min(amount, self.capacity)
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+class ClientRateLimiter:
+    """Per-client token buckets with a bounded number of tracked clients"""
+
+    def __init__(self, rate: float, capacity: float, max_clients: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client: str, amount: float = 1.0) -> None:
+        """
+        Charge a client and reject with 429 if its bucket is empty
+
+        Raises:
+            AdmissionRejected: If the client exceeded its rate
+        """
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[client] = bucket
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            wait = bucket.try_consume(amount)
+
+        if wait > 0:
+            raise AdmissionRejected(429, "Rate limit exceeded", wait)
+
+class AdmissionController:
+    """
+    Bounds the number of heavy jobs in the system.
+
+    A job is admitted while fewer than max_active + max_queued jobs are in
+    flight, its tenant holds fewer than max_per_tenant of them and the
+    container has at least min_free_memory bytes left. Otherwise it is
+    rejected with a Retry-After derived from the observed job duration and
+    the current backlog.
+    """
+
+    def __init__(
+        self,
+        max_active: int,
+        max_queued: int,
+        min_free_memory: int = 0,
+        max_per_tenant: Optional[int] = None
+    ):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.min_free_memory = min_free_memory
+        self.max_per_tenant = max_per_tenant
+        self.in_flight = 0
+        self.tenant_in_flight: Dict[str, int] = {}
+        self.avg_duration = 10.0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_active)
+
+    def _retry_after(self) -> float:
+        # Time for the current backlog to drain through the active slots
+        backlog = self.in_flight + 1
+        return min(300.0, max(1.0, self.avg_duration * backlog / self.max_active))
+
+    def check_memory(self) -> None:
+        """
+        Reject if the container is below its memory headroom
+
+        Raises:
+            AdmissionRejected: If available memory is below min_free_memory
+        """
+        if not self.min_free_memory:
+            return
+        available = get_available_memory_bytes()
+        if available is not None and available < self.min_free_memory:
+            self.rejected += 1
+            logger.warning(f"Shedding work: only {available // (1024 * 1024)}MB memory available")
+            raise AdmissionRejected(503, "Server is low on memory", self._retry_after())
+
+    def admit(self, tenant: Optional[str] = None) -> None:
+        """
+        Reserve a slot for a heavy job
+
+        Args:
+            tenant: Tenant the job belongs to, if slots are capped per tenant
+
+        Raises:
+            AdmissionRejected: If the server or the tenant's share of it is saturated
+        """
+        with self._lock:
+            if self.in_flight >= self.max_active + self.max_queued:
+                self.rejected += 1
+                raise AdmissionRejected(503, "Server is busy, export queue is full", self._retry_after())
+
+            held = self.tenant_in_flight.get(tenant, 0) if tenant is not None else 0
+            if self.max_per_tenant and held >= self.max_per_tenant:
+                self.rejected += 1
+                raise AdmissionRejected(503, "Too many exports in flight for this faculty", self._retry_after())
+
+            self.check_memory()
+
+            self.in_flight += 1
+            self.admitted += 1
+            if tenant is not None:
+                self.tenant_in_flight[tenant] = held + 1
+
+    def release(self, duration: Optional[float] = None, tenant: Optional[str] = None) -> None:
+        """Free a slot, folding the job duration into the running average"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if tenant is not None:
+                held = self.tenant_in_flight.get(tenant, 0) - 1
+                if held > 0:
+                    self.tenant_in_flight[tenant] = held
+                else:
+                    self.tenant_in_flight.pop(tenant, None)
+            if duration is not None:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "active_limit": self.max_active,
+            "queue_depth": self.queue_depth,
+            "queue_limit": self.max_queued,
+            "tenant_limit": self.max_per_tenant,
+            "avg_duration_seconds": round(self.avg_duration, 2),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,282 @@
+import os
+import hashlib
+import logging
+from datetime import datetime
+from typing import Tuple, List, Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from ..models import Blob
+from .storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+class BlobStoreError(Exception):
+    """Custom exception for blob store errors"""
+    pass
+
+def compute_digest(content: bytes) -> str:
+    """
+    Compute the content hash used as a blob key
+
+    Args:
+        content: Raw file content
+
+    Returns:
+        Hex-encoded SHA-256 digest
+    """
+    return hashlib.sha256(content).hexdigest()
+
+def compute_file_digest(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Compute the content hash of a file without loading it into memory
+
+    Args:
+        file_path: Path to the file
+        chunk_size: Read chunk size in bytes
+
+    Returns:
+        Hex-encoded SHA-256 digest
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded files.
+
+    Blobs live under ``blobs/<aa>/<bb>/<digest>`` in the storage backend and
+    are shared between sessions. On local storage a session also gets a
+    hardlink to each of its blobs; on object storage it references them by
+    key. The ``Blob`` table keeps a reference count per digest so
+    unreferenced blobs can be garbage-collected.
+
+    A reference is committed before its blob is written, and the collector
+    deletes a row (only while it is still unreferenced) and its files in one
+    transaction. Either an upload's reference lands first and the blob is
+    kept, or the collector finishes first and the upload writes the blob
+    again, so a deduplicated upload never loses its blob to a concurrent
+    collection.
+    """
+
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+
+    @staticmethod
+    def key_for(digest: str) -> str:
+        """Return the sharded storage key of a blob"""
+        return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def exists(self, digest: str) -> bool:
+        return self.storage.exists(self.key_for(digest))
+
+    def put_bytes(self, content: bytes, digest: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Store content in the blob store unless it is already present
+
+        Args:
+            content: Raw file content
+            digest: Digest of the content, if already computed
+
+        Returns:
+            Tuple of (digest, created) where created is False for a dedup hit
+        """
+        digest = digest or compute_digest(content)
+        key = self.key_for(digest)
+
+        if self.storage.exists(key):
+            logger.info(f"Blob already stored, skipping write: {digest}")
+            return digest, False
+
+        try:
+            self.storage.put_bytes(key, content)
+        except Exception as e:
+            raise BlobStoreError(f"Failed to store blob {digest}: {str(e)}")
+
+        logger.info(f"Stored new blob: {digest} ({len(content)} bytes)")
+        return digest, True
+
+    def put_file(self, file_path: str, digest: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Store a file in the blob store unless its content is already present
+
+        Args:
+            file_path: Path to the file
+            digest: Digest of the content, if already computed
+
+        Returns:
+            Tuple of (digest, created) where created is False for a dedup hit
+        """
+        digest = digest or compute_file_digest(file_path)
+        key = self.key_for(digest)
+
+        if self.storage.exists(key):
+            logger.info(f"Blob already stored, skipping write: {digest}")
+            return digest, False
+
+        try:
+            self.storage.put_file(key, file_path)
+        except Exception as e:
+            raise BlobStoreError(f"Failed to store blob {digest}: {str(e)}")
+
+        logger.info(f"Stored new blob: {digest} ({os.path.getsize(file_path)} bytes)")
+        return digest, True
+
+    def link(self, digest: str, dest_key: str) -> bool:
+        """
+        Make a blob visible at dest_key where the backend supports links
+
+        Args:
+            digest: Blob digest
+            dest_key: Storage key inside a session prefix
+
+        Returns:
+            True if a link was created
+        """
+        if not self.exists(digest):
+            raise BlobStoreError(f"Blob not found: {digest}")
+        return self.storage.link(self.key_for(digest), dest_key)
+
+    def add_reference(self, db: Session, digest: str, size: int) -> None:
+        """Increment the reference count of a blob, creating its row if needed"""
+        # One atomic upsert, so concurrent first uploads of one blob neither
+        # lose references nor trip over the unique digest
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            statement = insert(Blob).values(digest=digest, size=size, ref_count=1)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[Blob.digest],
+                set_={"ref_count": Blob.ref_count + 1, "last_used_at": datetime.utcnow()},
+            ))
+            return
+
+        if self._increment(db, digest):
+            return
+        try:
+            with db.begin_nested():
+                db.add(Blob(digest=digest, size=size, ref_count=1))
+        except IntegrityError:
+            # Another upload created the row in the meantime
+            self._increment(db, digest)
+
+    @staticmethod
+    def _increment(db: Session, digest: str) -> bool:
+        return bool(db.execute(
+            update(Blob)
+            .where(Blob.digest == digest)
+            .values(ref_count=Blob.ref_count + 1, last_used_at=datetime.utcnow())
+        ).rowcount)
+
+    def release_reference(self, db: Session, digest: str) -> None:
+        """Decrement the reference count of a blob"""
+        released = db.execute(
+            update(Blob)
+            .where(Blob.digest == digest, Blob.ref_count > 0)
+            .values(ref_count=Blob.ref_count - 1)
+        ).rowcount
+        if not released:
+            logger.warning(f"Release of unknown or unreferenced blob: {digest}")
+
+    def collect_garbage(self, db: Session) -> List[str]:
+        """
+        Delete blobs that are no longer referenced by any session,
+        together with intermediates derived from them
+
+        Args:
+            db: Database session
+
+        Returns:
+            List of removed digests
+        """
+        removed = []
+        for digest in db.exec(select(Blob.digest).where(Blob.ref_count <= 0)).all():
+            try:
+                # The row goes first, only if nothing referenced the blob since
+                # it was listed; the files go before the commit lets uploads in
+                deleted = db.execute(
+                    delete(Blob).where(Blob.digest == digest, Blob.ref_count <= 0)
+                ).rowcount
+                if deleted:
+                    self.storage.delete(self.key_for(digest))
+                    self.storage.delete_prefix(f"intermediates/{digest}")
+                    removed.append(digest)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Failed to remove blob {digest}: {str(e)}")
+
+        if removed:
+            logger.info(f"Garbage-collected {len(removed)} blobs")
+        return removed
+
+def ingest_uploads(
+    store: BlobStore,
+    db: Session,
+    uploads: List[Tuple[str, str, str]],
+) -> List[bool]:
+    """
+    Store the uploads of a session once each and reference them from it
+
+    The references are committed together with whatever the caller added
+    to db (the session row), and only then are the blobs written. If a
+    write fails, the references are released again before the error is
+    raised.
+
+    Args:
+        store: Blob store
+        db: Database session
+        uploads: Tuples of (file_path, digest, dest_key), file_path being
+            the spooled upload and dest_key the storage key of the file
+            inside the session prefix
+
+    Returns:
+        Whether each blob was newly created
+    """
+    for file_path, digest, _ in uploads:
+        store.add_reference(db, digest, os.path.getsize(file_path))
+    db.commit()
+
+    created = []
+    try:
+        for file_path, digest, dest_key in uploads:
+            created.append(store.put_file(file_path, digest)[1])
+            store.link(digest, dest_key)
+    except Exception:
+        for _, digest, _ in uploads:
+            store.release_reference(db, digest)
+        db.commit()
+        raise
+    return created
+
+def release_session(store: BlobStore, db: Session, file_records: List[dict], session_prefix: Optional[str] = None) -> int:
+    """
+    Drop all blob references held by a session
+
+    Args:
+        store: Blob store
+        db: Database session
+        file_records: File records from the session index
+        session_prefix: Storage prefix of the session to remove, if any
+
+    Returns:
+        Number of released references
+    """
+    released = 0
+    for record in file_records:
+        digest = record.get("sha256")
+        if digest:
+            store.release_reference(db, digest)
+            released += 1
+    db.commit()
+
+    if session_prefix is not None:
+        store.storage.delete_prefix(session_prefix)
+
+    return released
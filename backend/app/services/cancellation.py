@@ -0,0 +1,189 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from typing import List, Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# How often blocking waits wake up to look at the cancel token
+POLL_INTERVAL_SECONDS = 0.25
+# Grace period between SIGTERM and SIGKILL for a process group
+KILL_GRACE_SECONDS = 3.0
+
+class ConversionCancelled(Exception):
+    """Raised when a job is cancelled or runs past its deadline"""
+    pass
+
+_stats_lock = threading.Lock()
+_stats = {
+    "jobs_cancelled": 0,
+    "deadlines_exceeded": 0,
+    "process_groups_killed": 0,
+    "processes_sigkilled": 0,
+}
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+def get_cancellation_stats() -> Dict[str, int]:
+    """Counters of cancelled jobs and killed process groups"""
+    with _stats_lock:
+        return dict(_stats)
+
+class CancelToken:
+    """
+    Cooperative cancellation handle passed from a request down to each conversion.
+
+    A token is cancelled explicitly (client went away) or implicitly when its
+    deadline passes. Stage tokens created with child() inherit the parent's
+    cancellation and add a tighter deadline of their own.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, parent: Optional["CancelToken"] = None):
+        self._event = threading.Event()
+        self.deadline = deadline
+        self.parent = parent
+        self.reason: Optional[str] = None
+
+    @classmethod
+    def with_timeout(cls, seconds: Optional[float]) -> "CancelToken":
+        return cls(deadline=time.monotonic() + seconds if seconds else None)
+
+    def child(self, seconds: Optional[float] = None) -> "CancelToken":
+        """Create a stage token that expires after seconds or with its parent"""
+        deadline = time.monotonic() + seconds if seconds else None
+        if self.deadline is not None:
+            deadline = self.deadline if deadline is None else min(deadline, self.deadline)
+        return CancelToken(deadline=deadline, parent=self)
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            _count("jobs_cancelled")
+            logger.info(f"Job cancelled: {reason}")
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.parent is not None and self.parent.cancelled:
+            self.reason = self.parent.reason
+            return True
+        return False
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self) -> None:
+        """
+        Raise if the job should stop
+
+        Raises:
+            ConversionCancelled: If cancelled or past the deadline
+        """
+        if self.cancelled:
+            raise ConversionCancelled(self.reason or "cancelled")
+        if self.expired:
+            _count("deadlines_exceeded")
+            raise ConversionCancelled("deadline exceeded")
+
+def kill_process_group(proc: subprocess.Popen) -> None:
+    """
+    Terminate a process and every child it spawned
+
+    The process must have been started in its own session, so that its pid
+    is also the process group id (soffice forks soffice.bin, for instance).
+    """
+    try:
+        pgid = os.getpgid(proc.pid)
+    except ProcessLookupError:
+        return
+
+    _count("process_groups_killed")
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    try:
+        proc.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        pass
+
+    # Children may outlive the leader, so always sweep the group
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+        _count("processes_sigkilled")
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+def run_process(
+    cmd: List[str],
+    timeout: Optional[float] = None,
+    token: Optional[CancelToken] = None,
+    **kwargs
+) -> subprocess.CompletedProcess:
+    """
+    subprocess.run replacement that honours a cancel token and kills the whole
+    process group on timeout or cancellation
+
+    Args:
+        cmd: Command to execute
+        timeout: Stage time limit in seconds
+        token: Cancel token of the owning job
+
+    Returns:
+        CompletedProcess with text stdout/stderr
+
+    Raises:
+        subprocess.TimeoutExpired: If the stage time limit was hit
+        ConversionCancelled: If the job was cancelled or its deadline passed
+    """
+    stage = (token or CancelToken()).child(timeout)
+    stage.check()
+
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+        **kwargs
+    )
+
+    try:
+        while True:
+            wait = POLL_INTERVAL_SECONDS
+            remaining = stage.remaining()
+            if remaining is not None:
+                wait = min(wait, max(remaining, 0.01))
+            try:
+                stdout, stderr = proc.communicate(timeout=wait)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                pass
+
+            if stage.cancelled:
+                raise ConversionCancelled(stage.reason or "cancelled")
+            if stage.expired:
+                if token is not None and token.expired:
+                    _count("deadlines_exceeded")
+                    raise ConversionCancelled("deadline exceeded")
+                raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        logger.warning(f"Killing process group of {cmd[0]} (pid {proc.pid})")
+        kill_process_group(proc)
+        raise
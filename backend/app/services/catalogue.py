@@ -0,0 +1,239 @@
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import column, table, text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from ..models import Export
+
+logger = logging.getLogger(__name__)
+
+# MetadataRequest fields stored as Export columns
+CATALOGUE_FIELDS = ("title", "author", "supervisor", "year", "faculty", "form")
+# Rows updated per transaction while backfilling
+BACKFILL_BATCH = 1000
+MAX_PAGE_SIZE = 100
+
+# External-content FTS5 index over the export table, kept in sync by triggers
+FTS_TABLE = "export_fts"
+_FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, author, supervisor,
+        content='export', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS export_fts_insert AFTER INSERT ON export BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author, supervisor)
+        VALUES (new.id, new.title, new.author, new.supervisor);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS export_fts_delete AFTER DELETE ON export BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, supervisor)
+        VALUES ('delete', old.id, old.title, old.author, old.supervisor);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS export_fts_update AFTER UPDATE OF title, author, supervisor ON export BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, author, supervisor)
+        VALUES ('delete', old.id, old.title, old.author, old.supervisor);
+        INSERT INTO {FTS_TABLE}(rowid, title, author, supervisor)
+        VALUES (new.id, new.title, new.author, new.supervisor);
+    END""",
+]
+
+# Contentless FTS5 index over the extracted text of exports (rowid = export.id);
+# the text itself is kept compressed in storage
+TEXT_FTS_TABLE = "export_text_fts"
+_TEXT_FTS_SCHEMA = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TEXT_FTS_TABLE} USING fts5(
+    body, content='', tokenize='unicode61 remove_diacritics 2'
+)"""
+
+_fts = table(FTS_TABLE, column("rowid"))
+_text_fts = table(TEXT_FTS_TABLE, column("rowid"))
+# Set once the index exists; without FTS5 searches fall back to LIKE
+fts_enabled = False
+
+def catalogue_fields(metadata: Dict) -> Dict:
+    """Export column values for export metadata"""
+    fields = {}
+    for name in CATALOGUE_FIELDS:
+        value = metadata.get(name)
+        if name == "year":
+            try:
+                fields[name] = int(value) if value is not None else None
+            except (TypeError, ValueError):
+                fields[name] = None
+        else:
+            value = " ".join(str(value).split()) if value is not None else ""
+            fields[name] = value or None
+    return fields
+
+def backfill_export_columns(db: Session) -> int:
+    """
+    Fill the catalogue columns of exports recorded before they existed
+
+    Returns:
+        Number of updated exports
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.exec(
+            select(Export)
+            .where(Export.title == None, Export.id > last_id)  # noqa: E711
+            .order_by(Export.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        for export in rows:
+            try:
+                metadata = json.loads(export.metadata_json).get("metadata") or {}
+            except (TypeError, ValueError):
+                metadata = {}
+            for name, value in catalogue_fields(metadata).items():
+                setattr(export, name, value)
+            db.add(export)
+        db.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Backfilled catalogue columns of {updated} exports")
+    return updated
+
+def setup_search_index(engine: Engine) -> bool:
+    """
+    Create the FTS5 index, backfilling the catalogue columns first
+
+    The first start after an upgrade fills the new columns from
+    metadata_json and builds the index in one pass; later starts only check
+    that it exists.
+
+    Returns:
+        True if full-text search is available
+    """
+    global fts_enabled
+
+    if engine.dialect.name != "sqlite":
+        return False
+
+    with engine.connect() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first() is not None
+
+    if not exists:
+        # Triggers only index rows written from now on, so fill the columns before they exist
+        with Session(engine) as db:
+            backfill_export_columns(db)
+        try:
+            with engine.begin() as conn:
+                for statement in _FTS_SCHEMA:
+                    conn.execute(text(statement))
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            logger.info("Export full-text index built")
+        except Exception as e:
+            logger.warning(f"Full-text search unavailable, falling back to LIKE: {str(e)}")
+            return False
+
+    with engine.begin() as conn:
+        conn.execute(text(_TEXT_FTS_SCHEMA))
+
+    fts_enabled = True
+    return True
+
+def index_export_text(engine: Engine, export_row_id: int, body: str) -> bool:
+    """
+    Add the extracted text of an export to the full-text index
+
+    Returns:
+        True if the text was indexed
+    """
+    if not fts_enabled:
+        return False
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"INSERT INTO {TEXT_FTS_TABLE}(rowid, body) VALUES (:id, :body)"),
+            {"id": export_row_id, "body": body}
+        )
+    return True
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    FTS5 MATCH expression for free text: every word must match as a prefix
+
+    Returns:
+        The expression, or None if the text has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_exports(
+    db: Session,
+    query: Optional[str] = None,
+    faculty: Optional[str] = None,
+    year: Optional[int] = None,
+    form: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 20,
+    fulltext: Optional[str] = None
+) -> Tuple[List[Export], Optional[int]]:
+    """
+    Find exports, newest first, one page at a time
+
+    Pages are keyed on the export row ID rather than an offset, so every
+    page costs the same however deep the client has paged.
+
+    Args:
+        db: Database session
+        query: Words to find in title, author or supervisor
+        faculty: Exact faculty
+        year: Year of the work
+        form: Exact form of the work
+        cursor: ID of the last export on the previous page
+        limit: Page size, at most MAX_PAGE_SIZE
+        fulltext: Words to find in the extracted text of the work
+
+    Returns:
+        Tuple of (exports, cursor of the next page or None on the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    statement = select(Export)
+
+    if query:
+        match = fts_query(query)
+        if match is None:
+            return [], None
+        if fts_enabled:
+            statement = statement.join(_fts, _fts.c.rowid == Export.id).where(
+                text(f"{FTS_TABLE} MATCH :match").bindparams(match=match)
+            )
+        else:
+            for word in re.findall(r"\w+", query):
+                pattern = f"%{word}%"
+                statement = statement.where(
+                    Export.title.like(pattern) | Export.author.like(pattern) | Export.supervisor.like(pattern)
+                )
+
+    if fulltext:
+        match = fts_query(fulltext)
+        # Extracted text is only searchable through FTS5
+        if match is None or not fts_enabled:
+            return [], None
+        statement = statement.join(_text_fts, _text_fts.c.rowid == Export.id).where(
+            text(f"{TEXT_FTS_TABLE} MATCH :text_match").bindparams(text_match=match)
+        )
+
+    if faculty:
+        statement = statement.where(Export.faculty == faculty)
+    if year is not None:
+        statement = statement.where(Export.year == year)
+    if form:
+        statement = statement.where(Export.form == form)
+    if cursor is not None:
+        statement = statement.where(Export.id < cursor)
+
+    rows = db.exec(statement.order_by(Export.id.desc()).limit(limit + 1)).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
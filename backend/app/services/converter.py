@@ -1,28 +1,102 @@
+import io
+import json
 import subprocess
 import os
+import sys
+import time
+import shutil
 import logging
-from typing import Optional
+import zipfile
+import tempfile
+import threading
+import posixpath
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Optional, Tuple, Union
 from pathlib import Path
 
+from .cancellation import CancelToken, ConversionCancelled, run_process
+
 logger = logging.getLogger(__name__)
 
+# Page size images are fitted to, in millimetres (portrait)
+A4_MM = (210, 297)
+# Defaults for image ingestion; the API passes its configured values
+DEFAULT_IMAGE_DPI = 300
+MAX_IMAGE_PIXELS = 150_000_000
+IMAGE_MEMORY_BUDGET_MB = 512
+
+# DOCX media is only downsampled when it is this much larger than needed
+MEDIA_RESAMPLE_SLACK = 1.1
+MEDIA_JPEG_QUALITY = 85
+# Bumped whenever shrinking DOCX media changes its output, so cached parts are rebuilt
+MEDIA_SHRINK_VERSION = 1
+# Media files resized at once while shrinking a DOCX
+MEDIA_WORKERS = 4
+EMU_PER_INCH = 914400
+_WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+_A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+_R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_media_stats_lock = threading.Lock()
+_media_stats = {
+    "documents": 0,
+    "documents_shrunk": 0,
+    "images_resized": 0,
+    "bytes_before": 0,
+    "bytes_after": 0,
+    "shrink_seconds": 0.0,
+    "render_seconds": 0.0,
+    "rendered_pdf_bytes": 0,
+}
+
+def _count_media(**amounts) -> None:
+    with _media_stats_lock:
+        for key, amount in amounts.items():
+            _media_stats[key] += amount
+
+def get_docx_media_stats() -> Dict[str, float]:
+    """Sizes before and after DOCX media shrinking, and time spent shrinking and rendering shrunk documents"""
+    with _media_stats_lock:
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in _media_stats.items()}
+
 class ConversionError(Exception):
     """Custom exception for file conversion errors"""
     pass
 
-def convert_docx_to_pdf(docx_path: str, out_dir: str) -> str:
+class ImageTooLargeError(ConversionError):
+    """Custom exception for images over the pixel or memory limit"""
+    pass
+
+def convert_docx_to_pdf(
+    docx_path: str,
+    out_dir: str,
+    token: Optional[CancelToken] = None,
+    timeout: float = 60,
+    max_image_dpi: Optional[int] = None,
+    media_dpi: Optional[float] = None
+) -> str:
     """
     Convert DOCX file to PDF using LibreOffice headless mode with fallback to python-docx2pdf
     
     Args:
         docx_path: Path to the DOCX file
         out_dir: Output directory for the PDF
+        token: Cancel token of the owning job
+        timeout: Time limit for the LibreOffice stage in seconds
+        max_image_dpi: Downsample embedded images above this resolution and
+            JPEG-compress them (LibreOffice accepts 75, 150, 300, 600 and 1200);
+            None keeps them as they are. docx2pdf ignores it
+        media_dpi: Before rendering, downsample images in word/media to this
+            resolution at the size they are displayed at (None renders the
+            document as uploaded)
         
     Returns:
         Path to the generated PDF file
         
     Raises:
         ConversionError: If conversion fails
+        ConversionCancelled: If the job was cancelled or ran past its deadline
     """
     try:
         # Ensure output directory exists
@@ -31,35 +105,56 @@ def convert_docx_to_pdf(docx_path: str, out_dir: str) -> str:
         # Get the base filename without extension
         base_name = Path(docx_path).stem
         output_pdf = os.path.join(out_dir, f"{base_name}.pdf")
+
+        # A slimmer copy renders faster; its name keeps the output name the same
+        source_path = _shrunk_docx(docx_path, out_dir, media_dpi) if media_dpi else docx_path
         
         # Try LibreOffice first (preferred method)
+        # A private profile lets conversions run side by side and leaves no
+        # stale lock behind when a hung instance has to be killed
+        profile_dir = tempfile.mkdtemp(prefix="lo-profile-")
         try:
             # LibreOffice command for headless conversion
+            target = "pdf"
+            if max_image_dpi:
+                target = "pdf:writer_pdf_Export:" + json.dumps({
+                    "ReduceImageResolution": {"type": "boolean", "value": "true"},
+                    "MaxImageResolution": {"type": "long", "value": str(max_image_dpi)},
+                    "UseLosslessCompression": {"type": "boolean", "value": "false"},
+                    "Quality": {"type": "long", "value": "60"},
+                })
             cmd = [
                 "soffice",
+                f"-env:UserInstallation=file://{profile_dir}",
                 "--headless",
-                "--convert-to", "pdf",
+                "--convert-to", target,
                 "--outdir", out_dir,
-                docx_path
+                source_path
             ]
             
             logger.info(f"Converting DOCX to PDF using LibreOffice: {docx_path}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+            started = time.monotonic()
+            result = run_process(cmd, timeout=timeout, token=token)
             
             if result.returncode == 0 and os.path.exists(output_pdf):
-                logger.info(f"Successfully converted DOCX to PDF using LibreOffice: {output_pdf}")
+                elapsed = time.monotonic() - started
+                logger.info(f"Successfully converted DOCX to PDF using LibreOffice: {output_pdf} in {elapsed:.1f}s")
+                if source_path != docx_path:
+                    _count_media(render_seconds=elapsed, rendered_pdf_bytes=os.path.getsize(output_pdf))
                 return output_pdf
             else:
                 logger.warning(f"LibreOffice conversion failed: {result.stderr}")
                 raise Exception("LibreOffice not available or failed")
                 
+        except ConversionCancelled:
+            raise
         except (subprocess.TimeoutExpired, FileNotFoundError, Exception) as e:
             logger.warning(f"LibreOffice conversion failed: {str(e)}")
             logger.info("Falling back to python-docx2pdf...")
             
             # Fallback to python-docx2pdf
             try:
-                from docx2pdf import convert
+                import docx2pdf  # noqa: F401 - only checking availability here
                 
                 logger.info(f"Converting DOCX to PDF using python-docx2pdf: {docx_path}")
                 logger.info(f"Output PDF path: {output_pdf}")
@@ -71,23 +166,22 @@ def convert_docx_to_pdf(docx_path: str, out_dir: str) -> str:
                 if not os.access(docx_path, os.R_OK):
                     raise ConversionError(f"Input DOCX file is not readable: {docx_path}")
                 
-                # Perform conversion with timeout
-                import signal
-                
-                def timeout_handler(signum, frame):
-                    raise TimeoutError("DOCX conversion timed out")
-                
-                # Set timeout for conversion (30 seconds)
-                signal.signal(signal.SIGALRM, timeout_handler)
-                signal.alarm(30)
+                # Run the conversion in a child process: a timeout then works
+                # from any thread and kills whatever docx2pdf started
+                cmd = [
+                    sys.executable, "-c",
+                    "import sys; from docx2pdf import convert; convert(sys.argv[1], sys.argv[2])",
+                    source_path, output_pdf
+                ]
                 
                 try:
-                    convert(docx_path, output_pdf)
-                    signal.alarm(0)  # Cancel timeout
-                except TimeoutError:
-                    signal.alarm(0)  # Cancel timeout
+                    result = run_process(cmd, timeout=30, token=token)
+                except subprocess.TimeoutExpired:
                     raise ConversionError("DOCX conversion timed out after 30 seconds")
                 
+                if result.returncode != 0:
+                    raise ConversionError(f"python-docx2pdf failed: {result.stderr.strip()}")
+                
                 # Verify output file was created and has content
                 if not os.path.exists(output_pdf):
                     raise ConversionError(f"PDF file was not created: {output_pdf}")
@@ -111,45 +205,332 @@ def convert_docx_to_pdf(docx_path: str, out_dir: str) -> str:
                         logger.info(f"Cleaned up partial output file: {output_pdf}")
                     except OSError:
                         pass
+                if isinstance(e, ConversionCancelled):
+                    raise
                 raise ConversionError(f"DOCX conversion failed with both methods: {str(e)}")
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
         
+    except ConversionCancelled:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error during DOCX conversion: {str(e)}")
         raise ConversionError(f"DOCX conversion failed: {str(e)}")
 
-def convert_image_to_pdf(img_path: str, out_path: str) -> str:
+def _docx_display_sizes(docx: zipfile.ZipFile) -> Dict[str, Tuple[float, float]]:
+    """
+    Largest size in inches each media file is displayed at, by its name in the package
+
+    Covers DrawingML pictures in the body, headers, footers and notes; a
+    cropped picture counts at the size its whole image would take. Media
+    placed any other way (VML, charts) isn't listed and stays as it is.
+    """
+    names = set(docx.namelist())
+    sizes: Dict[str, Tuple[float, float]] = {}
+    for name in names:
+        if not name.startswith("word/") or not name.endswith(".xml") or "/_rels/" in name:
+            continue
+        folder = posixpath.dirname(name)
+        rels_name = posixpath.join(folder, "_rels", posixpath.basename(name) + ".rels")
+        if rels_name not in names:
+            continue
+        targets = {}
+        for rel in ET.fromstring(docx.read(rels_name)):
+            if rel.get("TargetMode") != "External" and rel.get("Target"):
+                targets[rel.get("Id")] = posixpath.normpath(posixpath.join(folder, rel.get("Target")))
+
+        root = ET.fromstring(docx.read(name))
+        for tag in ("inline", "anchor"):
+            for drawing in root.iter(f"{{{_WP_NS}}}{tag}"):
+                extent = drawing.find(f"{{{_WP_NS}}}extent")
+                if extent is None:
+                    continue
+                width = int(extent.get("cx", 0)) / EMU_PER_INCH
+                height = int(extent.get("cy", 0)) / EMU_PER_INCH
+                for fill in drawing.iter():
+                    if not fill.tag.endswith("}blipFill"):
+                        continue
+                    blip = fill.find(f"{{{_A_NS}}}blip")
+                    target = targets.get(blip.get(f"{{{_R_NS}}}embed")) if blip is not None else None
+                    if target is None:
+                        continue
+                    shown_x = shown_y = 1.0
+                    crop = fill.find(f"{{{_A_NS}}}srcRect")
+                    if crop is not None:
+                        # Crop offsets are in thousandths of a percent of the image
+                        shown_x = 1 - (int(crop.get("l", 0)) + int(crop.get("r", 0))) / 100000
+                        shown_y = 1 - (int(crop.get("t", 0)) + int(crop.get("b", 0))) / 100000
+                    if shown_x <= 0 or shown_y <= 0:
+                        continue
+                    known = sizes.get(target, (0.0, 0.0))
+                    sizes[target] = (max(known[0], width / shown_x), max(known[1], height / shown_y))
+    return sizes
+
+def _shrink_image(data: bytes, shown: Tuple[float, float], dpi: float, max_pixels: int) -> Optional[bytes]:
+    """A JPEG or PNG downsampled to dpi at its displayed size, or None if that saves nothing"""
+    from PIL import Image  # Lazy import to avoid hard dependency at startup
+
+    with _open_image(io.BytesIO(data), max_pixels) as img:
+        if img.format not in ("JPEG", "PNG") or img.mode not in ("1", "L", "LA", "RGB", "RGBA", "P", "PA", "CMYK"):
+            return None
+        scale = max(shown[0] * dpi / img.width, shown[1] * dpi / img.height)
+        if scale * MEDIA_RESAMPLE_SLACK >= 1.0:
+            return None
+        target = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        image_format = img.format
+        # EXIF (orientation) and colour profile are carried over so the picture looks the same
+        options = {key: img.info[key] for key in ("exif", "icc_profile") if img.info.get(key)}
+        if image_format == "JPEG":
+            img.draft(None, target)
+            options.update(quality=MEDIA_JPEG_QUALITY, optimize=True)
+        else:
+            options.update(optimize=True)
+        resized = img
+        if resized.mode == "1":
+            resized = resized.convert("L")
+        elif resized.mode in ("P", "PA"):
+            resized = resized.convert("RGBA" if resized.mode == "PA" or "transparency" in img.info else "RGB")
+        resized = resized.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        out = io.BytesIO()
+        resized.save(out, image_format, **options)
+    shrunk = out.getvalue()
+    return shrunk if len(shrunk) < len(data) else None
+
+def shrink_docx_media(
+    docx_path: str,
+    out_path: str,
+    dpi: float,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    workers: int = MEDIA_WORKERS
+) -> Dict[str, float]:
+    """
+    Write a copy of a DOCX whose oversized images are downsampled to dpi at their displayed size
+
+    Only JPEG and PNG files in word/media are resized, in their own format,
+    so no relationship or content type changes; everything else is copied
+    as it is.
+
+    Args:
+        docx_path: Path to the DOCX file
+        out_path: Path for the copy
+        dpi: Resolution of images at their displayed size
+        max_pixels: Images larger than this are left alone
+        workers: Images resized at once
+
+    Returns:
+        Statistics: images, resized, bytes_before, bytes_after (of the whole file) and seconds
+    """
+    started = time.monotonic()
+    with zipfile.ZipFile(docx_path) as docx:
+        sizes = _docx_display_sizes(docx)
+        media = [name for name in docx.namelist() if name.startswith("word/media/") and name in sizes]
+
+        def shrink(name: str) -> Optional[bytes]:
+            try:
+                return _shrink_image(docx.read(name), sizes[name], dpi, max_pixels)
+            except Exception as e:
+                logger.warning(f"Left {name} as it is: {str(e)}")
+                return None
+
+        # ZipFile reads are serialised internally; decoding and resampling run in parallel
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            replaced = {name: data for name, data in zip(media, executor.map(shrink, media)) if data is not None}
+
+        if replaced:
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+            with zipfile.ZipFile(out_path, "w") as out:
+                for item in docx.infolist():
+                    out.writestr(item, replaced.get(item.filename) or docx.read(item.filename))
+
+    stats = {
+        "images": len(media),
+        "resized": len(replaced),
+        "bytes_before": os.path.getsize(docx_path),
+        "bytes_after": os.path.getsize(out_path) if replaced else os.path.getsize(docx_path),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    return stats
+
+def _shrunk_docx(docx_path: str, out_dir: str, dpi: float) -> str:
+    """Path of a media-shrunk copy of a DOCX under out_dir, or docx_path if shrinking saved nothing"""
+    out_path = os.path.join(out_dir, "shrunk", os.path.basename(docx_path))
+    try:
+        stats = shrink_docx_media(docx_path, out_path, dpi)
+    except Exception as e:
+        logger.warning(f"Rendering {docx_path} without shrinking its media: {str(e)}")
+        return docx_path
+    _count_media(documents=1, shrink_seconds=stats["seconds"], bytes_before=stats["bytes_before"])
+    if not stats["resized"]:
+        _count_media(bytes_after=stats["bytes_before"])
+        return docx_path
+    _count_media(documents_shrunk=1, images_resized=stats["resized"], bytes_after=stats["bytes_after"])
+    logger.info(
+        f"Shrunk {stats['resized']} of {stats['images']} images in {docx_path}: "
+        f"{stats['bytes_before'] / (1024 * 1024):.1f}MB -> {stats['bytes_after'] / (1024 * 1024):.1f}MB "
+        f"in {stats['seconds']:.2f}s"
+    )
+    return out_path
+
+def _a4_size(width: int, height: int, dpi: float) -> Tuple[int, int]:
+    """Largest size, at most the image's own, that fits an A4 page at dpi in the image's orientation"""
+    short_side = A4_MM[0] / 25.4 * dpi
+    long_side = A4_MM[1] / 25.4 * dpi
+    scale = min(1.0, long_side / max(width, height), short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def set_pixel_limit(max_pixels: int) -> None:
+    """
+    Set Pillow's decompression bomb limit for the whole process
+
+    The limit is global, so it is set once at startup: changing it per call
+    would race with other threads opening images. Each conversion still
+    checks its own max_pixels explicitly.
+    """
+    from PIL import Image  # Lazy import to avoid hard dependency at startup
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+
+def _open_image(source: Union[str, BinaryIO], max_pixels: int):
+    """
+    Open an image (only its header is read) and check its pixel count
+
+    Raises:
+        ImageTooLargeError: If the image has more than max_pixels pixels
+    """
+    from PIL import Image  # Lazy import to avoid hard dependency at startup
+
+    try:
+        img = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    width, height = img.size
+    if width * height > max_pixels:
+        img.close()
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} ({width * height} pixels), the limit is {max_pixels} pixels"
+        )
+    return img
+
+def _plan_decode(img, target_dpi: float, memory_budget_mb: int) -> Tuple[int, int]:
+    """
+    Set up reduced-resolution decoding and check the memory it will take
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale when the target size allows
+    (draft mode), so only the reduced image is ever held. Other formats are
+    decoded in full; their decoded size counts against the budget.
+
+    Returns:
+        Target size of the image
+
+    Raises:
+        ImageTooLargeError: If decoding would take more than memory_budget_mb
+    """
+    target = _a4_size(img.width, img.height, target_dpi)
+    if img.format == "JPEG":
+        img.draft(None, target)
+
+    decoded = img.width * img.height * len(img.getbands())
+    if img.mode in ("P", "PA", "1"):
+        # Palette and bilevel images are expanded before they can be resampled
+        decoded += img.width * img.height * 4
+    if decoded > memory_budget_mb * 1024 * 1024:
+        raise ImageTooLargeError(
+            f"Decoding the {img.width}x{img.height} {img.mode} image takes about "
+            f"{decoded // (1024 * 1024)}MB, the limit is {memory_budget_mb}MB"
+        )
+    return target
+
+def check_image(
+    source: Union[str, BinaryIO, bytes],
+    target_dpi: float = DEFAULT_IMAGE_DPI,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    memory_budget_mb: int = IMAGE_MEMORY_BUDGET_MB
+) -> Tuple[int, int]:
+    """
+    Check that an image can be converted within the limits, reading only its header
+
+    Returns:
+        Width and height of the image
+
+    Raises:
+        ImageTooLargeError: If the image is over the pixel or memory limit
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with _open_image(source, max_pixels) as img:
+        size = img.size
+        _plan_decode(img, target_dpi, memory_budget_mb)
+    return size
+
+def convert_image_to_pdf(
+    img_path: Union[str, BinaryIO],
+    out_path: Union[str, BinaryIO],
+    target_dpi: float = DEFAULT_IMAGE_DPI,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    memory_budget_mb: int = IMAGE_MEMORY_BUDGET_MB
+) -> str:
     """
     Convert image file to PDF using Pillow
     
+    Images larger than an A4 page at target_dpi are downsampled to fit it;
+    smaller ones keep their pixels. Resampling happens before any colour
+    mode conversion, so that conversion only copies the reduced image.
+    
     Args:
-        img_path: Path to the image file
-        out_path: Path for the output PDF file
+        img_path: Path to the image file, or a binary file object
+        out_path: Path for the output PDF file, or a writable binary file object
+        target_dpi: Resolution of the page image
+        max_pixels: Largest accepted image, in pixels
+        memory_budget_mb: Largest accepted decoded image, in MB
         
     Returns:
-        Path to the generated PDF file
+        out_path
         
     Raises:
+        ImageTooLargeError: If the image is over the pixel or memory limit
         ConversionError: If conversion fails
     """
     try:
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        to_file = isinstance(out_path, str)
+        if to_file:
+            # Ensure output directory exists
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        name = img_path if isinstance(img_path, str) else "in-memory image"
         
-        logger.info(f"Converting image to PDF: {img_path}")
+        logger.info(f"Converting image to PDF: {name}")
         
-        # Open and convert image
         from PIL import Image  # Lazy import to avoid hard dependency at startup
-        with Image.open(img_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            img.save(out_path, "PDF", resolution=300.0, quality=95)
+        with _open_image(img_path, max_pixels) as original:
+            target = _plan_decode(original, target_dpi, memory_budget_mb)
+            img = original
+            if img.mode == "1":
+                img = img.convert("L")
+            elif img.mode in ("P", "PA"):
+                img = img.convert("RGBA" if img.mode == "PA" or "transparency" in img.info else "RGB")
+            if img.size != target:
+                # reduce() by an integer factor first, then a Lanczos pass for the rest
+                img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            if img is not original:
+                original.close()
+
+            if img.mode in ("RGBA", "LA"):
+                # PDF pages have no transparency; flatten onto white paper
+                background = Image.new(img.mode[:-1], img.size, 255 if img.mode == "LA" else (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode not in ("RGB", "L", "CMYK"):
+                img = img.convert("RGB")
+            img.save(out_path, "PDF", resolution=float(target_dpi), quality=95)
         
-        if not os.path.exists(out_path):
+        if to_file and not os.path.exists(out_path):
             raise ConversionError(f"PDF file was not created: {out_path}")
         
-        logger.info(f"Successfully converted image to PDF: {out_path}")
+        logger.info(f"Successfully converted image to PDF: {out_path if to_file else name} ({target[0]}x{target[1]})")
         return out_path
         
+    except ImageTooLargeError as e:
+        logger.warning(f"Image rejected: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Image conversion failed: {str(e)}")
         raise ConversionError(f"Image conversion failed: {str(e)}")
@@ -0,0 +1,209 @@
+import io
+import re
+import logging
+import zipfile
+import threading
+from typing import Dict, List, Optional, Sequence, Union, BinaryIO
+
+from sqlmodel import Session, select
+
+from ..models import ConversionStat
+
+logger = logging.getLogger(__name__)
+
+# Features a prediction is based on, after the intercept
+FEATURES = ("size_mb", "pages", "media_mb")
+
+# Prior coefficients (intercept, per MB, per page, per MB of media or megapixel)
+# used until enough history has been recorded; fits are pulled towards them
+DEFAULT_COEFFICIENTS = {
+    "docx": (4.0, 0.3, 0.05, 0.4),
+    "image": (0.3, 0.2, 0.0, 0.15),
+    "pdf": (0.0, 0.0, 0.0, 0.0),
+    "merge": (0.05, 0.01, 0.002, 0.0),
+    # Draft parts: images decoded at low resolution, DOCX media downsampled by LibreOffice
+    "docx-draft": (4.0, 0.2, 0.05, 0.2),
+    "image-draft": (0.1, 0.1, 0.0, 0.05),
+}
+# Shortest prediction handed out, so nothing is ever free
+MIN_PREDICTION_SECONDS = 0.05
+# Rows per kind used for a fit
+HISTORY_SIZE = 500
+# Strength of the pull towards the prior coefficients
+RIDGE = 2.0
+
+def extract_features(source: Union[str, BinaryIO, bytes], file_type: str, size: int) -> Dict[str, float]:
+    """
+    Describe a file for the cost model
+
+    Args:
+        source: Path, binary file object or raw content
+        file_type: One of docx, pdf, image
+        size: File size in bytes
+
+    Returns:
+        Dictionary with size_mb, pages and media_mb (embedded media in MB
+        for DOCX, megapixels for images); unknown values are 0
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    features = {"size_mb": size / (1024 * 1024), "pages": 0.0, "media_mb": 0.0}
+
+    try:
+        if file_type == "docx":
+            with zipfile.ZipFile(source) as archive:
+                media = [info for info in archive.infolist() if info.filename.startswith("word/media/")]
+                features["media_mb"] = sum(info.file_size for info in media) / (1024 * 1024)
+                # Word records the page count of its last layout in app.xml
+                if "docProps/app.xml" in archive.namelist():
+                    match = re.search(rb"<Pages>(\d+)</Pages>", archive.read("docProps/app.xml"))
+                    if match:
+                        features["pages"] = float(match.group(1))
+        elif file_type == "image":
+            from PIL import Image
+            with Image.open(source) as image:
+                # Only the header is read here
+                features["media_mb"] = image.width * image.height / 1_000_000
+                features["pages"] = 1.0
+        elif file_type == "pdf":
+            from pypdf import PdfReader
+            features["pages"] = float(len(PdfReader(source).pages))
+    except Exception as e:
+        logger.warning(f"Could not extract cost features ({file_type}): {str(e)}")
+
+    return features
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> Optional[List[float]]:
+    """Solve a small dense linear system by Gaussian elimination with partial pivoting"""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, n + 1):
+                rows[r][c] -= factor * rows[col][c]
+    solution = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        solution[r] = (rows[r][n] - sum(rows[r][c] * solution[c] for c in range(r + 1, n))) / rows[r][r]
+    return solution
+
+def fit_coefficients(
+    samples: Sequence[Sequence[float]],
+    durations: Sequence[float],
+    prior: Sequence[float],
+    ridge: float = RIDGE
+) -> List[float]:
+    """
+    Least-squares fit of duration = b0 + b . features, regularised towards prior
+
+    Solves (X'X + ridge*I) b = X'y + ridge*prior, so a handful of samples
+    only nudges the prior and a long history dominates it.
+
+    Args:
+        samples: Feature rows, in FEATURES order
+        durations: Observed durations in seconds
+        prior: Prior coefficients, intercept first
+
+    Returns:
+        Fitted coefficients, intercept first
+    """
+    n = len(prior)
+    xtx = [[ridge if i == j else 0.0 for j in range(n)] for i in range(n)]
+    xty = [ridge * p for p in prior]
+    for features, duration in zip(samples, durations):
+        row = [1.0] + list(features)
+        for i in range(n):
+            xty[i] += row[i] * duration
+            for j in range(n):
+                xtx[i][j] += row[i] * row[j]
+    solution = _solve(xtx, xty)
+    return solution if solution is not None else list(prior)
+
+class CostModel:
+    """
+    Predicts how long a conversion or merge takes from recorded history.
+
+    One linear model per kind (docx, image, pdf, merge, and the draft
+    conversions docx-draft and image-draft) over FEATURES.
+    Observations are stored in the ConversionStat table so every replica
+    learns from all of them; each kind is refitted after refit_every new
+    observations.
+    """
+
+    def __init__(self, refit_every: int = 20):
+        self.refit_every = refit_every
+        self.coefficients: Dict[str, List[float]] = {k: list(v) for k, v in DEFAULT_COEFFICIENTS.items()}
+        self.samples: Dict[str, int] = {}
+        self._since_fit: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def predict(self, kind: str, features: Dict[str, float]) -> float:
+        """Predicted duration in seconds"""
+        coefficients = self.coefficients.get(kind, DEFAULT_COEFFICIENTS["docx"])
+        row = [1.0] + [features.get(name, 0.0) for name in FEATURES]
+        return max(MIN_PREDICTION_SECONDS, sum(c * x for c, x in zip(coefficients, row)))
+
+    def fit(self, db: Session, kind: Optional[str] = None) -> None:
+        """Refit one kind, or all kinds, from recorded history"""
+        kinds = [kind] if kind else list(DEFAULT_COEFFICIENTS)
+        for k in kinds:
+            rows = db.exec(
+                select(ConversionStat)
+                .where(ConversionStat.kind == k)
+                .order_by(ConversionStat.id.desc())
+                .limit(HISTORY_SIZE)
+            ).all()
+            prior = DEFAULT_COEFFICIENTS.get(k, DEFAULT_COEFFICIENTS["docx"])
+            coefficients = fit_coefficients(
+                [(r.size_mb, r.pages, r.media_mb) for r in rows],
+                [r.duration_seconds for r in rows],
+                prior
+            )
+            with self._lock:
+                self.coefficients[k] = coefficients
+                self.samples[k] = len(rows)
+                self._since_fit[k] = 0
+            if rows:
+                logger.info(f"Cost model for {k} fitted on {len(rows)} samples: {[round(c, 4) for c in coefficients]}")
+
+    def record(
+        self,
+        db: Session,
+        kind: str,
+        features: Dict[str, float],
+        duration: float,
+        memory: Optional[Dict[str, Optional[float]]] = None
+    ) -> None:
+        """
+        Store an observation and refit its kind when enough new ones arrived
+
+        memory holds the rss_delta_mb and peak_delta_mb of the run, if measured.
+        """
+        memory = memory or {}
+        db.add(ConversionStat(
+            kind=kind,
+            size_mb=features.get("size_mb", 0.0),
+            pages=features.get("pages", 0.0),
+            media_mb=features.get("media_mb", 0.0),
+            duration_seconds=duration,
+            predicted_seconds=self.predict(kind, features),
+            rss_delta_mb=memory.get("rss_delta_mb"),
+            peak_delta_mb=memory.get("peak_delta_mb"),
+        ))
+        db.commit()
+
+        with self._lock:
+            self._since_fit[kind] = self._since_fit.get(kind, 0) + 1
+            due = self._since_fit[kind] >= self.refit_every
+        if due:
+            self.fit(db, kind)
+
+    def stats(self) -> Dict:
+        return {
+            kind: {"coefficients": [round(c, 4) for c in coefficients], "samples": self.samples.get(kind, 0)}
+            for kind, coefficients in self.coefficients.items()
+        }
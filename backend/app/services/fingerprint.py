@@ -0,0 +1,56 @@
+import json
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+def normalize_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize metadata so cosmetic differences don't change the fingerprint
+
+    Args:
+        metadata: Dictionary containing metadata fields
+
+    Returns:
+        Dictionary with trimmed, whitespace-collapsed values and no empty fields
+    """
+    normalized = {}
+    for key, value in metadata.items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+            if not value:
+                value = None
+        if value is None:
+            continue
+        normalized[key] = value
+    return normalized
+
+def compute_export_fingerprint(
+    content_hashes: List[Union[str, Dict[str, Any]]],
+    metadata: Dict[str, Any],
+    engine_version: str,
+    finishing: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Compute a deterministic fingerprint for an export
+
+    Args:
+        content_hashes: Content hashes of the input files in export order; entries
+            with a page selection are dicts (sha256, pages, rotate) or {"blank": n}
+        metadata: Export metadata fields
+        engine_version: Version of the PDF pipeline producing the export
+        finishing: Requested stamps and page labels, if any
+
+    Returns:
+        Hex-encoded SHA-256 fingerprint
+    """
+    payload = {
+        "inputs": list(content_hashes),
+        "metadata": normalize_metadata(metadata),
+        "engine": engine_version,
+    }
+    if finishing:
+        payload["finishing"] = finishing
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
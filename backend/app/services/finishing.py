@@ -0,0 +1,323 @@
+import os
+import math
+import zlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# Fonts with Cyrillic coverage, tried in order for rendered stamps
+STAMP_FONT_PATHS = [
+    os.environ.get("STAMP_FONT_PATH", ""),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+]
+# Resolution of rendered stamp text
+STAMP_DPI = 300
+# Width of Helvetica digits in 1/1000 em, used to centre page numbers
+HELVETICA_DIGIT_WIDTH = 556
+# Watermark text is rendered at this size, then scaled to WATERMARK_SPAN of the page diagonal
+WATERMARK_FONT_SIZE = 48
+WATERMARK_SPAN = 0.7
+# Grey level (0 black, 255 white) and opacity of the watermark
+WATERMARK_GRAY = 128
+WATERMARK_OPACITY = 0.3
+
+PAGE_LABEL_STYLES = {
+    "decimal": "/D",
+    "roman": "/r",
+    "Roman": "/R",
+    "letters": "/a",
+    "Letters": "/A",
+    "none": None,
+}
+
+class FinishingError(Exception):
+    """Custom exception for finishing errors"""
+    pass
+
+class FinishingSpec:
+    """
+    Finishing applied while a merged PDF is written.
+
+    Covers document metadata (Info dictionary and XMP packet), page labels
+    and per-page stamps: a page number centred at the bottom, a footer
+    line below it and a diagonal watermark. Page numbers use the standard
+    Helvetica font; footer and watermark text may be Cyrillic, so each is
+    rendered once with Pillow and placed on every page as a shared image.
+
+    Args:
+        metadata: Export metadata (title, author, supervisor, year, faculty, form)
+        footer: Footer text, or None for no footer
+        page_numbers: Whether to print page numbers
+        first_numbered_page: First page (1-based) that gets a printed number;
+            earlier pages are still counted, as with a title page
+        page_labels: Page label ranges, dicts with start_page (1-based),
+            style (decimal, roman, Roman, letters, Letters, none), prefix and first
+        font_size: Stamp font size in points
+        margin: Distance of the page number baseline from the bottom edge in points
+        watermark: Text drawn in light grey across every page, or None
+    """
+
+    def __init__(
+        self,
+        metadata: Optional[Dict[str, Any]] = None,
+        footer: Optional[str] = None,
+        page_numbers: bool = False,
+        first_numbered_page: int = 1,
+        page_labels: Optional[List[Dict[str, Any]]] = None,
+        font_size: float = 10,
+        margin: float = 28,
+        watermark: Optional[str] = None
+    ):
+        self.metadata = metadata or {}
+        self.footer = footer.strip() if footer and footer.strip() else None
+        self.page_numbers = page_numbers
+        self.first_numbered_page = max(1, first_numbered_page)
+        self.page_labels = page_labels or []
+        self.font_size = font_size
+        self.margin = margin
+        self.watermark = watermark.strip() if watermark and watermark.strip() else None
+
+        for label in self.page_labels:
+            if label.get("style", "decimal") not in PAGE_LABEL_STYLES:
+                raise FinishingError(f"Unknown page label style: {label.get('style')}")
+            if int(label.get("start_page", 1)) < 1:
+                raise FinishingError("Page label ranges start at page 1 or later")
+
+    @property
+    def has_stamps(self) -> bool:
+        return self.page_numbers or self.footer is not None or self.watermark is not None
+
+    def stamp_images(self) -> Dict[str, Tuple[str, float, int, float]]:
+        """Text stamps placed as images, by XObject name: (text, font size, grey level, opacity)"""
+        images = {}
+        if self.footer is not None:
+            images["/StampFooter"] = (self.footer, self.font_size * 0.8, 0, 1.0)
+        if self.watermark is not None:
+            images["/StampWatermark"] = (self.watermark, WATERMARK_FONT_SIZE, WATERMARK_GRAY, WATERMARK_OPACITY)
+        return images
+
+    def page_number_text(self, page_number: int) -> Optional[str]:
+        """Printed number of a 1-based page, or None if it isn't numbered"""
+        if not self.page_numbers or page_number < self.first_numbered_page:
+            return None
+        return str(page_number)
+
+    def stamp_operators(
+        self,
+        page_number: int,
+        width: float,
+        height: float,
+        image_sizes: Optional[Dict[str, Tuple[float, float]]] = None
+    ) -> bytes:
+        """
+        Content stream operators stamping one page
+
+        Coordinates are in the displayed page's space; the caller maps them
+        onto the page's user space.
+
+        Args:
+            page_number: 1-based page number in the export
+            width: Displayed page width in points
+            height: Displayed page height in points
+            image_sizes: (width, height) in points of the rendered stamp_images();
+                images missing here are left out
+
+        Returns:
+            PDF operators drawing /FStamp text and the stamp images
+        """
+        image_sizes = image_sizes or {}
+        ops = []
+        watermark_size = image_sizes.get("/StampWatermark") if self.watermark is not None else None
+        if watermark_size is not None:
+            # Centred, along the diagonal from the lower left corner, drawn under the other stamps
+            image_width, image_height = watermark_size
+            angle = math.atan2(height, width)
+            scale = WATERMARK_SPAN * math.hypot(width, height) / image_width
+            w, h = image_width * scale, image_height * scale
+            cos, sin = math.cos(angle), math.sin(angle)
+            ops.append(
+                f"q {cos:.4f} {sin:.4f} {-sin:.4f} {cos:.4f} {width / 2:.2f} {height / 2:.2f} cm "
+                f"{w:.2f} 0 0 {h:.2f} {-w / 2:.2f} {-h / 2:.2f} cm /StampWatermark Do Q"
+            )
+        number = self.page_number_text(page_number)
+        if number is not None:
+            text_width = len(number) * HELVETICA_DIGIT_WIDTH * self.font_size / 1000
+            x = (width - text_width) / 2
+            ops.append(
+                f"BT /FStamp {self.font_size:g} Tf 0 g {x:.2f} {self.margin:.2f} Td ({number}) Tj ET"
+            )
+        footer_size = image_sizes.get("/StampFooter") if self.footer is not None else None
+        if footer_size is not None:
+            image_width, image_height = footer_size
+            x = (width - image_width) / 2
+            y = max(2.0, self.margin / 2 - image_height / 2)
+            ops.append(f"q {image_width:.2f} 0 0 {image_height:.2f} {x:.2f} {y:.2f} cm /StampFooter Do Q")
+        return "\n".join(ops).encode("ascii")
+
+    def page_label_ranges(self) -> List[Tuple[int, Optional[str], Optional[str], int]]:
+        """Page label ranges as (0-based start, style name, prefix, first number), sorted"""
+        ranges = []
+        for label in sorted(self.page_labels, key=lambda item: int(item.get("start_page", 1))):
+            ranges.append((
+                int(label.get("start_page", 1)) - 1,
+                PAGE_LABEL_STYLES[label.get("style", "decimal")],
+                label.get("prefix") or None,
+                int(label.get("first", 1)),
+            ))
+        return ranges
+
+def expand_footer(template: str, metadata: Dict[str, Any]) -> str:
+    """
+    Substitute {title}, {author}, {supervisor}, {year}, {faculty} and {form}
+    in a footer template; unknown placeholders are left as they are
+    """
+    text = template
+    for key in ("title", "author", "supervisor", "year", "faculty", "form"):
+        text = text.replace("{" + key + "}", _metadata_text(metadata.get(key)) or "")
+    return " ".join(text.split())
+
+def _metadata_text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    text = " ".join(str(value).split())
+    return text or None
+
+def build_info(metadata: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Document Info entries for the export metadata
+
+    Args:
+        metadata: Export metadata fields
+
+    Returns:
+        Mapping of Info keys (e.g. "/Title") to text values
+    """
+    title = _metadata_text(metadata.get("title"))
+    author = _metadata_text(metadata.get("author"))
+    supervisor = _metadata_text(metadata.get("supervisor"))
+    year = _metadata_text(metadata.get("year"))
+    faculty = _metadata_text(metadata.get("faculty"))
+    form = _metadata_text(metadata.get("form"))
+
+    info = {
+        "/Title": title,
+        "/Author": author,
+        "/Subject": ", ".join(part for part in (form, faculty, year) if part) or None,
+        "/Keywords": "; ".join(part for part in (faculty, year) if part) or None,
+        "/Creator": "VKR Export System",
+        # Custom keys so catalogue tools can read the fields individually
+        "/Supervisor": supervisor,
+        "/Faculty": faculty,
+        "/Year": year,
+        "/Form": form,
+    }
+    return {key: value for key, value in info.items() if value}
+
+def build_xmp(metadata: Dict[str, Any], producer: str, created: Optional[datetime] = None) -> bytes:
+    """
+    XMP metadata packet for the export metadata
+
+    Args:
+        metadata: Export metadata fields
+        producer: PDF producer string
+        created: Creation time, now if omitted
+
+    Returns:
+        UTF-8 encoded XMP packet
+    """
+    created = created or datetime.now(timezone.utc)
+    info = build_info(metadata)
+
+    def text(value: Optional[str]) -> str:
+        return escape(value or "")
+
+    fields = []
+    if "/Title" in info:
+        fields.append(
+            f'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{text(info["/Title"])}</rdf:li></rdf:Alt></dc:title>'
+        )
+    if "/Author" in info:
+        fields.append(f'<dc:creator><rdf:Seq><rdf:li>{text(info["/Author"])}</rdf:li></rdf:Seq></dc:creator>')
+    if "/Supervisor" in info:
+        fields.append(
+            f'<dc:contributor><rdf:Bag><rdf:li>{text(info["/Supervisor"])}</rdf:li></rdf:Bag></dc:contributor>'
+        )
+    if "/Year" in info:
+        fields.append(f'<dc:date><rdf:Seq><rdf:li>{text(info["/Year"])}</rdf:li></rdf:Seq></dc:date>')
+    if "/Subject" in info:
+        fields.append(
+            f'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{text(info["/Subject"])}</rdf:li></rdf:Alt></dc:description>'
+        )
+    if "/Keywords" in info:
+        fields.append(f'<pdf:Keywords>{text(info["/Keywords"])}</pdf:Keywords>')
+    for key, tag in (("/Supervisor", "supervisor"), ("/Faculty", "faculty"), ("/Year", "year"), ("/Form", "form")):
+        if key in info:
+            fields.append(f"<vkr:{tag}>{text(info[key])}</vkr:{tag}>")
+
+    timestamp = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+    packet = (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        '<rdf:Description rdf:about=""\n'
+        ' xmlns:dc="http://purl.org/dc/elements/1.1/"\n'
+        ' xmlns:pdf="http://ns.adobe.com/pdf/1.3/"\n'
+        ' xmlns:xmp="http://ns.adobe.com/xap/1.0/"\n'
+        ' xmlns:vkr="https://vkr-export.local/ns/1.0/">\n'
+        '<dc:format>application/pdf</dc:format>\n'
+        + "\n".join(fields) + "\n"
+        f"<pdf:Producer>{text(producer)}</pdf:Producer>\n"
+        f"<xmp:CreatorTool>VKR Export System</xmp:CreatorTool>\n"
+        f"<xmp:CreateDate>{timestamp}</xmp:CreateDate>\n"
+        f"<xmp:ModifyDate>{timestamp}</xmp:ModifyDate>\n"
+        "</rdf:Description>\n"
+        "</rdf:RDF>\n"
+        "</x:xmpmeta>\n"
+        '<?xpacket end="w"?>'
+    )
+    return packet.encode("utf-8")
+
+def find_stamp_font() -> Optional[str]:
+    """Path of the first available TrueType font for rendered stamps"""
+    for path in STAMP_FONT_PATHS:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+def render_text_image(text: str, font_size: float, opacity: float = 1.0) -> Tuple[int, int, bytes, float, float]:
+    """
+    Render a line of text as an 8-bit alpha mask
+
+    Args:
+        text: Text to render, any script the stamp font covers
+        font_size: Size in points
+        opacity: Scale of the mask, 1.0 for opaque glyphs
+
+    Returns:
+        Tuple of (pixel width, pixel height, Flate-compressed alpha bytes,
+        width in points, height in points)
+
+    Raises:
+        FinishingError: If no suitable font is installed
+    """
+    from PIL import Image, ImageDraw, ImageFont  # Pillow is already used for image conversion
+
+    font_path = find_stamp_font()
+    if font_path is None:
+        raise FinishingError("No TrueType font found for stamp text (set STAMP_FONT_PATH)")
+
+    pixel_size = max(1, round(font_size * STAMP_DPI / 72))
+    font = ImageFont.truetype(font_path, pixel_size)
+    left, top, right, bottom = font.getbbox(text)
+    width, height = max(1, right - left), max(1, bottom - top)
+
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=round(255 * opacity))
+
+    scale = 72 / STAMP_DPI
+    return width, height, zlib.compress(mask.tobytes()), width * scale, height * scale
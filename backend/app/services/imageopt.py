@@ -0,0 +1,404 @@
+import io
+import os
+import math
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+from pypdf import PdfWriter
+from pypdf.generic import ContentStream, DecodedStreamObject, IndirectObject, NameObject, NumberObject
+
+from .merger import PdfSource, open_pdf
+
+logger = logging.getLogger(__name__)
+
+# Image streams smaller than this aren't worth recompressing
+MIN_IMAGE_BYTES = 32 * 1024
+# A recompressed image is only used if it is at least this much smaller
+MIN_SAVINGS = 0.1
+# Images within this factor of their target size keep their resolution
+RESAMPLE_SLACK = 1.1
+# Target-size passes lower the resolution and JPEG quality down to these
+MIN_DPI = 72
+MIN_JPEG_QUALITY = 50
+MAX_PASSES = 3
+# Form XObjects nested deeper than this aren't searched for images
+MAX_FORM_DEPTH = 3
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "runs": 0,
+    "images_seen": 0,
+    "images_recompressed": 0,
+    "cache_hits": 0,
+    "bytes_saved": 0,
+}
+
+def _count(**amounts: int) -> None:
+    with _stats_lock:
+        for key, amount in amounts.items():
+            _stats[key] += amount
+
+def get_image_optimization_stats() -> Dict[str, int]:
+    """Counters of optimisation runs, recompressed images and saved bytes"""
+    with _stats_lock:
+        return dict(_stats)
+
+class ImageCache:
+    """
+    Recompressed image streams by source hash and target, most recent kept in memory.
+
+    Args:
+        max_bytes: Bytes of image data kept in memory
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            if key in self._entries or len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+class StorageImageCache(ImageCache):
+    """ImageCache backed by the storage backend, so re-exports on any replica reuse the work"""
+
+    def __init__(self, storage, prefix: str = "intermediates/images/", max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.storage = storage
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}.jpg"
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = super().get(key)
+        if data is None and self.storage.exists(self._key(key)):
+            data = self.storage.get_bytes(self._key(key))
+            super().put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        super().put(key, data)
+        self.storage.put_bytes(self._key(key), data)
+
+def _multiply(m: Tuple[float, ...], n: Tuple[float, ...]) -> Tuple[float, ...]:
+    """The PDF matrix product m x n"""
+    return (
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+def _find_placements(
+    contents,
+    resources,
+    pdf,
+    ctm: Tuple[float, ...],
+    placements: Dict[int, Tuple[float, float]],
+    refs: Dict[int, IndirectObject],
+    depth: int = 0
+) -> None:
+    """Record the largest size in points at which each image XObject is drawn, following forms"""
+    xobjects = resources.get("/XObject") if resources else None
+    xobjects = xobjects.get_object() if xobjects is not None else None
+    if contents is None or not xobjects:
+        return
+    stack = []
+    for operands, operator in ContentStream(contents, pdf).operations:
+        if operator == b"q":
+            stack.append(ctm)
+        elif operator == b"Q":
+            ctm = stack.pop() if stack else ctm
+        elif operator == b"cm" and len(operands) == 6:
+            ctm = _multiply(tuple(float(value) for value in operands), ctm)
+        elif operator == b"Do" and operands:
+            ref = xobjects.raw_get(operands[0]) if operands[0] in xobjects else None
+            if not isinstance(ref, IndirectObject):
+                continue
+            obj = ref.get_object()
+            subtype = obj.get("/Subtype")
+            if subtype == "/Image":
+                # The image's unit square is mapped by the CTM; its sides are the drawn width and height
+                width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                known = placements.get(ref.idnum, (0.0, 0.0))
+                placements[ref.idnum] = (max(known[0], width), max(known[1], height))
+                refs[ref.idnum] = ref
+            elif subtype == "/Form" and depth < MAX_FORM_DEPTH:
+                matrix = tuple(float(value) for value in obj.get("/Matrix", IDENTITY))
+                _find_placements(
+                    obj, obj.get("/Resources") or resources, pdf, _multiply(matrix, ctm), placements, refs, depth + 1
+                )
+
+def _image_mode(obj) -> Optional[str]:
+    """Pillow mode of an image stream we can recompress, None for masks, palettes, CMYK and the like"""
+    if obj.get("/ImageMask") or obj.get("/Decode") is not None or obj.get("/BitsPerComponent", 8) != 8:
+        return None
+    colorspace = obj.get("/ColorSpace")
+    colorspace = colorspace.get_object() if colorspace is not None else None
+    if colorspace == "/DeviceRGB":
+        return "RGB"
+    if colorspace == "/DeviceGray":
+        return "L"
+    if isinstance(colorspace, list) and len(colorspace) == 2 and colorspace[0] == "/ICCBased":
+        return {1: "L", 3: "RGB"}.get(colorspace[1].get_object().get("/N"))
+    return None
+
+def _filters(obj) -> List[str]:
+    filters = obj.get("/Filter")
+    if filters is None:
+        return []
+    filters = filters.get_object()
+    return [str(f) for f in filters] if isinstance(filters, list) else [str(filters)]
+
+def _source_hash(obj) -> str:
+    """Identity of an image stream: its encoded bytes and how to read them"""
+    digest = hashlib.sha256(obj._data)
+    for key in ("/Filter", "/DecodeParms", "/ColorSpace", "/Width", "/Height"):
+        digest.update(repr(obj.get(key)).encode())
+    return digest.hexdigest()
+
+def _recompress(obj, mode: str, target: Tuple[int, int], quality: int) -> bytes:
+    """Decode an image stream, downsample it to target and encode it as JPEG"""
+    from PIL import Image  # Lazy import to avoid hard dependency at startup
+
+    size = (int(obj["/Width"]), int(obj["/Height"]))
+    if _filters(obj) == ["/DCTDecode"]:
+        img = Image.open(io.BytesIO(obj._data))
+        # JPEG decoding can scale by 1/2, 1/4 or 1/8 on the way, which is far cheaper
+        img.draft(mode, target)
+    else:
+        img = Image.frombytes(mode, size, obj.get_data())
+    if img.mode != mode:
+        img = img.convert(mode)
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+def _target_size(size: Tuple[int, int], drawn: Tuple[float, float], dpi: float) -> Tuple[int, int]:
+    """Pixel size at which an image drawn drawn points wide and high has dpi, keeping its aspect ratio"""
+    scale = max(drawn[0] / 72 * dpi / size[0], drawn[1] / 72 * dpi / size[1])
+    if scale * RESAMPLE_SLACK >= 1.0:
+        return size
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+class _Candidate:
+    def __init__(self, ref: IndirectObject, obj, mode: str, drawn: Tuple[float, float]):
+        self.ref = ref
+        self.obj = obj
+        self.mode = mode
+        self.drawn = drawn
+        self.size = (int(obj["/Width"]), int(obj["/Height"]))
+        self.raw_bytes = len(obj._data)
+        self.source_hash = _source_hash(obj)
+
+def _plan(writer: PdfWriter) -> List[_Candidate]:
+    """Images of a document worth optimising, with the largest size each is drawn at"""
+    placements: Dict[int, Tuple[float, float]] = {}
+    refs: Dict[int, IndirectObject] = {}
+    for page in writer.pages:
+        _find_placements(page.get_contents(), page.get("/Resources"), writer, IDENTITY, placements, refs)
+    candidates = []
+    for idnum, drawn in placements.items():
+        obj = refs[idnum].get_object()
+        mode = _image_mode(obj)
+        if mode is None or len(obj._data) < MIN_IMAGE_BYTES or min(drawn) <= 0:
+            continue
+        if _filters(obj) not in (["/DCTDecode"], ["/FlateDecode"], []):
+            continue
+        candidates.append(_Candidate(refs[idnum], obj, mode, drawn))
+    return candidates
+
+def _replacement(data: bytes, candidate: _Candidate, target: Tuple[int, int]) -> DecodedStreamObject:
+    stream = DecodedStreamObject()
+    for key, value in candidate.obj.items():
+        if key not in ("/Filter", "/DecodeParms", "/Length", "/ColorSpace", "/Width", "/Height", "/BitsPerComponent"):
+            stream[NameObject(key)] = value
+    stream[NameObject("/Filter")] = NameObject("/DCTDecode")
+    stream[NameObject("/ColorSpace")] = NameObject("/DeviceRGB" if candidate.mode == "RGB" else "/DeviceGray")
+    stream[NameObject("/Width")] = NumberObject(target[0])
+    stream[NameObject("/Height")] = NumberObject(target[1])
+    stream[NameObject("/BitsPerComponent")] = NumberObject(8)
+    stream.set_data(data)
+    return stream
+
+def _swap_object(writer: PdfWriter, ref: IndirectObject, obj) -> None:
+    """Put obj behind ref, so every page and form drawing the image gets it"""
+    # pypdf (pinned in requirements.txt) has no public call for this. Images
+    # are shared by reference, and pointing each /XObject entry at a new
+    # object instead would need the equally private _add_object
+    writer._replace_object(ref, obj)
+
+def _copy_source(source: PdfSource, out_path: Union[str, BinaryIO]) -> None:
+    """Write source unchanged to out_path"""
+    if isinstance(out_path, str):
+        if isinstance(source, bytes):
+            with open(out_path, "wb") as f:
+                f.write(source)
+        else:
+            shutil.copyfile(source, out_path)
+    elif isinstance(source, bytes):
+        out_path.write(source)
+    else:
+        with open(source, "rb") as f:
+            shutil.copyfileobj(f, out_path)
+
+def optimize_pdf_images(
+    source: PdfSource,
+    out_path: Union[str, BinaryIO],
+    target_dpi: float = 150,
+    target_size_bytes: Optional[int] = None,
+    quality: int = 80,
+    workers: int = 4,
+    cache: Optional[ImageCache] = None
+) -> Dict[str, float]:
+    """
+    Downsample and recompress the embedded images of a PDF
+
+    Images drawn at more than target_dpi are resampled to it and, like
+    large losslessly stored ones, re-encoded as JPEG; a new stream is only
+    used if it is clearly smaller. With target_size_bytes, further passes
+    lower the resolution (down to MIN_DPI) and quality until the document
+    fits. Images are recompressed on parallel threads (Pillow releases the
+    GIL while resampling and encoding), once per image shared by several
+    pages, and results are cached by the hash of the source stream.
+
+    A source path is read through a memory map, and with an out_path path
+    each pass is written to a file next to it, so neither the input nor the
+    passes of a large export are held in memory.
+
+    Args:
+        source: PDF path or bytes
+        out_path: Path or writable binary file object for the result; it is
+            a copy of source if nothing could be saved
+        target_dpi: Resolution of images at their drawn size
+        target_size_bytes: Size the document should fit in, if any
+        quality: JPEG quality of the first pass
+        workers: Images recompressed at once
+        cache: Cache of recompressed streams
+
+    Returns:
+        Statistics: images, recompressed, cache_hits, bytes_before, bytes_after, dpi, passes, seconds
+    """
+    started = time.monotonic()
+    bytes_before = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    on_disk = isinstance(out_path, str)
+    pass_path = f"{out_path}.pass" if on_disk else None
+    pass_buffer = None
+    result_size = None
+
+    stats = {"images": 0, "recompressed": 0, "cache_hits": 0, "bytes_before": bytes_before, "dpi": target_dpi, "passes": 0}
+    try:
+        with open_pdf(source) as reader:
+            writer = PdfWriter(clone_from=reader)
+            candidates = _plan(writer)
+            stats["images"] = len(candidates)
+            dpi = target_dpi
+            lock = threading.Lock()
+
+            def optimize(candidate: _Candidate) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+                target = _target_size(candidate.size, candidate.drawn, dpi)
+                key = f"{candidate.source_hash}-{target[0]}x{target[1]}-q{quality}"
+                data = cache.get(key) if cache is not None else None
+                if data is not None:
+                    with lock:
+                        stats["cache_hits"] += 1
+                else:
+                    try:
+                        data = _recompress(candidate.obj, candidate.mode, target, quality)
+                    except Exception as e:
+                        logger.warning(f"Image {candidate.ref.idnum} left as it is: {str(e)}")
+                        return None
+                    if cache is not None:
+                        cache.put(key, data)
+                if len(data) > candidate.raw_bytes * (1 - MIN_SAVINGS):
+                    return None
+                return data, target
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for _ in range(MAX_PASSES):
+                    stats["passes"] += 1
+                    stats["dpi"] = dpi
+                    replaced = 0
+                    image_bytes = 0
+                    for candidate, outcome in zip(candidates, executor.map(optimize, candidates)):
+                        if outcome is None:
+                            _swap_object(writer, candidate.ref, candidate.obj)
+                            image_bytes += candidate.raw_bytes
+                            continue
+                        data, target = outcome
+                        _swap_object(writer, candidate.ref, _replacement(data, candidate, target))
+                        image_bytes += len(data)
+                        replaced += 1
+                    stats["recompressed"] = replaced
+                    if not replaced:
+                        break
+                    if on_disk:
+                        with open(pass_path, "wb") as f:
+                            writer.write(f)
+                        result_size = os.path.getsize(pass_path)
+                    else:
+                        pass_buffer = io.BytesIO()
+                        writer.write(pass_buffer)
+                        result_size = pass_buffer.getbuffer().nbytes
+                    if target_size_bytes is None or result_size <= target_size_bytes or (dpi <= MIN_DPI and quality <= MIN_JPEG_QUALITY):
+                        break
+                    # Image bytes grow roughly with the pixel count, the square of the resolution
+                    budget = target_size_bytes - (result_size - image_bytes)
+                    shrink = math.sqrt(budget / image_bytes) if budget > 0 else 0.0
+                    dpi = max(MIN_DPI, dpi * min(0.9, shrink))
+                    quality = max(MIN_JPEG_QUALITY, quality - 10)
+
+        if result_size is None or result_size >= bytes_before:
+            result_size = bytes_before
+            stats["recompressed"] = 0
+            _copy_source(source, out_path)
+        elif on_disk:
+            os.replace(pass_path, out_path)
+        else:
+            out_path.write(pass_buffer.getbuffer())
+    finally:
+        if on_disk and os.path.exists(pass_path):
+            os.remove(pass_path)
+
+    stats["bytes_after"] = result_size
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    _count(
+        runs=1,
+        images_seen=stats["images"],
+        images_recompressed=stats["recompressed"],
+        cache_hits=stats["cache_hits"],
+        bytes_saved=bytes_before - result_size
+    )
+    if stats["recompressed"]:
+        logger.info(
+            f"Recompressed {stats['recompressed']} of {stats['images']} images at {stats['dpi']:.0f} dpi: "
+            f"{bytes_before / (1024 * 1024):.1f}MB -> {result_size / (1024 * 1024):.1f}MB in {stats['seconds']:.1f}s"
+        )
+    return stats
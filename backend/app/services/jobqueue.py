@@ -0,0 +1,394 @@
+import json
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from ..models import QueuedJob
+
+logger = logging.getLogger(__name__)
+
+# Jobs a worker picks from per claim; the fairest of them wins
+CLAIM_CANDIDATES = 32
+# Queued and running states, the ones an identical request may attach to
+ACTIVE_STATES = ("queued", "running")
+
+class JobQueue:
+    """
+    Durable job queue in the application database, with leases.
+
+    A worker claims a job by setting it running under its own name with a
+    lease that it extends by heartbeating. Every later change is made with
+    a conditional UPDATE on (job, state, owner), so a worker that lost its
+    lease can't overwrite the job another worker has taken over. Leases
+    that run out (the worker crashed or hung) are recovered by whichever
+    worker calls recover_expired() next.
+
+    Args:
+        engine: SQLAlchemy engine of the application database
+        lease_seconds: How long a claim holds without a heartbeat
+        max_attempts: Tries before a job is failed for good
+        retry_base_seconds: Backoff after the first failed try, doubled per try
+        retry_max_seconds: Upper bound of the backoff
+        aging: Seconds of predicted cost forgiven per second a job waits
+    """
+
+    def __init__(
+        self,
+        engine,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        retry_base_seconds: float = 5.0,
+        retry_max_seconds: float = 300.0,
+        aging: float = 1.0
+    ):
+        self.engine = engine
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.aging = aging
+
+    def _lease(self, now: datetime) -> datetime:
+        return now + timedelta(seconds=self.lease_seconds)
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before try attempts + 1, with jitter so failed jobs don't retry in lockstep"""
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def enqueue(
+        self,
+        job_id: str,
+        payload: dict,
+        tenant: str,
+        cost: float = 0.0,
+        fingerprint: Optional[str] = None,
+        kind: str = "export"
+    ) -> QueuedJob:
+        """
+        Add a job to the queue.
+
+        Args:
+            job_id: Unique ID of the job (the export ID)
+            payload: JSON-serialisable arguments for the worker
+            tenant: Tenant the job is charged to
+            cost: Predicted seconds of work
+            fingerprint: Lets identical requests attach to the job
+
+        Returns:
+            The stored job, or the active job with the same fingerprint if
+            another replica enqueued one since the caller looked
+        """
+        # The unique index on active fingerprints settles races between replicas;
+        # the loser attaches, or tries again if the winner has finished meanwhile
+        for attempt in range(2):
+            job = QueuedJob(
+                job_id=job_id,
+                kind=kind,
+                tenant=tenant,
+                fingerprint=fingerprint,
+                payload=json.dumps(payload, ensure_ascii=False),
+                cost=cost,
+                max_attempts=self.max_attempts
+            )
+            with Session(self.engine) as db:
+                db.add(job)
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    existing = self.find_active(fingerprint) if fingerprint else None
+                    if existing is not None:
+                        logger.info(f"Job {existing.job_id} with the same fingerprint was enqueued concurrently")
+                        return existing
+                    if not fingerprint or attempt:
+                        raise
+                    continue
+                db.refresh(job)
+            logger.info(f"Job {job_id} enqueued for {tenant} with predicted cost {cost:.1f}s")
+            return job
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        with Session(self.engine) as db:
+            return db.exec(select(QueuedJob).where(QueuedJob.job_id == job_id)).first()
+
+    def find_active(self, fingerprint: str) -> Optional[QueuedJob]:
+        """The queued or running job with this fingerprint, if any"""
+        with Session(self.engine) as db:
+            return db.exec(
+                select(QueuedJob)
+                .where(QueuedJob.fingerprint == fingerprint, QueuedJob.state.in_(ACTIVE_STATES))
+                .order_by(QueuedJob.id.desc())
+            ).first()
+
+    def claim(
+        self,
+        owner: str,
+        kinds: Optional[List[str]] = None,
+        weight: Optional[Callable[[str], float]] = None
+    ) -> Optional[QueuedJob]:
+        """
+        Lease the next job to a worker.
+
+        Among the available jobs, tenants with the fewest running jobs per
+        unit of weight go first; within a tenant the job with the lowest
+        cost minus aging credit wins. Several workers may race for the same
+        job: the conditional UPDATE lets exactly one of them have it, and
+        the others move on to the next candidate.
+
+        Args:
+            owner: Unique name of the claiming worker
+            kinds: Job kinds the worker runs (all if None)
+            weight: Scheduling weight of a tenant (1.0 for all if None)
+
+        Returns:
+            The claimed job, or None if nothing is available
+        """
+        now = datetime.utcnow()
+        with Session(self.engine) as db:
+            query = select(QueuedJob).where(QueuedJob.state == "queued", QueuedJob.available_at <= now)
+            if kinds:
+                query = query.where(QueuedJob.kind.in_(kinds))
+            candidates = db.exec(query.order_by(QueuedJob.available_at).limit(CLAIM_CANDIDATES)).all()
+            if not candidates:
+                return None
+            running = dict(db.exec(
+                select(QueuedJob.tenant, func.count())
+                .where(QueuedJob.state == "running")
+                .group_by(QueuedJob.tenant)
+            ).all())
+
+            def rank(job: QueuedJob):
+                share = running.get(job.tenant, 0) / max(weight(job.tenant) if weight else 1.0, 1e-6)
+                waited = (now - job.available_at).total_seconds()
+                return share, job.cost - self.aging * waited
+
+            for job in sorted(candidates, key=rank):
+                claimed = db.execute(
+                    update(QueuedJob)
+                    .where(QueuedJob.id == job.id, QueuedJob.state == "queued")
+                    .values(
+                        state="running",
+                        lease_owner=owner,
+                        lease_expires_at=self._lease(now),
+                        attempts=QueuedJob.attempts + 1,
+                        stage="queued",
+                        progress=0.0,
+                        started_at=now
+                    )
+                ).rowcount
+                db.commit()
+                if claimed:
+                    db.refresh(job)
+                    logger.info(f"Job {job.job_id} claimed by {owner} (attempt {job.attempts})")
+                    return job
+        return None
+
+    def _update_owned(self, job_id: str, owner: str, **values) -> bool:
+        """Change a running job, if owner still holds its lease"""
+        with Session(self.engine) as db:
+            changed = db.execute(
+                update(QueuedJob)
+                .where(QueuedJob.job_id == job_id, QueuedJob.state == "running", QueuedJob.lease_owner == owner)
+                .values(**values)
+            ).rowcount
+            db.commit()
+        return changed > 0
+
+    def heartbeat(self, job_id: str, owner: str, stage: Optional[str] = None, progress: Optional[float] = None) -> bool:
+        """
+        Extend a lease and record progress.
+
+        Returns:
+            False if owner no longer holds the lease and should stop the job
+        """
+        values = {"lease_expires_at": self._lease(datetime.utcnow())}
+        if stage is not None:
+            values["stage"] = stage
+        if progress is not None:
+            values["progress"] = progress
+        return self._update_owned(job_id, owner, **values)
+
+    def complete(self, job_id: str, owner: str, result: dict) -> bool:
+        done = self._update_owned(
+            job_id, owner,
+            state="completed",
+            stage="completed",
+            progress=1.0,
+            result=json.dumps(result, ensure_ascii=False),
+            error=None,
+            lease_owner=None,
+            lease_expires_at=None,
+            finished_at=datetime.utcnow()
+        )
+        if done:
+            logger.info(f"Job {job_id} completed by {owner}")
+        return done
+
+    def fail(self, job_id: str, owner: str, error: str, retryable: bool = True, status_code: int = 500) -> Optional[str]:
+        """
+        Record a failed try: retry it after a backoff, or fail the job.
+
+        Args:
+            error: Error message for the status endpoint and logs
+            retryable: False for errors another try can't fix (bad input)
+            status_code: HTTP status reported if the job fails for good
+
+        Returns:
+            The new state (queued or failed), or None if owner lost the lease
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        now = datetime.utcnow()
+        if retryable and job.attempts < job.max_attempts:
+            delay = self.backoff(job.attempts)
+            requeued = self._update_owned(
+                job_id, owner,
+                state="queued",
+                stage="retrying",
+                error=error,
+                lease_owner=None,
+                lease_expires_at=None,
+                available_at=now + timedelta(seconds=delay)
+            )
+            if not requeued:
+                return None
+            logger.warning(f"Job {job_id} failed (attempt {job.attempts}), retrying in {delay:.1f}s: {error}")
+            return "queued"
+        failed = self._update_owned(
+            job_id, owner,
+            state="failed",
+            stage="failed",
+            error=error,
+            result=json.dumps({"status_code": status_code}),
+            lease_owner=None,
+            lease_expires_at=None,
+            finished_at=now
+        )
+        if not failed:
+            return None
+        logger.error(f"Job {job_id} failed after {job.attempts} attempt(s): {error}")
+        return "failed"
+
+    def release(self, job_id: str, owner: str) -> bool:
+        """Hand a job back without counting the try (the worker is shutting down)"""
+        released = self._update_owned(
+            job_id, owner,
+            state="queued",
+            stage="queued",
+            progress=0.0,
+            attempts=QueuedJob.attempts - 1,
+            lease_owner=None,
+            lease_expires_at=None,
+            available_at=datetime.utcnow()
+        )
+        if released:
+            logger.info(f"Job {job_id} released by {owner}")
+        return released
+
+    def recover_expired(self) -> int:
+        """
+        Requeue running jobs whose lease ran out, or fail them once out of tries.
+
+        Returns:
+            Number of jobs recovered
+        """
+        now = datetime.utcnow()
+        recovered = 0
+        with Session(self.engine) as db:
+            expired = db.exec(
+                select(QueuedJob).where(QueuedJob.state == "running", QueuedJob.lease_expires_at < now)
+            ).all()
+            for job in expired:
+                error = f"lease of {job.lease_owner} expired"
+                if job.attempts < job.max_attempts:
+                    values = dict(
+                        state="queued",
+                        stage="retrying",
+                        available_at=now + timedelta(seconds=self.backoff(job.attempts))
+                    )
+                else:
+                    values = dict(
+                        state="failed",
+                        stage="failed",
+                        result=json.dumps({"status_code": 500}),
+                        finished_at=now
+                    )
+                # Only if the owner hasn't heartbeated since we looked
+                changed = db.execute(
+                    update(QueuedJob)
+                    .where(
+                        QueuedJob.id == job.id,
+                        QueuedJob.state == "running",
+                        QueuedJob.lease_owner == job.lease_owner,
+                        QueuedJob.lease_expires_at == job.lease_expires_at
+                    )
+                    .values(error=error, lease_owner=None, lease_expires_at=None, **values)
+                ).rowcount
+                db.commit()
+                if changed:
+                    recovered += 1
+                    logger.warning(f"Job {job.job_id}: {error}, now {values['state']}")
+        return recovered
+
+    def prune(self, older_than: timedelta) -> int:
+        """Delete completed and failed jobs that finished before now - older_than"""
+        cutoff = datetime.utcnow() - older_than
+        with Session(self.engine) as db:
+            old = db.exec(
+                select(QueuedJob).where(
+                    QueuedJob.state.in_(("completed", "failed")),
+                    QueuedJob.finished_at < cutoff
+                )
+            ).all()
+            for job in old:
+                db.delete(job)
+            db.commit()
+        return len(old)
+
+    def depth(self) -> int:
+        """Number of queued jobs, including ones backing off"""
+        with Session(self.engine) as db:
+            return db.exec(select(func.count()).select_from(QueuedJob).where(QueuedJob.state == "queued")).one()
+
+    def estimate(self, job: QueuedJob) -> float:
+        """Predicted seconds until a job finishes, with the running jobs as the measure of worker capacity"""
+        if job.state == "running":
+            return job.cost * (1.0 - job.progress)
+        if job.state != "queued":
+            return 0.0
+        with Session(self.engine) as db:
+            ahead = db.exec(
+                select(func.coalesce(func.sum(QueuedJob.cost), 0.0))
+                .where(QueuedJob.state == "queued", QueuedJob.available_at < job.available_at)
+            ).one()
+            running = db.exec(select(func.count()).select_from(QueuedJob).where(QueuedJob.state == "running")).one()
+        return max(0.0, ahead / max(running, 1) + job.cost)
+
+    def stats(self) -> Dict:
+        """Job counts per state, queued and running work, and the workers holding leases"""
+        with Session(self.engine) as db:
+            counts = dict(db.exec(select(QueuedJob.state, func.count()).group_by(QueuedJob.state)).all())
+            active = db.exec(select(QueuedJob).where(QueuedJob.state.in_(ACTIVE_STATES))).all()
+        now = datetime.utcnow()
+        queued = [job for job in active if job.state == "queued"]
+        running = [job for job in active if job.state == "running"]
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "retrying": sum(1 for job in queued if job.attempts > 0),
+            "queued_cost_seconds": round(sum(job.cost for job in queued), 1),
+            "running_remaining_seconds": round(sum(job.cost * (1.0 - job.progress) for job in running), 1),
+            "oldest_queued_seconds": round(max(
+                ((now - job.created_at).total_seconds() for job in queued), default=0.0
+            ), 1),
+            "workers": len({job.lease_owner for job in running}),
+        }
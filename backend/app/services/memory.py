@@ -0,0 +1,278 @@
+import os
+import logging
+import threading
+import tracemalloc
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = Path(__file__).resolve().parent.parent
+# Named snapshots kept for diffing; the oldest is dropped beyond this
+MAX_SNAPSHOTS = 8
+# Source lines listed per module in a diff
+TOP_LINES = 5
+
+def _status_kb(field: str) -> Optional[int]:
+    """A kB field of /proc/self/status, None where there is no procfs"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of the process"""
+    kb = _status_kb("VmRSS")
+    return kb * 1024 if kb is not None else None
+
+def peak_rss_bytes() -> Optional[int]:
+    """Highest resident set size the process has reached"""
+    kb = _status_kb("VmHWM")
+    if kb is not None:
+        return kb * 1024
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+def open_fd_count() -> Optional[int]:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+def child_process_count() -> Optional[int]:
+    """Live child processes (LibreOffice, text extraction workers, ...)"""
+    try:
+        children = set()
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children", "r") as f:
+                children.update(f.read().split())
+        return len(children)
+    except OSError:
+        return None
+
+def gauges() -> Dict[str, Optional[float]]:
+    rss = rss_bytes()
+    peak = peak_rss_bytes()
+    return {
+        "rss_mb": round(rss / (1024 * 1024), 1) if rss is not None else None,
+        "peak_rss_mb": round(peak / (1024 * 1024), 1) if peak is not None else None,
+        "open_fds": open_fd_count(),
+        "child_processes": child_process_count(),
+        "threads": threading.active_count(),
+    }
+
+class MemoryProbe:
+    """
+    RSS and peak RSS change over a block of work.
+
+    Other threads allocate at the same time, so a delta is the process's
+    growth while the work ran, not what the work alone allocated; averaged
+    over many runs it still points at the expensive kinds of work.
+    """
+
+    def __init__(self):
+        self.rss_before = rss_bytes()
+        self.peak_before = peak_rss_bytes()
+
+    def deltas(self) -> Dict[str, Optional[float]]:
+        """rss_delta_mb and peak_delta_mb since the probe was created"""
+        rss, peak = rss_bytes(), peak_rss_bytes()
+        return {
+            "rss_delta_mb": (rss - self.rss_before) / (1024 * 1024)
+            if rss is not None and self.rss_before is not None else None,
+            "peak_delta_mb": (peak - self.peak_before) / (1024 * 1024)
+            if peak is not None and self.peak_before is not None else None,
+        }
+
+class MemoryRecorder:
+    """Per-route (or per-kind) totals of the memory deltas of recent work"""
+
+    def __init__(self):
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, deltas: Dict[str, Optional[float]]) -> None:
+        rss = deltas.get("rss_delta_mb")
+        peak = deltas.get("peak_delta_mb")
+        if rss is None:
+            return
+        with self._lock:
+            entry = self.totals.setdefault(
+                name, {"count": 0, "rss_delta_mb": 0.0, "max_rss_delta_mb": 0.0, "peak_delta_mb": 0.0}
+            )
+            entry["count"] += 1
+            entry["rss_delta_mb"] += rss
+            entry["max_rss_delta_mb"] = max(entry["max_rss_delta_mb"], rss)
+            entry["peak_delta_mb"] += peak or 0.0
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    "count": entry["count"],
+                    "total_rss_delta_mb": round(entry["rss_delta_mb"], 1),
+                    "avg_rss_delta_mb": round(entry["rss_delta_mb"] / entry["count"], 2),
+                    "max_rss_delta_mb": round(entry["max_rss_delta_mb"], 1),
+                    "total_peak_delta_mb": round(entry["peak_delta_mb"], 1),
+                }
+                for name, entry in sorted(self.totals.items())
+            }
+
+@lru_cache(maxsize=4096)
+def module_group(filename: str) -> Tuple[Optional[str], bool]:
+    """
+    Module an allocation site belongs to, and whether it is app code
+
+    App modules are named after their service (converter, merger, ...), with
+    main.py as "routes"; third-party code by its top-level package.
+    """
+    path = Path(filename)
+    try:
+        relative = path.resolve().relative_to(APP_DIR)
+    except (ValueError, OSError):
+        relative = None
+    if relative is not None:
+        return ("routes" if relative.name == "main.py" else relative.stem), True
+    parts = path.parts
+    if "site-packages" in parts:
+        index = parts.index("site-packages")
+        if index + 1 < len(parts):
+            return parts[index + 1].split(".")[0], False
+    return None, False
+
+def _attribute(traceback: tracemalloc.Traceback) -> Tuple[str, str]:
+    """
+    (module, "file:line") an allocation is charged to
+
+    The innermost app frame wins, so a pypdf object allocated for a merge is
+    charged to merger; allocations outside app code go to the package of
+    their innermost frame.
+    """
+    fallback = None
+    for frame in reversed(traceback):
+        group, in_app = module_group(frame.filename)
+        if in_app:
+            return group, f"{Path(frame.filename).name}:{frame.lineno}"
+        if group is not None and fallback is None:
+            fallback = (group, f"{Path(frame.filename).name}:{frame.lineno}")
+    if fallback is not None:
+        return fallback
+    if not len(traceback):
+        return "other", "?"
+    frame = traceback[-1]
+    return "other", f"{Path(frame.filename).name}:{frame.lineno}"
+
+class SnapshotStore:
+    """
+    Named tracemalloc snapshots for leak hunting.
+
+    Tracing starts with the first snapshot and slows allocation-heavy code
+    down noticeably, so it is only on between an operator's first snapshot
+    and stop().
+    """
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self.snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def take(self, name: str) -> Dict:
+        """Take a snapshot, starting tracing if it is off"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info(f"tracemalloc started with {self.frames} frames")
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        with self._lock:
+            self.snapshots.pop(name, None)
+            self.snapshots[name] = snapshot
+            while len(self.snapshots) > MAX_SNAPSHOTS:
+                self.snapshots.popitem(last=False)
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "name": name,
+            "traced_mb": round(traced / (1024 * 1024), 2),
+            "traced_peak_mb": round(peak / (1024 * 1024), 2),
+            "modules": self._by_module(snapshot),
+        }
+
+    def get(self, name: str) -> Optional[tracemalloc.Snapshot]:
+        with self._lock:
+            return self.snapshots.get(name)
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self.snapshots)
+
+    def stop(self) -> None:
+        """Stop tracing and drop all snapshots"""
+        with self._lock:
+            self.snapshots.clear()
+        tracemalloc.stop()
+
+    @staticmethod
+    def _group(snapshot: tracemalloc.Snapshot) -> Dict[str, Dict[str, List[int]]]:
+        """Bytes and blocks per module and allocation site"""
+        groups: Dict[str, Dict[str, List[int]]] = {}
+        for stat in snapshot.statistics("traceback"):
+            module, site = _attribute(stat.traceback)
+            entry = groups.setdefault(module, {}).setdefault(site, [0, 0])
+            entry[0] += stat.size
+            entry[1] += stat.count
+        return groups
+
+    def _by_module(self, snapshot: tracemalloc.Snapshot) -> Dict[str, float]:
+        totals = {
+            module: sum(size for size, _ in sites.values())
+            for module, sites in self._group(snapshot).items()
+        }
+        return {
+            module: round(size / (1024 * 1024), 3)
+            for module, size in sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        }
+
+    def diff(self, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> List[Dict]:
+        """
+        Memory growth between two snapshots, grouped by module
+
+        Returns:
+            Modules by growth, largest first, each with its top growing lines
+        """
+        old, new = self._group(before), self._group(after)
+        result = []
+        for module in set(old) | set(new):
+            old_sites, new_sites = old.get(module, {}), new.get(module, {})
+            sites = []
+            for site in set(old_sites) | set(new_sites):
+                size_before, count_before = old_sites.get(site, (0, 0))
+                size_after, count_after = new_sites.get(site, (0, 0))
+                if size_after != size_before or count_after != count_before:
+                    sites.append((site, size_after - size_before, count_after - count_before))
+            if not sites:
+                continue
+            sites.sort(key=lambda site: site[1], reverse=True)
+            result.append({
+                "module": module,
+                "size_delta_kb": round(sum(site[1] for site in sites) / 1024, 1),
+                "blocks_delta": sum(site[2] for site in sites),
+                "top_lines": [
+                    {"line": site, "size_delta_kb": round(size / 1024, 1), "blocks_delta": count}
+                    for site, size, count in sites[:TOP_LINES]
+                ],
+            })
+        result.sort(key=lambda entry: entry["size_delta_kb"], reverse=True)
+        return result
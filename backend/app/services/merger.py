@@ -1,79 +1,860 @@
+import io
 import os
+import mmap
+import zlib
 import logging
-from pathlib import Path
-from pypdf import PdfMerger, PdfReader
-from typing import List, Optional
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import pypdf
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+    TextStringObject,
+)
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from .finishing import FinishingError, FinishingSpec, build_info, build_xmp, render_text_image
 
 logger = logging.getLogger(__name__)
 
+# Bump when the merge output changes for identical inputs
+MERGE_PIPELINE_VERSION = "3"
+
+# Inputs at least this large count against the merge memory budget
+LARGE_INPUT_BYTES = 16 * 1024 * 1024
+# Default bytes of large inputs one export may keep open
+DEFAULT_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024
+# Inputs opened ahead of the one being copied
+MAX_PREFETCH = 4
+# Size of inserted blank pages when there is no previous page
+A4_SIZE = (595.28, 841.89)
+# Page attributes that only make sense inside the source document
+_DROPPED_PAGE_KEYS = ("/Parent", "/B", "/StructParents")
+
 class MergeError(Exception):
     """Custom exception for PDF merging errors"""
     pass
 
-def merge_pdfs(pdf_paths: List[str], out_path: str) -> str:
+class PageRangeError(MergeError):
+    """Custom exception for page selections that don't fit their document"""
+    pass
+
+# A PDF input: path of a file, or the document itself when it is kept in memory
+PdfSource = Union[str, bytes]
+
+class MergePart:
+    """
+    One entry of a merge: pages of a PDF file, or inserted blank pages.
+
+    path is a file path or the PDF itself as bytes. pages uses 1-based
+    ranges such as "3-7", "1,4,10-" (from 10 to the end); rotate is added
+    clockwise to each page's own rotation.
+    """
+
+    def __init__(self, path: Optional[PdfSource] = None, pages: Optional[str] = None, rotate: int = 0, blank: int = 0):
+        self.path = path
+        self.pages = pages
+        self.rotate = rotate % 360
+        self.blank = blank
+
+def parse_page_ranges(spec: str) -> List[Tuple[int, Optional[int]]]:
+    """
+    Parse a page range specification
+
+    Args:
+        spec: Comma-separated 1-based pages or ranges, e.g. "1,3-7,10-"
+
+    Returns:
+        List of (first, last) pairs; last is None for open-ended ranges
+
+    Raises:
+        ValueError: If the specification is malformed
+    """
+    ranges = []
+    for item in spec.replace(" ", "").split(","):
+        if not item:
+            raise ValueError("empty range")
+        first, sep, last = item.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            raise ValueError(f"'{item}' is not a page or range")
+        start = int(first)
+        end = (int(last) if last else None) if sep else start
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"'{item}' is not a valid range")
+        ranges.append((start, end))
+    return ranges
+
+def select_pages(spec: str, page_count: int) -> List[int]:
+    """
+    Resolve a page range specification against a document
+
+    Returns:
+        0-based page indices in the requested order
+
+    Raises:
+        PageRangeError: If the specification is malformed or past the last page
+    """
+    try:
+        ranges = parse_page_ranges(spec)
+    except ValueError as e:
+        raise PageRangeError(f"Invalid page range '{spec}': {str(e)}")
+
+    indices = []
+    for start, end in ranges:
+        end = page_count if end is None else end
+        if end > page_count or start > page_count:
+            raise PageRangeError(f"Page range '{spec}' is outside the document ({page_count} pages)")
+        indices.extend(range(start - 1, end))
+    return indices
+
+class MemoryBudget:
+    """
+    Limits the bytes of large inputs an export keeps open at the same time.
+
+    Each large input reserves its file size before it is opened and gives it
+    back once it has been copied. A single input bigger than the whole budget
+    is still admitted, but only on its own.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = max(1, limit_bytes)
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, amount: int) -> int:
+        """
+        Block until amount bytes fit in the budget
+
+        Returns:
+            The reserved amount, to be passed back to release()
+        """
+        amount = min(amount, self.limit)
+        with self._cond:
+            while self.used and self.used + amount > self.limit:
+                self._cond.wait()
+            self.used += amount
+        return amount
+
+    def release(self, amount: int) -> None:
+        with self._cond:
+            self.used = max(0, self.used - amount)
+            self._cond.notify_all()
+
+def source_name(source: PdfSource) -> str:
+    """Name of a PDF input for logs and as its identity within a merge"""
+    return source if isinstance(source, str) else f"<in-memory PDF {id(source):x}>"
+
+@contextmanager
+def open_pdf(pdf_path: PdfSource) -> Iterator[PdfReader]:
+    """
+    Open a PDF through a read-only memory map, or from bytes already in memory
+
+    Object data is read straight from the page cache, so large inputs are
+    not copied into private memory and are shared between workers.
+    """
+    if isinstance(pdf_path, bytes):
+        if not pdf_path:
+            raise MergeError("PDF data is empty")
+        reader = PdfReader(io.BytesIO(pdf_path))
+        if reader.is_encrypted:
+            reader.decrypt("")
+        yield reader
+        return
+
+    with open(pdf_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise MergeError(f"PDF file is empty: {pdf_path}")
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            reader = PdfReader(buffer)
+            if reader.is_encrypted:
+                reader.decrypt("")
+            yield reader
+        finally:
+            _close_buffer(buffer)
+
+def _close_buffer(buffer: mmap.mmap) -> None:
+    try:
+        buffer.close()
+    except BufferError:
+        # Still referenced by a parsed object; unmapped once that is collected
+        pass
+
+def _resolve(obj: Optional[PdfObject]) -> Optional[PdfObject]:
+    return obj.get_object() if obj is not None else None
+
+def _page_size(page, rotate: int = 0) -> Tuple[float, float]:
+    """Displayed (width, height) of a page after rotation"""
+    box = page.mediabox
+    width, height = float(box.width), float(box.height)
+    turns = (int(_resolve(page.get("/Rotate")) or 0) + rotate) % 180
+    return (height, width) if turns == 90 else (width, height)
+
+def _iter_name_tree(node: DictionaryObject, depth: int = 0) -> Iterator[Tuple[str, PdfObject]]:
+    """Yield (name, raw value) pairs from a PDF name tree"""
+    if depth > 32:
+        return
+    names = _resolve(node.get("/Names"))
+    if isinstance(names, ArrayObject):
+        for i in range(0, len(names) - 1, 2):
+            yield str(names[i]), names[i + 1]
+    for kid in _resolve(node.get("/Kids")) or []:
+        yield from _iter_name_tree(kid.get_object(), depth + 1)
+
+class _StreamingPdfWriter:
+    """
+    Writes a merged PDF object by object.
+
+    pypdf's PdfWriter keeps every copied object until write(), so its memory
+    grows with the size of the export. Here each object is serialised as soon
+    as it has been copied from its source document and only xref offsets are
+    kept, so memory is bounded by the largest input object instead.
+    Outlines and named destinations of all inputs are carried over.
+    """
+
+    def __init__(self, out, finishing: Optional[FinishingSpec] = None):
+        self.out = out
+        self.finishing = finishing
+        self._shared: Dict[str, int] = {}
+        self._image_sizes: Dict[str, Tuple[float, float]] = {}
+        self.offsets: List[Optional[int]] = []
+        self.page_numbers: List[int] = []
+        self.outline_items: List[Tuple[int, DictionaryObject]] = []
+        self.named_destinations: Dict[str, PdfObject] = {}
+        self.last_page_size = A4_SIZE
+        self._sources: Dict[str, Dict] = {}
+
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.catalog_number = self._allocate()
+        self.pages_number = self._allocate()
+
+    def _allocate(self) -> int:
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    @staticmethod
+    def _ref(number: int) -> IndirectObject:
+        return IndirectObject(number, 0, None)
+
+    def _write(self, number: int, obj: PdfObject) -> None:
+        self.offsets[number - 1] = self.out.tell()
+        self.out.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self.out)
+        self.out.write(b"\nendobj\n")
+
+    def add_document(
+        self,
+        reader: PdfReader,
+        source: Optional[str] = None,
+        page_indices: Optional[List[int]] = None,
+        rotate: int = 0
+    ) -> int:
+        """
+        Copy pages of a document, with everything they reference
+
+        Objects are copied once per source: selecting pages of the same file
+        again only adds new page dictionaries pointing at the content,
+        fonts and images that were already written.
+
+        Args:
+            reader: Source document
+            source: Identifies the document across calls (usually its path)
+            page_indices: 0-based pages to take, in order; all pages if None
+            rotate: Clockwise rotation added to each page, a multiple of 90
+
+        Returns:
+            Number of pages added
+        """
+        source = source or f"document-{id(reader)}"
+        state = self._sources.setdefault(source, {"refs": {}, "pages": {}, "outline": False})
+        refs: Dict[Tuple[int, int], int] = state["refs"]
+        pending: List[Tuple[int, IndirectObject]] = []
+
+        pages = reader.pages
+        whole_document = page_indices is None
+        if whole_document:
+            page_indices = list(range(len(pages)))
+
+        # Pages are numbered up front so that links, outlines and annotations
+        # pointing at them resolve to the merged pages. Links to pages that
+        # were left out become null rather than dragging those pages in.
+        page_targets: Dict[Tuple[int, int], Optional[int]] = {}
+        for page in pages:
+            if page.indirect_reference is not None:
+                page_targets[(page.indirect_reference.idnum, page.indirect_reference.generation)] = None
+        page_targets.update(state["pages"])
+        numbers = []
+        for index in page_indices:
+            number = self._allocate()
+            ref = pages[index].indirect_reference
+            if ref is not None and page_targets.get((ref.idnum, ref.generation)) is None:
+                page_targets[(ref.idnum, ref.generation)] = number
+            numbers.append(number)
+
+        def translate(obj: PdfObject) -> PdfObject:
+            if isinstance(obj, IndirectObject):
+                key = (obj.idnum, obj.generation)
+                if key in page_targets:
+                    target = page_targets[key]
+                    return NullObject() if target is None else self._ref(target)
+                if key not in refs:
+                    refs[key] = self._allocate()
+                    pending.append((refs[key], obj))
+                return self._ref(refs[key])
+            if isinstance(obj, StreamObject):
+                copy = EncodedStreamObject() if isinstance(obj, EncodedStreamObject) else DecodedStreamObject()
+                for key, value in obj.items():
+                    if key != "/Length":
+                        copy[key] = translate(value)
+                copy._data = obj._data
+                return copy
+            if isinstance(obj, DictionaryObject):
+                copy = DictionaryObject()
+                for key, value in obj.items():
+                    copy[key] = translate(value)
+                return copy
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(translate(value) for value in obj)
+            return obj
+
+        def flush() -> None:
+            while pending:
+                number, ref = pending.pop()
+                obj = ref.get_object()
+                self._write(number, NullObject() if obj is None else translate(obj))
+                # Only the copy was needed; let the parsed source object go
+                reader.resolved_objects.pop((ref.generation, ref.idnum), None)
+
+        try:
+            stamping = self.finishing is not None and self.finishing.has_stamps
+            for position, (index, number) in enumerate(zip(page_indices, numbers)):
+                page = pages[index]
+                copy = DictionaryObject()
+                for key, value in page.items():
+                    if key not in _DROPPED_PAGE_KEYS and not (stamping and key in ("/Contents", "/Resources")):
+                        copy[NameObject(key)] = translate(value)
+                copy[NameObject("/Parent")] = self._ref(self.pages_number)
+                if rotate:
+                    current = int(_resolve(page.get("/Rotate")) or 0)
+                    copy[NameObject("/Rotate")] = NumberObject((current + rotate) % 360)
+                if stamping:
+                    self._stamp_page(copy, page, translate, len(self.page_numbers) + position + 1)
+                self._write(number, copy)
+                flush()
+                self.last_page_size = _page_size(page, rotate)
+
+            # Outlines and named destinations only make sense for a whole
+            # document, and are carried over once per source
+            outline_items = []
+            named_destinations = {}
+            if whole_document and not state["outline"]:
+                root = reader.trailer["/Root"]
+                outline_items = self._copy_outline(root, refs, translate)
+                flush()
+                named_destinations = self._copy_named_destinations(root, translate)
+                flush()
+                state["outline"] = True
+        except Exception:
+            # Objects of this source may now be referenced but unwritten
+            self._sources.pop(source, None)
+            raise
+
+        # Only publish the pages once they have been copied completely
+        for key, target in page_targets.items():
+            if target is not None:
+                state["pages"].setdefault(key, target)
+        self.page_numbers.extend(numbers)
+        self.outline_items.extend(outline_items)
+        for name, dest in named_destinations.items():
+            self.named_destinations.setdefault(name, dest)
+        return len(numbers)
+
+    def add_blank_pages(self, count: int, size: Optional[Tuple[float, float]] = None) -> int:
+        """
+        Insert empty pages, sized like the previous page unless size is given
+
+        Returns:
+            Number of pages added
+        """
+        width, height = size or self.last_page_size
+        for _ in range(count):
+            number = self._allocate()
+            page = DictionaryObject({
+                NameObject("/Type"): NameObject("/Page"),
+                NameObject("/Parent"): self._ref(self.pages_number),
+                NameObject("/MediaBox"): ArrayObject([
+                    NumberObject(0), NumberObject(0), FloatObject(width), FloatObject(height)
+                ]),
+                NameObject("/Resources"): DictionaryObject(),
+            })
+            if self.finishing is not None and self.finishing.has_stamps:
+                self._stamp_page(page, page, lambda obj: obj, len(self.page_numbers) + 1)
+            self._write(number, page)
+            self.page_numbers.append(number)
+        return count
+
+    def _shared_object(self, name: str, build) -> IndirectObject:
+        """Write an object used by many pages once, on first use"""
+        if name not in self._shared:
+            number = self._allocate()
+            self._write(number, build())
+            self._shared[name] = number
+        return self._ref(self._shared[name])
+
+    def _stamp_font(self) -> DictionaryObject:
+        return DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        })
+
+    def _stamp_image(self, name: str) -> Optional[IndirectObject]:
+        """A rendered text stamp (footer, watermark) as an image XObject, or None if it can't be rendered"""
+        if name not in self._shared and f"{name}-failed" not in self._shared:
+            text, font_size, gray, opacity = self.finishing.stamp_images()[name]
+            try:
+                width, height, alpha, width_pt, height_pt = render_text_image(text, font_size, opacity)
+            except FinishingError as e:
+                logger.error(f"Stamp {name} skipped: {str(e)}")
+                self._shared[f"{name}-failed"] = 0
+                return None
+
+            def image_stream(extra: Dict, data: bytes) -> EncodedStreamObject:
+                stream = EncodedStreamObject()
+                stream.update({
+                    NameObject("/Type"): NameObject("/XObject"),
+                    NameObject("/Subtype"): NameObject("/Image"),
+                    NameObject("/Width"): NumberObject(width),
+                    NameObject("/Height"): NumberObject(height),
+                    NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+                    NameObject("/BitsPerComponent"): NumberObject(8),
+                    NameObject("/Filter"): NameObject("/FlateDecode"),
+                    **extra,
+                })
+                stream._data = data
+                return stream
+
+            # Solid grey glyphs whose shape comes from the anti-aliased alpha mask
+            mask = self._shared_object(f"{name}-mask", lambda: image_stream({}, alpha))
+            self._shared_object(name, lambda: image_stream(
+                {NameObject("/SMask"): mask}, zlib.compress(bytes([gray]) * (width * height))
+            ))
+            self._image_sizes[name] = (width_pt, height_pt)
+        if name not in self._shared:
+            return None
+        return self._ref(self._shared[name])
+
+    def _stamp_page(self, copy: DictionaryObject, page: DictionaryObject, translate, page_number: int) -> None:
+        """
+        Add the finishing stamps to a page being copied
+
+        The original content is wrapped in q/Q so its graphics state can't
+        leak into the stamp, and the stamp is drawn in the displayed page's
+        orientation whatever the page's /Rotate.
+        """
+        images = {name: self._stamp_image(name) for name in self.finishing.stamp_images()}
+        box = _resolve(page.get("/MediaBox"))
+        x0, y0, x1, y1 = (float(_resolve(v)) for v in box) if box else (0.0, 0.0) + A4_SIZE
+        width, height = x1 - x0, y1 - y0
+        rotation = int(_resolve(copy.get("/Rotate")) or 0) % 360
+        shown_width, shown_height = (height, width) if rotation in (90, 270) else (width, height)
+
+        operators = self.finishing.stamp_operators(page_number, shown_width, shown_height, self._image_sizes)
+
+        # Resources: the page's own, plus the stamp font and images
+        resources = DictionaryObject()
+        source = _resolve(page.get("/Resources"))
+        if isinstance(source, DictionaryObject):
+            for key, value in source.items():
+                if key not in ("/Font", "/XObject"):
+                    resources[key] = translate(value)
+        for category, stamps in (
+            ("/Font", {"/FStamp": self._shared_object("font", self._stamp_font)}),
+            ("/XObject", images),
+        ):
+            entries = DictionaryObject()
+            existing = _resolve(source.get(category)) if isinstance(source, DictionaryObject) else None
+            if isinstance(existing, DictionaryObject):
+                for key, value in existing.items():
+                    entries[key] = translate(value)
+            for name, ref in stamps.items():
+                if ref is not None:
+                    entries[NameObject(name)] = ref
+            if entries:
+                resources[NameObject(category)] = entries
+        copy[NameObject("/Resources")] = resources
+
+        # Contents: q, original streams, Q, stamp
+        contents = ArrayObject()
+        if operators:
+            contents.append(self._shared_object("save", lambda: self._content_stream(b"q\n")))
+        raw = page.raw_get("/Contents") if "/Contents" in page else None
+        resolved = _resolve(raw)
+        if isinstance(resolved, ArrayObject):
+            contents.extend(translate(item) for item in resolved)
+        elif raw is not None:
+            contents.append(translate(raw))
+        if operators:
+            matrix = display_matrix(rotation, x0, y0, width, height)
+            stamp = b"\nQ\nq " + matrix.encode("ascii") + b" cm\n" + operators + b"\nQ\n"
+            stamp_number = self._allocate()
+            self._write(stamp_number, self._content_stream(stamp))
+            contents.append(self._ref(stamp_number))
+        if contents:
+            copy[NameObject("/Contents")] = contents
+
+    @staticmethod
+    def _content_stream(data: bytes) -> DecodedStreamObject:
+        stream = DecodedStreamObject()
+        stream._data = data
+        return stream
+
+    def _copy_outline(self, root: DictionaryObject, refs, translate) -> List[Tuple[int, DictionaryObject]]:
+        """Copy the top-level outline items of a document; nested items are written directly"""
+        outlines = _resolve(root.get("/Outlines"))
+        if not isinstance(outlines, DictionaryObject) or "/First" not in outlines:
+            return []
+
+        top_level = []
+        seen = set()
+        ref = outlines.raw_get("/First")
+        while isinstance(ref, IndirectObject) and (ref.idnum, ref.generation) not in seen:
+            seen.add((ref.idnum, ref.generation))
+            number = self._allocate()
+            refs[(ref.idnum, ref.generation)] = number
+            top_level.append((number, ref.get_object()))
+            ref = top_level[-1][1].raw_get("/Next") if "/Next" in top_level[-1][1] else None
+
+        items = []
+        for number, item in top_level:
+            copy = DictionaryObject()
+            for key, value in item.items():
+                if key not in ("/Parent", "/Prev", "/Next"):
+                    copy[key] = translate(value)
+            items.append((number, copy))
+        return items
+
+    def _copy_named_destinations(self, root: DictionaryObject, translate) -> Dict[str, PdfObject]:
+        destinations = {}
+        names = _resolve(root.get("/Names"))
+        if isinstance(names, DictionaryObject) and "/Dests" in names:
+            for name, value in _iter_name_tree(names["/Dests"]):
+                destinations.setdefault(name, translate(value))
+        legacy = _resolve(root.get("/Dests"))
+        if isinstance(legacy, DictionaryObject):
+            for name, value in legacy.items():
+                destinations.setdefault(name[1:], translate(value))
+        return destinations
+
+    def close(self) -> None:
+        """Write the page tree, catalog and cross-reference table"""
+        self._write(self.pages_number, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self._ref(n) for n in self.page_numbers),
+            NameObject("/Count"): NumberObject(len(self.page_numbers)),
+        }))
+
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self._ref(self.pages_number),
+        })
+
+        if self.outline_items:
+            outline_number = self._allocate()
+            last = len(self.outline_items) - 1
+            for i, (number, item) in enumerate(self.outline_items):
+                item[NameObject("/Parent")] = self._ref(outline_number)
+                if i > 0:
+                    item[NameObject("/Prev")] = self._ref(self.outline_items[i - 1][0])
+                if i < last:
+                    item[NameObject("/Next")] = self._ref(self.outline_items[i + 1][0])
+                self._write(number, item)
+            self._write(outline_number, DictionaryObject({
+                NameObject("/Type"): NameObject("/Outlines"),
+                NameObject("/First"): self._ref(self.outline_items[0][0]),
+                NameObject("/Last"): self._ref(self.outline_items[-1][0]),
+                NameObject("/Count"): NumberObject(len(self.outline_items)),
+            }))
+            catalog[NameObject("/Outlines")] = self._ref(outline_number)
+
+        if self.named_destinations:
+            names = ArrayObject()
+            for name in sorted(self.named_destinations):
+                names.append(TextStringObject(name))
+                names.append(self.named_destinations[name])
+            dests_number = self._allocate()
+            self._write(dests_number, DictionaryObject({NameObject("/Names"): names}))
+            catalog[NameObject("/Names")] = DictionaryObject({NameObject("/Dests"): self._ref(dests_number)})
+
+        producer = f"pypdf {pypdf.__version__}"
+        info = DictionaryObject({NameObject("/Producer"): TextStringObject(producer)})
+        if self.finishing is not None:
+            self._finish_document(catalog, info, producer)
+
+        self._write(self.catalog_number, catalog)
+        info_number = self._allocate()
+        self._write(info_number, info)
+
+        xref_offset = self.out.tell()
+        self.out.write(f"xref\n0 {len(self.offsets) + 1}\n".encode())
+        self.out.write(b"0000000000 65535 f \n")
+        for offset in self.offsets:
+            # Numbers reserved for a document that failed to copy stay free
+            self.out.write(b"0000000000 65535 f \n" if offset is None else f"{offset:010d} 00000 n \n".encode())
+        self.out.write(b"trailer\n")
+        DictionaryObject({
+            NameObject("/Size"): NumberObject(len(self.offsets) + 1),
+            NameObject("/Root"): self._ref(self.catalog_number),
+            NameObject("/Info"): self._ref(info_number),
+        }).write_to_stream(self.out)
+        self.out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+    def _finish_document(self, catalog: DictionaryObject, info: DictionaryObject, producer: str) -> None:
+        """Add document metadata and page labels from the finishing spec"""
+        created = datetime.now(timezone.utc)
+        for key, value in build_info(self.finishing.metadata).items():
+            info[NameObject(key)] = TextStringObject(value)
+        info[NameObject("/CreationDate")] = TextStringObject(created.strftime("D:%Y%m%d%H%M%SZ"))
+
+        xmp = self._content_stream(build_xmp(self.finishing.metadata, producer, created))
+        xmp[NameObject("/Type")] = NameObject("/Metadata")
+        xmp[NameObject("/Subtype")] = NameObject("/XML")
+        xmp_number = self._allocate()
+        self._write(xmp_number, xmp)
+        catalog[NameObject("/Metadata")] = self._ref(xmp_number)
+
+        ranges = [r for r in self.finishing.page_label_ranges() if r[0] < len(self.page_numbers)]
+        if ranges:
+            if ranges[0][0] != 0:
+                # The number tree has to cover the first page
+                ranges.insert(0, (0, "/D", None, 1))
+            nums = ArrayObject()
+            for start, style, prefix, first in ranges:
+                label = DictionaryObject()
+                if style:
+                    label[NameObject("/S")] = NameObject(style)
+                if prefix:
+                    label[NameObject("/P")] = TextStringObject(prefix)
+                if first != 1:
+                    label[NameObject("/St")] = NumberObject(first)
+                nums.append(NumberObject(start))
+                nums.append(label)
+            catalog[NameObject("/PageLabels")] = DictionaryObject({NameObject("/Nums"): nums})
+
+def display_matrix(rotation: int, x0: float, y0: float, width: float, height: float) -> str:
+    """
+    Matrix mapping the displayed page's coordinates onto its user space
+
+    Args:
+        rotation: Page /Rotate (clockwise) in degrees
+        x0, y0: Lower-left corner of the media box
+        width, height: Media box size in user space
+    """
+    a, b, c, d, e, f = {
+        0: (1, 0, 0, 1, 0, 0),
+        90: (0, 1, -1, 0, width, 0),
+        180: (-1, 0, 0, -1, width, height),
+        270: (0, -1, 1, 0, 0, height),
+    }[rotation]
+    return f"{a} {b} {c} {d} {e + x0:.2f} {f + y0:.2f}"
+
+class _OpenInput:
+    """A prefetched input document together with its memory reservation"""
+
+    def __init__(self, pdf_path: PdfSource, budget: MemoryBudget):
+        self.pdf_path = pdf_path
+        self.budget = budget
+        self.reserved = 0
+        self.reader: Optional[PdfReader] = None
+        self._context = None
+
+    def open(self) -> "_OpenInput":
+        # Inputs passed as bytes are in memory already
+        size = os.path.getsize(self.pdf_path) if isinstance(self.pdf_path, str) else 0
+        if size >= LARGE_INPUT_BYTES:
+            self.reserved = self.budget.acquire(size)
+        try:
+            self._context = open_pdf(self.pdf_path)
+            self.reader = self._context.__enter__()
+            # Parse the page tree now, while the previous input is being copied
+            _ = len(self.reader.pages)
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self) -> None:
+        self.reader = None
+        if self._context is not None:
+            self._context.__exit__(None, None, None)
+            self._context = None
+        if self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
+
+def _open_inputs(
+    pdf_paths: List[Optional[PdfSource]],
+    budget: MemoryBudget
+) -> Iterator[Tuple[Optional[str], Optional[_OpenInput], Optional[Exception]]]:
+    """
+    Open inputs in order, a few ahead of the consumer
+
+    Yields (name, opened input or None, error or None); a None path is
+    passed through without opening anything. The caller must close
+    each opened input before asking for the next one, which is what lets the
+    budget bound how many large inputs are mapped at once.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = []
+        next_index = 0
+        try:
+            for pdf_path in pdf_paths:
+                while next_index < len(pdf_paths) and len(futures) < MAX_PREFETCH:
+                    candidate = pdf_paths[next_index]
+                    next_index += 1
+                    if candidate is None:
+                        futures.append((None, None))
+                    elif isinstance(candidate, str) and not os.path.exists(candidate):
+                        futures.append((candidate, None))
+                    else:
+                        futures.append((source_name(candidate), executor.submit(_OpenInput(candidate, budget).open)))
+
+                path, future = futures.pop(0)
+                if path is None:
+                    yield None, None, None
+                    continue
+                if future is None:
+                    yield path, None, FileNotFoundError(path)
+                    continue
+                try:
+                    opened = future.result()
+                except Exception as e:
+                    yield path, None, e
+                    continue
+                yield path, opened, None
+        finally:
+            for _, future in futures:
+                if future is not None and not future.cancel():
+                    try:
+                        future.result().close()
+                    except Exception:
+                        pass
+
+def merge_pdfs(
+    pdf_paths: List[Union[PdfSource, MergePart]],
+    out_path: Union[str, BinaryIO],
+    memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES,
+    finishing: Optional[FinishingSpec] = None
+) -> str:
     """
     Merge multiple PDF files into a single PDF
-    
+
+    Inputs are memory-mapped and copied one at a time straight into the
+    output file; inputs of LARGE_INPUT_BYTES or more are only opened ahead
+    while their combined size fits in memory_budget_bytes. Small exports
+    can pass their inputs as bytes and a buffer as out_path, so nothing
+    touches the disk.
+
     Args:
-        pdf_paths: List of paths to PDF files to merge
-        out_path: Path for the output merged PDF
+        pdf_paths: PDF paths or bytes, or MergeParts selecting pages, rotations and blank pages
+        out_path: Path for the output merged PDF, or an empty writable binary file object
+        memory_budget_bytes: Bytes of large inputs this export may keep open at once
+        finishing: Metadata, page labels and stamps applied while the output is written
         
     Returns:
-        Path to the merged PDF file
+        out_path
         
     Raises:
+        PageRangeError: If a page selection is outside its document
         MergeError: If merging fails
     """
+    to_file = isinstance(out_path, str)
     try:
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        if to_file:
+            # Ensure output directory exists
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
         
-        logger.info(f"Merging {len(pdf_paths)} PDF files into: {out_path}")
+        parts = [part if isinstance(part, MergePart) else MergePart(part) for part in pdf_paths]
+        logger.info(f"Merging {len(parts)} parts into: {out_path if to_file else 'memory'}")
         
-        merger = PdfMerger()
-        
-        for pdf_path in pdf_paths:
-            if not os.path.exists(pdf_path):
-                logger.warning(f"PDF file not found, skipping: {pdf_path}")
-                continue
-                
-            try:
-                # Validate PDF file
-                with open(pdf_path, 'rb') as file:
-                    reader = PdfReader(file)
-                    if len(reader.pages) == 0:
+        budget = MemoryBudget(memory_budget_bytes)
+        with (open(out_path, "wb") if to_file else nullcontext(out_path)) as out:
+            start = out.tell()
+            writer = _StreamingPdfWriter(out, finishing)
+
+            for part, (pdf_path, opened, error) in zip(parts, _open_inputs([p.path for p in parts], budget)):
+                if part.path is None:
+                    writer.add_blank_pages(part.blank)
+                    logger.info(f"Added {part.blank} blank pages")
+                    continue
+                if isinstance(error, FileNotFoundError):
+                    logger.warning(f"PDF file not found, skipping: {pdf_path}")
+                    continue
+                if error is not None:
+                    logger.error(f"Error processing PDF {pdf_path}: {str(error)}")
+                    continue
+
+                try:
+                    page_total = len(opened.reader.pages)
+                    if page_total == 0:
                         logger.warning(f"Empty PDF file, skipping: {pdf_path}")
                         continue
-                
-                # Add PDF to merger
-                merger.append(pdf_path)
-                logger.info(f"Added PDF to merger: {pdf_path}")
-                
-            except Exception as e:
-                logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
-                # Continue with other files instead of failing completely
-                continue
-        
-        # Write merged PDF
-        merger.write(out_path)
-        merger.close()
+                    
+                    page_indices = select_pages(part.pages, page_total) if part.pages else None
+                    page_count = writer.add_document(opened.reader, pdf_path, page_indices, part.rotate)
+                    logger.info(f"Added PDF to merger: {pdf_path} ({page_count} pages)")
+                    
+                except PageRangeError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
+                    # Continue with other files instead of failing completely
+                    continue
+                finally:
+                    opened.close()
+
+            writer.close()
+            output_size = out.tell() - start
         
         # Validate output
-        if not os.path.exists(out_path):
+        if to_file and not os.path.exists(out_path):
             raise MergeError(f"Merged PDF was not created: {out_path}")
         
         # Check if output file has content
-        output_size = os.path.getsize(out_path)
         if output_size == 0:
             raise MergeError("Merged PDF is empty")
         
-        logger.info(f"Successfully merged PDFs: {out_path} ({output_size} bytes)")
+        logger.info(f"Successfully merged PDFs: {out_path if to_file else 'memory'} ({output_size} bytes)")
         return out_path
         
+    except PageRangeError:
+        raise
     except Exception as e:
         logger.error(f"PDF merging failed: {str(e)}")
         raise MergeError(f"PDF merging failed: {str(e)}")
 
+def get_engine_version() -> str:
+    """
+    Identify the PDF pipeline that produced an export
+
+    Returns:
+        Version string combining the pipeline and pypdf versions
+    """
+    return f"{MERGE_PIPELINE_VERSION}+pypdf-{pypdf.__version__}"
+
 def get_pdf_page_count(pdf_path: str) -> int:
     """
     Get the number of pages in a PDF file
@@ -85,8 +866,7 @@ def get_pdf_page_count(pdf_path: str) -> int:
         Number of pages in the PDF
     """
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
+        with open_pdf(pdf_path) as reader:
             return len(reader.pages)
     except Exception as e:
         logger.error(f"Error reading PDF page count: {str(e)}")
@@ -103,8 +883,7 @@ def validate_pdf(pdf_path: str) -> bool:
         True if valid PDF, False otherwise
     """
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
+        with open_pdf(pdf_path) as reader:
             # Try to access pages to validate
             _ = len(reader.pages)
             return True
@@ -0,0 +1,471 @@
+import io
+import os
+import zlib
+import logging
+from datetime import datetime, timezone
+from contextlib import nullcontext
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+from .finishing import FinishingError, FinishingSpec, build_info, build_xmp, render_text_image
+from .merger import (
+    A4_SIZE,
+    DEFAULT_MEMORY_BUDGET_BYTES,
+    MERGE_PIPELINE_VERSION,
+    MergeError,
+    MergePart,
+    PageRangeError,
+    PdfSource,
+    display_matrix,
+    get_engine_version,
+    get_pdf_page_count,
+    merge_pdfs,
+    select_pages,
+    source_name,
+    validate_pdf,
+)
+
+logger = logging.getLogger(__name__)
+
+ENGINE_NAMES = ("pypdf", "pikepdf")
+
+class PdfEngine:
+    """
+    The PDF operations of the export pipeline: merge, page count and validation.
+
+    Engines produce equivalent documents for the same parts and finishing
+    (same pages, order, rotations, metadata, page labels, stamps, outlines)
+    but not byte-identical ones, so version() names the engine and goes
+    into export fingerprints.
+    """
+
+    name = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def merge(
+        self,
+        parts: List[Union[PdfSource, MergePart]],
+        out_path: Union[str, BinaryIO],
+        memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES,
+        finishing: Optional[FinishingSpec] = None
+    ) -> Union[str, BinaryIO]:
+        """
+        Merge parts into one PDF, see merge_pdfs
+
+        Raises:
+            PageRangeError: If a page selection is outside its document
+            MergeError: If merging fails
+        """
+        raise NotImplementedError
+
+    def page_count(self, source: PdfSource) -> int:
+        """Number of pages of a PDF, 0 if it can't be read"""
+        raise NotImplementedError
+
+    def validate(self, source: PdfSource) -> bool:
+        """Whether a PDF can be opened and its pages read"""
+        raise NotImplementedError
+
+    def version(self) -> str:
+        """Version string of the pipeline and the library behind it"""
+        raise NotImplementedError
+
+class PypdfEngine(PdfEngine):
+    """The streaming pypdf merger in services.merger"""
+
+    name = "pypdf"
+
+    def merge(self, parts, out_path, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES, finishing=None):
+        return merge_pdfs(parts, out_path, memory_budget_bytes=memory_budget_bytes, finishing=finishing)
+
+    def page_count(self, source: PdfSource) -> int:
+        return get_pdf_page_count(source)
+
+    def validate(self, source: PdfSource) -> bool:
+        return validate_pdf(source)
+
+    def version(self) -> str:
+        return get_engine_version()
+
+def _pikepdf():
+    try:
+        import pikepdf  # Optional: compiled qpdf bindings
+        return pikepdf
+    except ImportError:
+        return None
+
+class PikepdfEngine(PdfEngine):
+    """
+    Merges with pikepdf, the Python bindings of the qpdf C++ library.
+
+    Pages are copied by qpdf, which is several times faster than pypdf on
+    large documents and writes compressed object streams. qpdf copies
+    stream data from the inputs only when the output is written, so every
+    input of a merge stays open until then and memory_budget_bytes is not
+    used; exports of very large scans are better served by pypdf's
+    streaming writer.
+    """
+
+    name = "pikepdf"
+
+    def __init__(self):
+        self.pikepdf = _pikepdf()
+        if self.pikepdf is None:
+            raise MergeError("pikepdf is required for the pikepdf PDF engine")
+
+    @classmethod
+    def available(cls) -> bool:
+        return _pikepdf() is not None
+
+    def _open(self, source: PdfSource):
+        return self.pikepdf.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    def merge(self, parts, out_path, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES, finishing=None):
+        to_file = isinstance(out_path, str)
+        opened = []
+        try:
+            if to_file:
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+            parts = [part if isinstance(part, MergePart) else MergePart(part) for part in parts]
+            logger.info(f"Merging {len(parts)} parts with pikepdf into: {out_path if to_file else 'memory'}")
+            writer = _PikepdfWriter(self.pikepdf, finishing)
+
+            for part in parts:
+                if part.path is None:
+                    writer.add_blank_pages(part.blank)
+                    logger.info(f"Added {part.blank} blank pages")
+                    continue
+                pdf_path = source_name(part.path)
+                if isinstance(part.path, str) and not os.path.exists(part.path):
+                    logger.warning(f"PDF file not found, skipping: {pdf_path}")
+                    continue
+                try:
+                    pdf = self._open(part.path)
+                    opened.append(pdf)
+                    page_total = len(pdf.pages)
+                    if page_total == 0:
+                        logger.warning(f"Empty PDF file, skipping: {pdf_path}")
+                        continue
+
+                    page_indices = select_pages(part.pages, page_total) if part.pages else None
+                    page_count = writer.add_document(pdf, pdf_path, page_indices, part.rotate)
+                    logger.info(f"Added PDF to merger: {pdf_path} ({page_count} pages)")
+                except PageRangeError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
+                    continue
+
+            with (open(out_path, "wb") if to_file else nullcontext(out_path)) as out:
+                start = out.tell()
+                writer.save(out)
+                output_size = out.tell() - start
+
+            if output_size == 0:
+                raise MergeError("Merged PDF is empty")
+
+            logger.info(f"Successfully merged PDFs: {out_path if to_file else 'memory'} ({output_size} bytes)")
+            return out_path
+
+        except PageRangeError:
+            raise
+        except Exception as e:
+            logger.error(f"PDF merging failed: {str(e)}")
+            raise MergeError(f"PDF merging failed: {str(e)}")
+        finally:
+            for pdf in opened:
+                pdf.close()
+
+    def page_count(self, source: PdfSource) -> int:
+        try:
+            with self._open(source) as pdf:
+                return len(pdf.pages)
+        except Exception as e:
+            logger.error(f"Error reading PDF page count: {str(e)}")
+            return 0
+
+    def validate(self, source: PdfSource) -> bool:
+        try:
+            with self._open(source) as pdf:
+                _ = len(pdf.pages)
+                return True
+        except Exception as e:
+            logger.error(f"PDF validation failed: {str(e)}")
+            return False
+
+    def version(self) -> str:
+        return (
+            f"{MERGE_PIPELINE_VERSION}+pikepdf-{self.pikepdf.__version__}"
+            f"+qpdf-{self.pikepdf.__libqpdf_version__}"
+        )
+
+class _PikepdfWriter:
+    """
+    Builds a merged document in a new pikepdf.Pdf, mirroring what the
+    streaming pypdf writer does: outlines and named destinations of whole
+    documents are carried over once per source, and finishing is applied
+    to pages as they are added.
+    """
+
+    def __init__(self, pikepdf, finishing: Optional[FinishingSpec] = None):
+        self.pikepdf = pikepdf
+        self.finishing = finishing
+        self.pdf = pikepdf.new()
+        self.last_page_size = A4_SIZE
+        self.outline_items: List = []
+        self.named_destinations: Dict[str, object] = {}
+        self._outlined = set()
+        self._targets: Dict[str, Dict[Tuple[int, int], object]] = {}
+        self._font = None
+        self._save = None
+        self._images: Dict[str, object] = {}
+        self._image_sizes: Dict[str, Tuple[float, float]] = {}
+
+    def add_document(self, source, name: str, page_indices: Optional[List[int]] = None, rotate: int = 0) -> int:
+        Name = self.pikepdf.Name
+        whole_document = page_indices is None
+        if whole_document:
+            page_indices = list(range(len(source.pages)))
+
+        # Source page -> its first merged copy, for outlines and destinations
+        targets = self._targets.setdefault(name, {})
+        for index in page_indices:
+            self.pdf.pages.append(source.pages[index])
+            page = self.pdf.pages[-1]
+            targets.setdefault(source.pages[index].objgen, page)
+            if rotate:
+                page.obj.Rotate = (int(page.obj.get(Name.Rotate, 0)) + rotate) % 360
+            if self.finishing is not None and self.finishing.has_stamps:
+                self._stamp_page(page, len(self.pdf.pages))
+            self.last_page_size = _shown_size(page)
+
+        if whole_document and name not in self._outlined:
+            self._outlined.add(name)
+            self._copy_outline(source, targets)
+            self._copy_named_destinations(source, targets)
+        return len(page_indices)
+
+    def add_blank_pages(self, count: int, size: Optional[Tuple[float, float]] = None) -> int:
+        for _ in range(count):
+            page = self.pdf.add_blank_page(page_size=size or self.last_page_size)
+            if self.finishing is not None and self.finishing.has_stamps:
+                self._stamp_page(page, len(self.pdf.pages))
+        return count
+
+    def _destination(self, dest, targets):
+        """A source destination array pointed at the merged page, or None if the page was left out"""
+        Array = self.pikepdf.Array
+        if isinstance(dest, self.pikepdf.Dictionary) and "/D" in dest:
+            dest = dest.D
+        if not isinstance(dest, Array) or len(dest) == 0:
+            return None
+        target = targets.get(dest[0].objgen) if isinstance(dest[0], self.pikepdf.Dictionary) else None
+        if target is None:
+            return None
+        # The rest of a destination is the view: a name and numbers
+        return Array([target.obj] + [
+            self.pdf.copy_foreign(item) if isinstance(item, self.pikepdf.Object) and item.is_indirect else item
+            for item in list(dest)[1:]
+        ])
+
+    def _copy_outline(self, source, targets) -> None:
+        OutlineItem = self.pikepdf.OutlineItem
+
+        def copy(item):
+            dest = item.destination
+            if dest is None and item.action is not None and item.action.get("/S") == "/GoTo":
+                dest = item.action.get("/D")
+            if isinstance(dest, (self.pikepdf.String, self.pikepdf.Name)):
+                dest = self._named_destination(source, str(dest).lstrip("/"))
+            copied = OutlineItem(item.title, self._destination(dest, targets) if dest is not None else None)
+            copied.children.extend(copy(child) for child in item.children)
+            return copied
+
+        try:
+            with source.open_outline() as outline:
+                self.outline_items.extend(copy(item) for item in outline.root)
+        except Exception as e:
+            logger.warning(f"Outline not copied: {str(e)}")
+
+    def _named_destination(self, source, name: str):
+        names = source.Root.get("/Names")
+        if names is not None and "/Dests" in names:
+            tree = self.pikepdf.NameTree(names.Dests)
+            if name in tree:
+                return tree[name]
+        legacy = source.Root.get("/Dests")
+        if legacy is not None and f"/{name}" in legacy:
+            return legacy[f"/{name}"]
+        return None
+
+    def _copy_named_destinations(self, source, targets) -> None:
+        entries = []
+        names = source.Root.get("/Names")
+        if names is not None and "/Dests" in names:
+            entries.extend(self.pikepdf.NameTree(names.Dests).items())
+        legacy = source.Root.get("/Dests")
+        if legacy is not None:
+            entries.extend((key[1:], value) for key, value in legacy.items())
+        for name, value in entries:
+            try:
+                dest = self._destination(value, targets)
+            except Exception as e:
+                logger.warning(f"Named destination {name} not copied: {str(e)}")
+                continue
+            if dest is not None:
+                self.named_destinations.setdefault(name, dest)
+
+    def _stamp_font(self):
+        if self._font is None:
+            Name = self.pikepdf.Name
+            self._font = self.pdf.make_indirect(self.pikepdf.Dictionary(
+                Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica, Encoding=Name.WinAnsiEncoding
+            ))
+        return self._font
+
+    def _stamp_image(self, name: str):
+        """A rendered text stamp (footer, watermark) as an image XObject, or None if it can't be rendered"""
+        if name not in self._images:
+            text, font_size, gray, opacity = self.finishing.stamp_images()[name]
+            try:
+                width, height, alpha, width_pt, height_pt = render_text_image(text, font_size, opacity)
+            except FinishingError as e:
+                logger.error(f"Stamp {name} skipped: {str(e)}")
+                self._images[name] = None
+                return None
+
+            Name = self.pikepdf.Name
+
+            def image_stream(data: bytes, **extra):
+                stream = self.pikepdf.Stream(self.pdf, b"")
+                stream.write(data, filter=Name.FlateDecode)
+                stream.Type = Name.XObject
+                stream.Subtype = Name.Image
+                stream.Width = width
+                stream.Height = height
+                stream.ColorSpace = Name.DeviceGray
+                stream.BitsPerComponent = 8
+                for key, value in extra.items():
+                    stream[Name("/" + key)] = value
+                return self.pdf.make_indirect(stream)
+
+            # Solid grey glyphs whose shape comes from the anti-aliased alpha mask
+            mask = image_stream(alpha)
+            self._images[name] = image_stream(zlib.compress(bytes([gray]) * (width * height)), SMask=mask)
+            self._image_sizes[name] = (width_pt, height_pt)
+        return self._images[name]
+
+    def _stamp_page(self, page, page_number: int) -> None:
+        """Add the finishing stamps to a merged page, in its displayed orientation"""
+        Name = self.pikepdf.Name
+        images = {name: self._stamp_image(name) for name in self.finishing.stamp_images()}
+        x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+        width, height = x1 - x0, y1 - y0
+        rotation = int(page.obj.get(Name.Rotate, 0)) % 360
+        shown_width, shown_height = (height, width) if rotation in (90, 270) else (width, height)
+
+        operators = self.finishing.stamp_operators(page_number, shown_width, shown_height, self._image_sizes)
+        if not operators:
+            return
+        page.add_resource(self._stamp_font(), Name.Font, Name.FStamp)
+        for name, image in images.items():
+            if image is not None:
+                page.add_resource(image, Name.XObject, Name(name))
+        if self._save is None:
+            self._save = self.pdf.make_stream(b"q\n")
+        page.contents_add(self._save, prepend=True)
+        matrix = display_matrix(rotation, x0, y0, width, height)
+        page.contents_add(self.pdf.make_stream(
+            b"\nQ\nq " + matrix.encode("ascii") + b" cm\n" + operators + b"\nQ\n"
+        ))
+
+    def save(self, out: BinaryIO) -> None:
+        Name = self.pikepdf.Name
+        pdf = self.pdf
+        if self.outline_items:
+            with pdf.open_outline() as outline:
+                outline.root.extend(self.outline_items)
+        if self.named_destinations:
+            tree = self.pikepdf.NameTree.new(pdf)
+            for name in sorted(self.named_destinations):
+                tree[name] = self.named_destinations[name]
+            pdf.Root.Names = self.pikepdf.Dictionary(Dests=tree.obj)
+
+        producer = f"pikepdf {self.pikepdf.__version__}"
+        pdf.docinfo[Name.Producer] = producer
+        if self.finishing is not None:
+            self._finish_document(producer)
+        pdf.save(
+            out,
+            compress_streams=True,
+            object_stream_mode=self.pikepdf.ObjectStreamMode.generate,
+            fix_metadata_version=False,
+        )
+
+    def _finish_document(self, producer: str) -> None:
+        """Add document metadata and page labels from the finishing spec"""
+        pikepdf, pdf = self.pikepdf, self.pdf
+        created = datetime.now(timezone.utc)
+        for key, value in build_info(self.finishing.metadata).items():
+            pdf.docinfo[pikepdf.Name(key)] = value
+        pdf.docinfo[pikepdf.Name.CreationDate] = created.strftime("D:%Y%m%d%H%M%SZ")
+        pdf.Root.Metadata = pdf.make_stream(
+            build_xmp(self.finishing.metadata, producer, created),
+            Type=pikepdf.Name.Metadata,
+            Subtype=pikepdf.Name.XML,
+        )
+
+        ranges = [r for r in self.finishing.page_label_ranges() if r[0] < len(pdf.pages)]
+        if ranges:
+            if ranges[0][0] != 0:
+                # The number tree has to cover the first page
+                ranges.insert(0, (0, "/D", None, 1))
+            nums = pikepdf.Array()
+            for start, style, prefix, first in ranges:
+                label = pikepdf.Dictionary()
+                if style:
+                    label.S = pikepdf.Name(style)
+                if prefix:
+                    label.P = pikepdf.String(prefix)
+                if first != 1:
+                    label.St = first
+                nums.append(start)
+                nums.append(label)
+            pdf.Root.PageLabels = pikepdf.Dictionary(Nums=nums)
+
+def _shown_size(page) -> Tuple[float, float]:
+    """Displayed size of a pikepdf page, its /Rotate applied"""
+    x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+    width, height = abs(x1 - x0), abs(y1 - y0)
+    rotation = int(page.obj.get("/Rotate", 0)) % 360
+    return (height, width) if rotation in (90, 270) else (width, height)
+
+def get_engine(name: str = "pypdf") -> PdfEngine:
+    """
+    The PDF engine for a configuration value
+
+    Args:
+        name: "pypdf", "pikepdf", or "auto" for pikepdf when it is installed
+
+    Returns:
+        The engine; pypdf if the requested engine isn't installed
+
+    Raises:
+        ValueError: If the name is unknown
+    """
+    name = (name or "pypdf").strip().lower()
+    if name not in ENGINE_NAMES + ("auto",):
+        raise ValueError(f"Unknown PDF engine: {name} (expected pypdf, pikepdf or auto)")
+    if name in ("pikepdf", "auto"):
+        if PikepdfEngine.available():
+            return PikepdfEngine()
+        if name == "pikepdf":
+            logger.warning("PDF_ENGINE=pikepdf but pikepdf isn't installed, using pypdf")
+    return PypdfEngine()
+
+def available_engines() -> List[PdfEngine]:
+    """One instance of every engine that can run here"""
+    return [PypdfEngine()] + ([PikepdfEngine()] if PikepdfEngine.available() else [])
@@ -0,0 +1,56 @@
+import time
+import shutil
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: how much later than asked a short sleep wakes up.
+
+    A blocking call on the loop (or a loop starved by CPU-bound threads)
+    shows up as lag long before requests start timing out.
+    """
+
+    def __init__(self, interval: float = 0.5, window: int = 20):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.monotonic() - started - self.interval))
+
+    @property
+    def lag(self) -> float:
+        """Worst lag in the recent window, in seconds"""
+        return max(self.samples, default=0.0)
+
+def free_disk_bytes(path: Path) -> Optional[int]:
+    """Free space on the file system holding path, None if it can't be read"""
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+def ping_database(engine: Engine) -> bool:
+    """Run a trivial query to check the database is reachable"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.warning(f"Database ping failed: {str(e)}")
+        return False
+
+def check(value, limit, ok: bool) -> Dict:
+    """One readiness check result"""
+    return {"ok": ok, "value": value, "limit": limit}
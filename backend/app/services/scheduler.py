@@ -0,0 +1,335 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+# Recent waits kept per tenant for the wait-time statistics
+WAIT_HISTORY = 200
+# Idle tenants without a policy are forgotten beyond this many
+MAX_TRACKED_TENANTS = 256
+
+class Job:
+    """A unit of work waiting for or running on the scheduler"""
+
+    def __init__(self, job_id: str, cost: float, fn: Callable, args: tuple, tenant: str = DEFAULT_TENANT):
+        self.id = job_id
+        self.cost = cost
+        self.fn = fn
+        self.args = args
+        self.tenant = tenant
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stage = "queued"
+        self.progress = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.finished_at is not None:
+            if self.future.cancelled() or self.future.exception() is not None:
+                return "failed"
+            return "completed"
+        return "running" if self.started_at is not None else "queued"
+
+    def report(self, stage: str, progress: float) -> None:
+        """Record progress from inside the job (progress is a 0..1 fraction)"""
+        self.stage = stage
+        self.progress = min(1.0, max(self.progress, progress))
+
+    def remaining_cost(self, now: float) -> float:
+        """Predicted seconds of work left"""
+        if self.finished_at is not None:
+            return 0.0
+        if self.started_at is None:
+            return self.cost
+        by_progress = self.cost * (1.0 - self.progress)
+        by_time = self.cost - (now - self.started_at)
+        return max(0.0, by_progress, by_time)
+
+class TenantPolicy:
+    """
+    Scheduling weight of a tenant and its temporary boosts.
+
+    Args:
+        weight: Share of the workers relative to other tenants
+        boost: Factor applied to the weight until boost_until
+        boost_until: Wall-clock time (epoch seconds) the boost expires
+        deadline: Wall-clock time (epoch seconds) of a deadline; the tenant
+            is boosted during the scheduler's deadline window before it
+    """
+
+    def __init__(
+        self,
+        weight: float = 1.0,
+        boost: float = 1.0,
+        boost_until: Optional[float] = None,
+        deadline: Optional[float] = None
+    ):
+        self.weight = weight
+        self.boost = boost
+        self.boost_until = boost_until
+        self.deadline = deadline
+
+class _TenantState:
+    """Queueing state and statistics of one tenant"""
+
+    def __init__(self):
+        # Virtual finish time of the tenant's last dispatched job
+        self.finish_tag = 0.0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.served_seconds = 0.0
+        self.waits = deque(maxlen=WAIT_HISTORY)
+
+class FairShareScheduler:
+    """
+    Runs jobs on a fixed set of worker threads, fair across tenants and
+    shortest predicted job first within a tenant.
+
+    Tenants (faculties) share the workers by weighted fair queueing: each
+    tenant's next job gets a virtual finish time of max(the tenant's last
+    finish time, the current virtual time) + cost / weight, and the job with
+    the earliest one runs next. A burst from one tenant therefore only
+    delays that tenant's own jobs, and a tenant that was idle doesn't bank
+    credit. Operator policies raise a tenant's weight for a while or ahead
+    of a deadline.
+
+    Within a tenant, a job's priority is its predicted cost minus aging
+    times the seconds it has waited, so a small job overtakes a large one
+    but a large job that has waited about as long as it is expected to run
+    gets its turn before newer small ones.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        aging: float = 1.0,
+        name: str = "scheduler",
+        deadline_window: float = 24 * 3600,
+        deadline_boost: float = 4.0
+    ):
+        self.workers = workers
+        self.aging = aging
+        self.deadline_window = deadline_window
+        self.deadline_boost = deadline_boost
+        self.queue: List[Job] = []
+        self.running: List[Job] = []
+        self.completed = 0
+        self.failed = 0
+        self.virtual_time = 0.0
+        self.policies: Dict[str, TenantPolicy] = {}
+        self.tenants: Dict[str, _TenantState] = {}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job_id: str, cost: float, fn: Callable, *args, tenant: str = DEFAULT_TENANT) -> Job:
+        """
+        Queue fn(*args) with its predicted cost in seconds
+
+        Returns:
+            The job; its future resolves with fn's result
+        """
+        job = Job(job_id, cost, fn, args, tenant)
+        with self._cond:
+            self._tenant(tenant)
+            self.queue.append(job)
+            self._cond.notify()
+        return job
+
+    def set_policy(self, tenant: str, policy: TenantPolicy) -> None:
+        with self._cond:
+            self.policies[tenant] = policy
+
+    def clear_policy(self, tenant: str) -> None:
+        with self._cond:
+            self.policies.pop(tenant, None)
+
+    def effective_weight(self, tenant: str, wall: Optional[float] = None) -> float:
+        """Weight of a tenant right now, including boosts that haven't expired"""
+        wall = time.time() if wall is None else wall
+        policy = self.policies.get(tenant)
+        if policy is None:
+            return 1.0
+        weight = policy.weight
+        if policy.boost_until is not None and wall < policy.boost_until:
+            weight *= policy.boost
+        if policy.deadline is not None and policy.deadline - self.deadline_window <= wall < policy.deadline:
+            weight *= self.deadline_boost
+        return max(weight, 1e-3)
+
+    def current_job(self) -> Optional[Job]:
+        """The job running on the calling worker thread, if any"""
+        return getattr(self._local, "job", None)
+
+    def _tenant(self, tenant: str) -> _TenantState:
+        state = self.tenants.get(tenant)
+        if state is None:
+            if len(self.tenants) >= MAX_TRACKED_TENANTS:
+                busy = {job.tenant for job in self.queue + self.running}
+                for name in [t for t in self.tenants if t not in busy and t not in self.policies]:
+                    del self.tenants[name]
+            state = self.tenants[tenant] = _TenantState()
+        return state
+
+    def _priority(self, job: Job, now: float) -> float:
+        return job.cost - self.aging * (now - job.submitted_at)
+
+    def _pick(
+        self,
+        queue: List[Job],
+        finish_tags: Dict[str, float],
+        virtual_time: float,
+        now: float,
+        wall: float
+    ) -> Tuple[Job, float, float]:
+        """Next job to dispatch, with its virtual start and finish times"""
+        heads: Dict[str, Job] = {}
+        for job in queue:
+            head = heads.get(job.tenant)
+            if head is None or self._priority(job, now) < self._priority(head, now):
+                heads[job.tenant] = job
+
+        best = None
+        for tenant, job in heads.items():
+            start = max(finish_tags.get(tenant, 0.0), virtual_time)
+            finish = start + job.cost / self.effective_weight(tenant, wall)
+            if best is None or finish < best[2]:
+                best = (job, start, finish)
+        return best
+
+    def _dispatch_order(self, now: float) -> List[Job]:
+        """Queued jobs in the order they would run if nothing else arrived"""
+        wall = time.time()
+        queue = list(self.queue)
+        finish_tags = {tenant: state.finish_tag for tenant, state in self.tenants.items()}
+        virtual_time = self.virtual_time
+        order = []
+        while queue:
+            job, virtual_time, finish_tags[job.tenant] = self._pick(queue, finish_tags, virtual_time, now, wall)
+            queue.remove(job)
+            order.append(job)
+        return order
+
+    def _next_job(self) -> Job:
+        with self._cond:
+            while not self.queue:
+                self._cond.wait()
+            now = time.monotonic()
+            finish_tags = {tenant: state.finish_tag for tenant, state in self.tenants.items()}
+            job, start, finish = self._pick(self.queue, finish_tags, self.virtual_time, now, time.time())
+            self.queue.remove(job)
+            self.running.append(job)
+            self.virtual_time = start
+            tenant = self._tenant(job.tenant)
+            tenant.finish_tag = finish
+            tenant.running += 1
+            tenant.waits.append(now - job.submitted_at)
+            job.started_at = now
+            job.stage = "running"
+            return job
+
+    def _work(self) -> None:
+        while True:
+            job = self._next_job()
+            if job.future.set_running_or_notify_cancel():
+                self._local.job = job
+                try:
+                    job.future.set_result(job.fn(*job.args))
+                except BaseException as e:
+                    job.future.set_exception(e)
+                finally:
+                    self._local.job = None
+            with self._cond:
+                job.finished_at = time.monotonic()
+                self.running.remove(job)
+                tenant = self._tenant(job.tenant)
+                tenant.running -= 1
+                tenant.served_seconds += job.finished_at - job.started_at
+                if job.future.cancelled() or job.future.exception() is not None:
+                    self.failed += 1
+                    tenant.failed += 1
+                else:
+                    self.completed += 1
+                    tenant.completed += 1
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        """1-based position among queued jobs, or None once started"""
+        with self._cond:
+            if job not in self.queue:
+                return None
+            return self._dispatch_order(time.monotonic()).index(job) + 1
+
+    def estimate(self, job: Job) -> float:
+        """
+        Predicted seconds until a job completes
+
+        Work ahead of a queued job (what is left of the running jobs plus the
+        queued jobs that would be dispatched before it) is spread over the
+        workers, then the job's own cost is added.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if job.finished_at is not None:
+                return 0.0
+            if job.started_at is not None:
+                return job.remaining_cost(now)
+            order = self._dispatch_order(now)
+            ahead = order[:order.index(job)]
+            free = max(0, self.workers - len(self.running))
+            if len(ahead) < free:
+                return job.cost
+            backlog = sum(j.remaining_cost(now) for j in self.running) + sum(j.cost for j in ahead)
+        return backlog / self.workers + job.cost
+
+    def tenant_stats(self) -> Dict[str, Dict]:
+        """Queue depth, wait times and share of worker time per tenant"""
+        now = time.monotonic()
+        wall = time.time()
+        with self._cond:
+            served_total = sum(state.served_seconds for state in self.tenants.values()) or 1.0
+            stats = {}
+            for tenant, state in self.tenants.items():
+                queued = [job for job in self.queue if job.tenant == tenant]
+                waits = sorted(state.waits)
+                stats[tenant] = {
+                    "weight": round(self.effective_weight(tenant, wall), 3),
+                    "queued": len(queued),
+                    "running": state.running,
+                    "completed": state.completed,
+                    "failed": state.failed,
+                    "oldest_wait_seconds": round(max((now - j.submitted_at for j in queued), default=0.0), 2),
+                    "avg_wait_seconds": round(sum(waits) / len(waits), 2) if waits else 0.0,
+                    "p95_wait_seconds": round(waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0,
+                    "served_seconds": round(state.served_seconds, 2),
+                    "share": round(state.served_seconds / served_total, 3),
+                }
+            return stats
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._cond:
+            summary = {
+                "workers": self.workers,
+                "running": len(self.running),
+                "queued": len(self.queue),
+                "queued_cost_seconds": round(sum(j.cost for j in self.queue), 2),
+                "running_remaining_seconds": round(sum(j.remaining_cost(now) for j in self.running), 2),
+                "oldest_wait_seconds": round(max((now - j.submitted_at for j in self.queue), default=0.0), 2),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+        summary["tenants"] = self.tenant_stats()
+        return summary
@@ -0,0 +1,180 @@
+import re
+import struct
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from ..models import Export, LshBand, TextSignature
+
+logger = logging.getLogger(__name__)
+
+# Words per shingle; five-word runs rarely repeat by chance in prose
+SHINGLE_WORDS = 5
+# Signature slots, and their split into LSH bands of BAND_ROWS slots.
+# Two texts share at least one band with probability 1 - (1 - J^4)^32 for
+# Jaccard similarity J: ~0.5% at J=0.2, ~84% at J=0.4, >99.8% at J=0.6
+SIGNATURE_SIZE = 128
+BANDS = 32
+BAND_ROWS = SIGNATURE_SIZE // BANDS
+# Texts with fewer shingles (blank scans, title pages) aren't compared
+MIN_SHINGLES = 50
+# Candidates whose full signature is compared, per query
+MAX_CANDIDATES = 500
+
+_HASH_BITS = 64
+_SLOT_BITS = SIGNATURE_SIZE.bit_length() - 1
+# Band keys carry the band number in their top bits and stay positive signed 64-bit integers
+_BAND_SHIFT = 56
+_BUCKET_MASK = (1 << _BAND_SHIFT) - 1
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def shingles(text: str) -> Set[int]:
+    """64-bit hashes of the SHINGLE_WORDS-word runs of a text, case and punctuation ignored"""
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) < SHINGLE_WORDS:
+        return set()
+    return {
+        _hash64(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+def minhash(hashes: Iterable[int]) -> Optional[List[int]]:
+    """
+    MinHash signature of a set of shingle hashes
+
+    Uses one-permutation hashing: each hash is routed to a slot by its low
+    bits and the slot keeps the minimum of the remaining bits, so a
+    signature costs one pass over the shingles instead of SIGNATURE_SIZE.
+    Empty slots borrow the value of the next filled slot (rotation
+    densification), which keeps equal slots an unbiased estimate of the
+    Jaccard similarity.
+
+    Returns:
+        SIGNATURE_SIZE integers, or None for an empty set
+    """
+    slots: List[Optional[int]] = [None] * SIGNATURE_SIZE
+    for value in hashes:
+        slot = value & (SIGNATURE_SIZE - 1)
+        value >>= _SLOT_BITS
+        current = slots[slot]
+        if current is None or value < current:
+            slots[slot] = value
+    if all(value is None for value in slots):
+        return None
+
+    signature = list(slots)
+    for slot, value in enumerate(slots):
+        if value is None:
+            distance = 1
+            while slots[(slot + distance) % SIGNATURE_SIZE] is None:
+                distance += 1
+            # Offset by the distance so slots filled from the same donor still differ
+            borrowed = slots[(slot + distance) % SIGNATURE_SIZE]
+            signature[slot] = borrowed + (distance << (_HASH_BITS - _SLOT_BITS))
+    return signature
+
+def text_signature(text: str) -> Optional[Tuple[List[int], int]]:
+    """
+    Signature of a text
+
+    Returns:
+        Tuple of (signature, shingle count), or None if the text is too short to compare
+    """
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    return minhash(hashes), len(hashes)
+
+def band_keys(signature: List[int]) -> List[int]:
+    """LSH bucket key of each band of a signature"""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+        bucket = _hash64(struct.pack(f"<{BAND_ROWS}Q", *rows)) & _BUCKET_MASK
+        keys.append((band << _BAND_SHIFT) | bucket)
+    return keys
+
+def similarity(a: List[int], b: List[int]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+def pack_signature(signature: List[int]) -> bytes:
+    return struct.pack(f"<{SIGNATURE_SIZE}Q", *signature)
+
+def unpack_signature(data: bytes) -> List[int]:
+    return list(struct.unpack(f"<{SIGNATURE_SIZE}Q", data))
+
+def find_similar(
+    db: Session,
+    signature: List[int],
+    threshold: float,
+    exclude_session: Optional[str] = None,
+    limit: int = 3
+) -> List[Tuple[Export, float]]:
+    """
+    Indexed exports whose text is at least threshold similar
+
+    Only exports sharing an LSH band with the signature are compared, so a
+    query reads a few index entries per band however many exports are
+    indexed.
+
+    Args:
+        db: Database session
+        signature: Signature of the new text
+        threshold: Minimum estimated Jaccard similarity
+        exclude_session: Session whose own earlier exports are ignored
+        limit: Maximum number of matches
+
+    Returns:
+        (export, similarity) pairs, most similar first
+    """
+    candidate_ids = db.exec(
+        select(LshBand.signature_id)
+        .where(LshBand.key.in_(band_keys(signature)))
+        .distinct()
+        .limit(MAX_CANDIDATES)
+    ).all()
+    if not candidate_ids:
+        return []
+
+    rows = db.exec(
+        select(TextSignature, Export)
+        .join(Export, Export.export_id == TextSignature.export_id)
+        .where(TextSignature.id.in_(candidate_ids))
+    ).all()
+    matches = []
+    for row, export in rows:
+        if exclude_session and row.session_id == exclude_session:
+            continue
+        score = similarity(signature, unpack_signature(row.signature))
+        if score >= threshold:
+            matches.append((export, score))
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:limit]
+
+def add_signature(db: Session, export_id: str, session_id: str, signature: List[int], shingle_count: int) -> None:
+    """Add the signature of an export's text to the LSH index"""
+    if db.exec(select(TextSignature.id).where(TextSignature.export_id == export_id)).first() is not None:
+        return
+    row = TextSignature(
+        export_id=export_id,
+        session_id=session_id,
+        shingles=shingle_count,
+        signature=pack_signature(signature)
+    )
+    db.add(row)
+    db.flush()
+    db.add_all([LshBand(key=key, signature_id=row.id) for key in band_keys(signature)])
+    db.commit()
+
+def get_similarity_stats(db: Session) -> Dict[str, int]:
+    return {
+        "indexed_exports": db.exec(select(func.count()).select_from(TextSignature)).one(),
+        "bands": BANDS,
+        "band_rows": BAND_ROWS,
+    }
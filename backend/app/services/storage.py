@@ -0,0 +1,336 @@
+import os
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+class StorageError(Exception):
+    """Custom exception for storage backend errors"""
+    pass
+
+class StorageBackend:
+    """
+    Key/value storage for uploads, intermediates and exports.
+
+    Keys are relative, '/'-separated paths such as
+    ``exports/export_<id>.pdf``. Tools that need a real file (LibreOffice,
+    Pillow) go through local_path(), which returns a replica-local copy.
+    """
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def put_file(self, key: str, file_path: str) -> None:
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> int:
+        raise NotImplementedError
+
+    def list(self, prefix: str) -> List[str]:
+        raise NotImplementedError
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Path:
+        raise NotImplementedError
+
+    def direct_path(self, key: str) -> Optional[Path]:
+        """Path a response can serve as it is, or None if the object has to be streamed"""
+        return None
+
+    def link(self, src_key: str, dst_key: str) -> bool:
+        """
+        Make src_key also visible as dst_key without copying, if supported
+
+        Returns:
+            True if a link was created, False if the backend only supports references
+        """
+        return False
+
+class LocalStorage(StorageBackend):
+    """Storage on a local (or network-mounted) filesystem"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        root = self.root.resolve()
+        path = (root / key).resolve()
+        if path != root and root not in path.parents:
+            raise StorageError(f"Invalid storage key: {key}")
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temp file and rename so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise StorageError(f"Failed to write {key}: {str(e)}")
+
+    def put_file(self, key: str, file_path: str) -> None:
+        path = self._path(key)
+        if Path(file_path).resolve() == path:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        os.close(fd)
+        try:
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise StorageError(f"Failed to store {file_path} as {key}: {str(e)}")
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            raise StorageError(f"Object not found: {key}")
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def size(self, key: str) -> int:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            raise StorageError(f"Object not found: {key}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str) -> int:
+        if not prefix.strip("/"):
+            raise StorageError("Refusing to delete the storage root")
+        path = self._path(prefix)
+        if path.is_dir():
+            count = sum(1 for p in path.rglob("*") if p.is_file())
+            shutil.rmtree(path, ignore_errors=True)
+            return count
+        if path.exists():
+            path.unlink()
+            return 1
+        return 0
+
+    def list(self, prefix: str) -> List[str]:
+        path = self._path(prefix)
+        if not path.is_dir():
+            return []
+        return sorted(
+            str(p.relative_to(self.root.resolve())).replace(os.sep, "/")
+            for p in path.rglob("*") if p.is_file() and not p.name.startswith(".tmp-")
+        )
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def local_path(self, key: str) -> Path:
+        path = self._path(key)
+        if not path.exists():
+            raise StorageError(f"Object not found: {key}")
+        return path
+
+    def direct_path(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        return path if path.exists() else None
+
+    def link(self, src_key: str, dst_key: str) -> bool:
+        src = self._path(src_key)
+        dst = self._path(dst_key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        try:
+            os.link(src, dst)
+            return True
+        except OSError as e:
+            # Different filesystem or no hardlink support
+            logger.warning(f"Hardlink failed ({str(e)}), copying {src_key} instead")
+            shutil.copyfile(src, dst)
+            return False
+
+class S3Storage(StorageBackend):
+    """
+    Storage in an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    Objects are immutable once written, so local_path() keeps downloaded
+    copies in a replica-local cache directory.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        cache_dir: Path,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        prefix: str = ""
+    ):
+        try:
+            import boto3  # Lazy import: only needed for the S3 backend
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise StorageError("boto3 is required for the S3 storage backend")
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_not_found(self, error) -> bool:
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def put_file(self, key: str, file_path: str) -> None:
+        self.client.upload_file(str(file_path), self.bucket, self._key(key))
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+        except self._client_error as e:
+            if self._is_not_found(e):
+                raise StorageError(f"Object not found: {key}")
+            raise
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as e:
+            if self._is_not_found(e):
+                return False
+            raise
+
+    def size(self, key: str) -> int:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except self._client_error as e:
+            if self._is_not_found(e):
+                raise StorageError(f"Object not found: {key}")
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        cached = self.cache_dir / key
+        if cached.exists():
+            cached.unlink()
+
+    def list(self, prefix: str) -> List[str]:
+        keys = []
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys.extend(obj["Key"][strip:] for obj in page.get("Contents", []))
+        return sorted(keys)
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = self.list(prefix)
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self._key(k)} for k in batch]}
+            )
+        shutil.rmtree(self.cache_dir / prefix, ignore_errors=True)
+        return len(keys)
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    def local_path(self, key: str) -> Path:
+        path = self.cache_dir / key
+        if path.exists():
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(key), tmp_path)
+            os.replace(tmp_path, path)
+        except self._client_error as e:
+            os.remove(tmp_path)
+            if self._is_not_found(e):
+                raise StorageError(f"Object not found: {key}")
+            raise
+        return path
+
+def create_storage() -> StorageBackend:
+    """
+    Create the storage backend selected by configuration
+
+    Returns:
+        Configured storage backend, reading cold objects from the compressed tier
+    """
+    from .. import config
+    from .tiering import TieredStorage
+
+    if config.STORAGE_BACKEND == "local":
+        logger.info(f"Using local storage at {config.STORAGE_ROOT}")
+        return TieredStorage(LocalStorage(config.STORAGE_ROOT), config.WORK_ROOT)
+    if config.STORAGE_BACKEND == "s3":
+        logger.info(f"Using S3 storage: bucket={config.S3_BUCKET} endpoint={config.S3_ENDPOINT_URL or 'default'}")
+        return TieredStorage(S3Storage(
+            bucket=config.S3_BUCKET,
+            cache_dir=config.WORK_ROOT / "cache",
+            endpoint_url=config.S3_ENDPOINT_URL,
+            region=config.S3_REGION,
+            access_key_id=config.S3_ACCESS_KEY_ID,
+            secret_access_key=config.S3_SECRET_ACCESS_KEY,
+            prefix=config.S3_PREFIX,
+        ), config.WORK_ROOT)
+    raise StorageError(f"Unknown storage backend: {config.STORAGE_BACKEND}")
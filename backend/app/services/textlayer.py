@@ -0,0 +1,99 @@
+import os
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from .merger import PdfSource, open_pdf, source_name
+
+logger = logging.getLogger(__name__)
+
+# Pages extracted per pool task
+PAGES_PER_TASK = 16
+# Documents shorter than this are extracted in the calling thread
+MIN_PARALLEL_PAGES = 2 * PAGES_PER_TASK
+# Page separator in the text of an export (form feed, as pdftotext uses)
+PAGE_SEPARATOR = "\f"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+class TextExtractionError(Exception):
+    """Custom exception for text extraction errors"""
+    pass
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the server process runs threads
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _extract_range(pdf_path: PdfSource, start: int, end: int) -> List[str]:
+    """Text of pages [start, end) of a PDF; runs in a pool process"""
+    texts = []
+    with open_pdf(pdf_path) as reader:
+        for index in range(start, end):
+            try:
+                texts.append(reader.pages[index].extract_text() or "")
+            except Exception:
+                # One unreadable page shouldn't lose the rest of the document
+                texts.append("")
+    return texts
+
+def page_count(pdf_path: PdfSource) -> int:
+    with open_pdf(pdf_path) as reader:
+        return len(reader.pages)
+
+def extract_pdf_text(pdf_path: PdfSource, workers: Optional[int] = None) -> List[str]:
+    """
+    Extract the text layer of a PDF page by page
+
+    Long documents are split into PAGES_PER_TASK-page ranges extracted in
+    parallel on a process pool; pypdf's extraction is pure Python, so
+    threads wouldn't run it in parallel.
+
+    Args:
+        pdf_path: Path to the PDF, or the PDF as bytes (spilled to a
+            temporary file once when the pool is used, so the document
+            isn't pickled into every task)
+        workers: Pool size, CPU count (at most 4) if omitted
+
+    Returns:
+        Text of each page, in page order
+
+    Raises:
+        TextExtractionError: If the PDF can't be read
+    """
+    try:
+        count = page_count(pdf_path)
+        if count < MIN_PARALLEL_PAGES:
+            return _extract_range(pdf_path, 0, count)
+
+        spilled = None
+        if isinstance(pdf_path, bytes):
+            fd, spilled = tempfile.mkstemp(prefix="textlayer-", suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_path)
+        try:
+            pool = _get_pool(workers or min(4, os.cpu_count() or 1))
+            futures = [
+                pool.submit(_extract_range, spilled or pdf_path, start, min(start + PAGES_PER_TASK, count))
+                for start in range(0, count, PAGES_PER_TASK)
+            ]
+            texts = []
+            for future in futures:
+                texts.extend(future.result())
+            return texts
+        finally:
+            if spilled is not None:
+                os.remove(spilled)
+    except Exception as e:
+        raise TextExtractionError(f"Failed to extract text from {source_name(pdf_path)}: {str(e)}")
+
+def join_pages(pages: List[str]) -> str:
+    """Text of a document from its pages"""
+    return PAGE_SEPARATOR.join(page.strip() for page in pages)
@@ -0,0 +1,316 @@
+import os
+import zlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from ..models import TieredObject
+from .storage import StorageBackend, StorageError, DEFAULT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the compressed copy of an object, per codec
+CODEC_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+# Compressed copies are only kept if they save at least this fraction
+MIN_SAVINGS = 0.05
+
+def _zstandard():
+    try:
+        import zstandard  # Optional: gzip is used without it
+        return zstandard
+    except ImportError:
+        return None
+
+def default_codec() -> str:
+    """zstd when the zstandard package is installed, otherwise gzip"""
+    return "zstd" if _zstandard() is not None else "gzip"
+
+def _compressor(codec: str):
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise StorageError("zstandard is required for zstd compression")
+        return zstandard.ZstdCompressor(level=10).compressobj()
+    if codec == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    raise StorageError(f"Unknown codec: {codec}")
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise StorageError("zstandard is required to read zstd-compressed objects")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+class TieredStorage(StorageBackend):
+    """
+    Storage where cold objects may be kept compressed.
+
+    The tiering job replaces a cold object by ``<key>.zst`` (or ``.gz``) in
+    the wrapped backend. Reads fall back to the compressed copy and
+    decompress it while streaming; local_path() and link() need a real file,
+    so they restore the object to the hot tier first. on_restore, if set, is
+    called with the key of every restored object, so the application can
+    record the access and the job doesn't compress it again next cycle.
+    """
+
+    def __init__(self, inner: StorageBackend, work_dir: Path):
+        self.inner = inner
+        self.work_dir = Path(work_dir)
+        self._restore_lock = threading.Lock()
+        self.on_restore: Optional[Callable[[str], None]] = None
+
+    def _cold_copy(self, key: str) -> Optional[Tuple[str, str]]:
+        """(codec, key) of the compressed copy of an object, if there is one"""
+        for codec, suffix in CODEC_SUFFIXES.items():
+            if self.inner.exists(key + suffix):
+                return codec, key + suffix
+        return None
+
+    def _drop_cold_copies(self, key: str) -> None:
+        for suffix in CODEC_SUFFIXES.values():
+            self.inner.delete(key + suffix)
+
+    def is_cold(self, key: str) -> bool:
+        """Whether an object is only available compressed"""
+        return not self.inner.exists(key) and self._cold_copy(key) is not None
+
+    def _iter_decompressed(self, codec: str, cold_key: str, chunk_size: int) -> Iterator[bytes]:
+        decompressor = _decompressor(codec)
+        for chunk in self.inner.iter_chunks(cold_key, chunk_size):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.inner.put_bytes(key, data)
+        self._drop_cold_copies(key)
+
+    def put_file(self, key: str, file_path: str) -> None:
+        self.inner.put_file(key, file_path)
+        self._drop_cold_copies(key)
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            return self.inner.get_bytes(key)
+        except StorageError:
+            cold = self._cold_copy(key)
+            if cold is None:
+                raise
+            return b"".join(self._iter_decompressed(*cold, DEFAULT_CHUNK_SIZE))
+
+    def exists(self, key: str) -> bool:
+        return self.inner.exists(key) or self._cold_copy(key) is not None
+
+    def size(self, key: str) -> int:
+        """Size of the object; compressed objects are decompressed to count it"""
+        if self.inner.exists(key):
+            return self.inner.size(key)
+        cold = self._cold_copy(key)
+        if cold is None:
+            raise StorageError(f"Object not found: {key}")
+        return sum(len(chunk) for chunk in self._iter_decompressed(*cold, DEFAULT_CHUNK_SIZE))
+
+    def delete(self, key: str) -> None:
+        self.inner.delete(key)
+        self._drop_cold_copies(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self.inner.delete_prefix(prefix)
+
+    def list(self, prefix: str) -> List[str]:
+        keys = set()
+        for key in self.inner.list(prefix):
+            for suffix in CODEC_SUFFIXES.values():
+                if key.endswith(suffix):
+                    key = key[:-len(suffix)]
+                    break
+            keys.add(key)
+        return sorted(keys)
+
+    def iter_chunks(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        if self.inner.exists(key):
+            yield from self.inner.iter_chunks(key, chunk_size)
+            return
+        cold = self._cold_copy(key)
+        if cold is None:
+            raise StorageError(f"Object not found: {key}")
+        yield from self._iter_decompressed(*cold, chunk_size)
+
+    def local_path(self, key: str) -> Path:
+        if not self.inner.exists(key):
+            self.restore(key)
+        return self.inner.local_path(key)
+
+    def direct_path(self, key: str) -> Optional[Path]:
+        return self.inner.direct_path(key)
+
+    def link(self, src_key: str, dst_key: str) -> bool:
+        if not self.inner.exists(src_key):
+            self.restore(src_key)
+        return self.inner.link(src_key, dst_key)
+
+    def put_compressed(self, key: str, data: bytes, codec: Optional[str] = None) -> None:
+        """Store an object straight in the compressed tier; it reads like any other"""
+        codec = codec or default_codec()
+        compressor = _compressor(codec)
+        self.inner.put_bytes(key + CODEC_SUFFIXES[codec], compressor.compress(data) + compressor.flush())
+        self.inner.delete(key)
+        for other, suffix in CODEC_SUFFIXES.items():
+            if other != codec:
+                self.inner.delete(key + suffix)
+
+    def restore(self, key: str) -> None:
+        """
+        Move a compressed object back to the hot tier
+
+        Raises:
+            StorageError: If the object doesn't exist in either tier
+        """
+        with self._restore_lock:
+            if self.inner.exists(key):
+                return
+            cold = self._cold_copy(key)
+            if cold is None:
+                raise StorageError(f"Object not found: {key}")
+
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=str(self.work_dir), prefix=".restore-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in self._iter_decompressed(*cold, DEFAULT_CHUNK_SIZE):
+                        f.write(chunk)
+                self.inner.put_file(key, tmp_path)
+                self.inner.delete(cold[1])
+            finally:
+                os.remove(tmp_path)
+            logger.info(f"Restored {key} from the compressed tier")
+
+        if self.on_restore is not None:
+            try:
+                self.on_restore(key)
+            except Exception as e:
+                logger.warning(f"Failed to record the restore of {key}: {str(e)}")
+
+    def compress(self, key: str, codec: str, min_savings: float = MIN_SAVINGS) -> Tuple[int, int]:
+        """
+        Move an object to the compressed tier
+
+        Args:
+            key: Object key
+            codec: zstd or gzip
+            min_savings: Fraction of the size compression has to save
+
+        Returns:
+            Tuple of (raw size, stored size); the sizes are equal when
+            compression didn't pay off and the object was left as it is
+        """
+        compressor = _compressor(codec)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.work_dir), prefix=".tier-")
+        raw_size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.inner.iter_chunks(key):
+                    raw_size += len(chunk)
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            stored_size = os.path.getsize(tmp_path)
+
+            if raw_size == 0 or stored_size > raw_size * (1 - min_savings):
+                return raw_size, raw_size
+
+            # Write the compressed copy before dropping the original, so readers always find one
+            self.inner.put_file(key + CODEC_SUFFIXES[codec], tmp_path)
+            self.inner.delete(key)
+            return raw_size, stored_size
+        finally:
+            os.remove(tmp_path)
+
+def forget_restored(storage: TieredStorage, db: Session) -> int:
+    """
+    Drop tracking rows of objects that were restored or deleted since they were tiered
+
+    Returns:
+        Number of removed rows
+    """
+    removed = 0
+    for row in db.exec(select(TieredObject)).all():
+        gone = not storage.is_cold(row.key) if row.codec != "none" else not storage.exists(row.key)
+        if gone:
+            db.delete(row)
+            removed += 1
+    db.commit()
+    return removed
+
+def tier_objects(
+    storage: TieredStorage,
+    db: Session,
+    keys: Iterable[str],
+    codec: Optional[str] = None,
+    limit: int = 200
+) -> Dict[str, int]:
+    """
+    Compress cold objects that aren't tiered yet
+
+    Args:
+        storage: Tiered storage
+        db: Database session
+        keys: Candidate object keys
+        codec: zstd or gzip, the default codec if omitted
+        limit: Maximum number of objects to compress
+
+    Returns:
+        Counts of compressed, incompressible and failed objects and saved bytes
+    """
+    codec = codec or default_codec()
+    known = set(db.exec(select(TieredObject.key)).all())
+    result = {"compressed": 0, "incompressible": 0, "failed": 0, "saved_bytes": 0}
+
+    for key in dict.fromkeys(keys):
+        if result["compressed"] + result["incompressible"] >= limit:
+            break
+        if key in known or not storage.inner.exists(key):
+            continue
+        try:
+            raw_size, stored_size = storage.compress(key, codec)
+        except Exception as e:
+            logger.error(f"Failed to compress {key}: {str(e)}")
+            result["failed"] += 1
+            continue
+
+        compressed = stored_size < raw_size
+        db.add(TieredObject(
+            key=key,
+            codec=codec if compressed else "none",
+            raw_size=raw_size,
+            stored_size=stored_size
+        ))
+        db.commit()
+        if compressed:
+            result["compressed"] += 1
+            result["saved_bytes"] += raw_size - stored_size
+        else:
+            result["incompressible"] += 1
+
+    if result["compressed"]:
+        logger.info(f"Tiering compressed {result['compressed']} objects, saved {result['saved_bytes']} bytes")
+    return result
+
+def get_tiering_stats(db: Session) -> Dict[str, Dict[str, int]]:
+    """Number of objects and raw/stored bytes per codec"""
+    stats: Dict[str, Dict[str, int]] = {}
+    for row in db.exec(select(TieredObject)).all():
+        entry = stats.setdefault(row.codec, {"objects": 0, "raw_bytes": 0, "stored_bytes": 0})
+        entry["objects"] += 1
+        entry["raw_bytes"] += row.raw_size
+        entry["stored_bytes"] += row.stored_size
+    return stats
@@ -5,8 +5,13 @@ from typing import List, Tuple, Dict
 from pathlib import Path
 from datetime import datetime
 
+from .merger import parse_page_ranges
+
 logger = logging.getLogger(__name__)
 
+# Upper bound for a single blank page insertion
+MAX_BLANK_PAGES = 10
+
 class ValidationError(Exception):
     """Custom exception for validation errors"""
     pass
@@ -106,12 +111,12 @@ def validate_metadata(metadata: Dict) -> Tuple[List[str], List[str]]:
     
     return warnings, errors
 
-def validate_file_order(file_order: List[str], available_files: List[Dict]) -> Tuple[List[str], List[str]]:
+def validate_file_order(file_order: List, available_files: List[Dict]) -> Tuple[List[str], List[str]]:
     """
     Validate file order and check for logical ordering
     
     Args:
-        file_order: List of file IDs in desired order
+        file_order: File IDs, or page selection dicts (file_id, pages, rotate, blank), in desired order
         available_files: List of available file dictionaries
         
     Returns:
@@ -124,15 +129,41 @@ def validate_file_order(file_order: List[str], available_files: List[Dict]) -> T
         errors.append("No file order specified")
         return warnings, errors
     
-    # Check if all files in order exist
+    # Check if all files in order exist and page selections are well-formed
     available_file_ids = {f.get('id') for f in available_files}
-    for file_id in file_order:
+    first_file_id = None
+    for entry in file_order:
+        if isinstance(entry, str):
+            entry = {'file_id': entry}
+        file_id = entry.get('file_id')
+        blank = entry.get('blank') or 0
+
+        if blank:
+            if file_id:
+                errors.append(f"Entry for file {file_id} cannot also insert blank pages")
+            elif blank < 0 or blank > MAX_BLANK_PAGES:
+                errors.append(f"Blank page count must be between 1 and {MAX_BLANK_PAGES}")
+            continue
+
+        if not file_id:
+            errors.append("Order entry must reference a file or insert blank pages")
+            continue
         if file_id not in available_file_ids:
             errors.append(f"File ID {file_id} not found in uploaded files")
+        if first_file_id is None:
+            first_file_id = file_id
+
+        if (entry.get('rotate') or 0) % 90 != 0:
+            errors.append(f"Rotation for file {file_id} must be a multiple of 90 degrees")
+        if entry.get('pages'):
+            try:
+                parse_page_ranges(entry['pages'])
+            except ValueError as e:
+                errors.append(f"Invalid page range '{entry['pages']}' for file {file_id}: {str(e)}")
     
     # Check for logical ordering (title page should be first)
-    if available_files:
-        first_file = next((f for f in available_files if f.get('id') == file_order[0]), None)
+    if available_files and first_file_id:
+        first_file = next((f for f in available_files if f.get('id') == first_file_id), None)
         if first_file:
             first_file_name = first_file.get('name', '').lower()
             if not any(keyword in first_file_name for keyword in ['titul', 'титул', 'title']):
@@ -0,0 +1,175 @@
+"""
+Round-trip checks for the storage backends
+
+    python -m app.storagecheck                 # local storage in a temp directory
+    python -m app.storagecheck --s3            # plus the S3 bucket from S3_* (e.g. the MinIO of docker-compose)
+    python -m app.storagecheck --stand-in      # plus S3 against an in-process moto server
+
+Every backend is also checked wrapped in TieredStorage, with objects moved
+to the compressed tier. Objects are written under a fresh storagecheck-<id>/
+prefix, which is removed afterwards. Exits non-zero if any check fails.
+"""
+import os
+import sys
+import uuid
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from . import config
+from .services.storage import LocalStorage, S3Storage, StorageBackend, StorageError
+from .services.tiering import TieredStorage, default_codec
+
+# Larger than one streaming chunk, so chunked reads are exercised
+PAYLOAD = os.urandom(3 * 1024 + 7) + b"vkr" * 50_000
+CHUNK_SIZE = 64 * 1024
+
+def storage_checks(storage: StorageBackend, prefix: str, work_dir: str) -> List[Tuple[str, Callable[[], None]]]:
+    """Named checks against one backend, each raising AssertionError on a mismatch"""
+    key = f"{prefix}/uploads/a/thesis.pdf"
+    tiered = TieredStorage(storage, Path(work_dir) / "tiering")
+
+    def put_get_exists_size():
+        storage.put_bytes(key, PAYLOAD)
+        assert storage.exists(key)
+        assert storage.get_bytes(key) == PAYLOAD
+        assert storage.size(key) == len(PAYLOAD)
+
+    def streaming():
+        chunks = list(storage.iter_chunks(key, CHUNK_SIZE))
+        assert len(chunks) > 1 and b"".join(chunks) == PAYLOAD, [len(c) for c in chunks]
+
+    def put_file():
+        path = os.path.join(work_dir, "source.bin")
+        with open(path, "wb") as f:
+            f.write(PAYLOAD[::-1])
+        storage.put_file(f"{prefix}/intermediates/part.pdf", path)
+        assert storage.get_bytes(f"{prefix}/intermediates/part.pdf") == PAYLOAD[::-1]
+
+    def local_copy():
+        # Object stores download into the replica cache once and serve it from there
+        first = storage.local_path(key)
+        assert first.read_bytes() == PAYLOAD
+        assert storage.local_path(key) == first
+
+    def missing_objects():
+        missing = f"{prefix}/missing.pdf"
+        assert not storage.exists(missing)
+        for read in (storage.get_bytes, storage.size, storage.local_path):
+            try:
+                read(missing)
+            except StorageError:
+                continue
+            raise AssertionError(f"no StorageError from {read.__name__} for a missing object")
+
+    def link():
+        linked = storage.link(key, f"{prefix}/uploads/b/thesis.pdf")
+        if linked:
+            assert storage.get_bytes(f"{prefix}/uploads/b/thesis.pdf") == PAYLOAD
+        else:
+            # Backends without links reference blobs by key; nothing is copied
+            assert not isinstance(storage, LocalStorage), "local storage fell back to a copy"
+
+    def listing():
+        listed = storage.list(f"{prefix}/uploads")
+        assert f"{prefix}/uploads/a/thesis.pdf" in listed, listed
+        assert all(k.startswith(f"{prefix}/uploads/") for k in listed), listed
+
+    def delete():
+        cached = storage.local_path(key)
+        storage.delete(key)
+        assert not storage.exists(key)
+        assert not cached.exists() or isinstance(storage, LocalStorage), "cached copy outlived its object"
+        storage.delete(key)  # Deleting twice is not an error
+
+    def compressed_tier():
+        cold = f"{prefix}/exports/export.pdf"
+        tiered.put_bytes(cold, PAYLOAD)
+        raw_size, stored_size = tiered.compress(cold, default_codec())
+        assert stored_size < raw_size and tiered.is_cold(cold)
+        assert tiered.exists(cold) and tiered.list(f"{prefix}/exports") == [cold]
+        assert tiered.get_bytes(cold) == PAYLOAD
+        assert b"".join(tiered.iter_chunks(cold, CHUNK_SIZE)) == PAYLOAD
+        assert tiered.size(cold) == len(PAYLOAD)
+        # Paths need a real file, so the object comes back to the hot tier
+        assert tiered.local_path(cold).read_bytes() == PAYLOAD and not tiered.is_cold(cold)
+        tiered.delete(cold)
+        assert not tiered.exists(cold)
+
+    def delete_prefix():
+        storage.put_bytes(f"{prefix}/sessions/x/1", b"1")
+        storage.put_bytes(f"{prefix}/sessions/x/2", b"2")
+        assert storage.delete_prefix(f"{prefix}/sessions/x") == 2
+        assert storage.list(f"{prefix}/sessions/x") == []
+
+    return [(check.__name__, check) for check in (
+        put_get_exists_size, streaming, put_file, local_copy, missing_objects, link, listing, delete,
+        compressed_tier, delete_prefix,
+    )]
+
+def run_checks(name: str, storage: StorageBackend) -> int:
+    failures = 0
+    prefix = f"storagecheck-{uuid.uuid4().hex[:8]}"
+    print(name)
+    with tempfile.TemporaryDirectory(prefix="storagecheck-") as work_dir:
+        try:
+            for check_name, check in storage_checks(storage, prefix, work_dir):
+                try:
+                    check()
+                    print(f"  ok    {check_name}")
+                except Exception as e:
+                    failures += 1
+                    print(f"  FAIL  {check_name}: {type(e).__name__}: {e}")
+        finally:
+            storage.delete_prefix(prefix)
+    return failures
+
+def _s3(cache_dir: str, **options) -> S3Storage:
+    return S3Storage(
+        bucket=options.pop("bucket", config.S3_BUCKET),
+        cache_dir=Path(cache_dir),
+        endpoint_url=options.pop("endpoint_url", config.S3_ENDPOINT_URL),
+        region=options.pop("region", config.S3_REGION),
+        access_key_id=options.pop("access_key_id", config.S3_ACCESS_KEY_ID),
+        secret_access_key=options.pop("secret_access_key", config.S3_SECRET_ACCESS_KEY),
+        prefix=options.pop("prefix", config.S3_PREFIX),
+    )
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.storagecheck", description="Storage backend round-trip checks")
+    parser.add_argument("--s3", action="store_true", help="Also check the S3 bucket configured by the S3_* variables")
+    parser.add_argument("--stand-in", action="store_true", help="Also check S3 against an in-process moto server")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="storagecheck-") as root:
+        failures += run_checks("local", LocalStorage(Path(root) / "local"))
+
+        if args.s3:
+            failures += run_checks(f"s3 ({config.S3_ENDPOINT_URL or 'default endpoint'})", _s3(os.path.join(root, "s3")))
+
+        if args.stand_in:
+            try:
+                from moto.server import ThreadedMotoServer  # Lazy import: a development tool only
+            except ImportError:
+                print('--stand-in needs moto: pip install "moto[server]"')
+                return 2
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+            server.start()
+            try:
+                host, port = server.get_host_and_port()
+                storage = _s3(
+                    os.path.join(root, "stand-in"), bucket="storagecheck", endpoint_url=f"http://{host}:{port}",
+                    region="us-east-1", access_key_id="storagecheck", secret_access_key="storagecheck", prefix="vkr"
+                )
+                storage.client.create_bucket(Bucket="storagecheck")
+                failures += run_checks(f"s3 stand-in (moto at {host}:{port})", storage)
+            finally:
+                server.stop()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
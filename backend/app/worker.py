@@ -0,0 +1,162 @@
+"""
+Export worker: claims export jobs from the database queue and builds them
+
+    EXPORT_QUEUE=database uvicorn app.main:app    # web processes, HTTP only
+    python -m app.worker --concurrency 2           # as many workers as needed
+
+A worker heartbeats the jobs it runs. A job whose lease runs out because its
+worker crashed or hung goes back to the queue for another worker. Failed
+tries are retried with exponential backoff, QUEUE_MAX_ATTEMPTS tries in all.
+On SIGTERM a worker stops claiming, finishes its jobs for up to --grace
+seconds and hands the rest back to the queue.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import socket
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from . import main as api
+from .db import init_db, engine
+from .models import TenantPriority
+from .services.cancellation import CancelToken
+from .services.scheduler import Job
+
+logger = logging.getLogger(__name__)
+
+# Cancel reasons that hand a job back instead of failing it
+LEASE_LOST = "lease lost"
+SHUTTING_DOWN = "worker shutting down"
+
+class Worker:
+    """
+    Claims jobs up to its concurrency and runs them on the export scheduler.
+
+    Args:
+        concurrency: Jobs run at once (the export scheduler's worker threads)
+        poll_seconds: Pause between looks at the queue
+        grace_seconds: How long a stopping worker lets running jobs finish
+    """
+
+    def __init__(self, concurrency: int, poll_seconds: float = 1.0, grace_seconds: float = 30.0):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.grace_seconds = grace_seconds
+        self.heartbeat_seconds = api.QUEUE_LEASE_SECONDS / 3
+        # job ID -> (scheduler job, cancel token, payload)
+        self.active: Dict[str, Tuple[Job, CancelToken, dict]] = {}
+        self.stopping_since: Optional[float] = None
+        # Text extraction runs after a job is reported complete, so waiting clients don't wait for it
+        self.text_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="text")
+
+    def stop(self, *_) -> None:
+        if self.stopping_since is None:
+            logger.info(f"Worker {self.id} stopping, {len(self.active)} job(s) running")
+            self.stopping_since = time.monotonic()
+
+    def _claim(self) -> None:
+        while len(self.active) < self.concurrency:
+            queued = api.job_queue.claim(self.id, kinds=["export"], weight=api.export_scheduler.effective_weight)
+            if queued is None:
+                return
+            payload = json.loads(queued.payload)
+            token = CancelToken.with_timeout(api.EXPORT_TIMEOUT_SECONDS)
+            job = api.export_scheduler.submit(
+                queued.job_id, queued.cost, api.run_queued_export, payload, token, tenant=queued.tenant
+            )
+            self.active[queued.job_id] = (job, token, payload)
+
+    def _heartbeat(self) -> None:
+        for job_id, (job, token, _) in list(self.active.items()):
+            if job.future.done():
+                continue
+            if not api.job_queue.heartbeat(job_id, self.id, job.stage, job.progress):
+                logger.warning(f"Worker {self.id} lost the lease on job {job_id}")
+                token.cancel(LEASE_LOST)
+
+    def _reap(self) -> None:
+        for job_id, (job, token, payload) in list(self.active.items()):
+            if not job.future.done():
+                continue
+            del self.active[job_id]
+            error = job.future.exception()
+            if error is None:
+                if api.job_queue.complete(job_id, self.id, job.future.result()):
+                    self.text_executor.submit(api.extract_queued_text, payload)
+            elif token.reason == LEASE_LOST:
+                pass  # Another worker has the job now
+            elif token.reason == SHUTTING_DOWN:
+                api.job_queue.release(job_id, self.id)
+            else:
+                status_code = api.queued_error_status(error)
+                api.job_queue.fail(
+                    job_id, self.id, str(error),
+                    retryable=status_code is None,
+                    status_code=status_code or 500
+                )
+
+    def _maintain(self) -> None:
+        """Recover jobs of crashed workers and drop old history"""
+        api.job_queue.recover_expired()
+        pruned = api.job_queue.prune(timedelta(days=api.QUEUE_HISTORY_DAYS))
+        if pruned:
+            logger.info(f"Pruned {pruned} finished job(s)")
+
+    def run(self) -> None:
+        logger.info(f"Worker {self.id} running {self.concurrency} job(s) at a time")
+        last_heartbeat = last_maintenance = 0.0
+        while True:
+            now = time.monotonic()
+            if now - last_maintenance >= self.heartbeat_seconds:
+                self._maintain()
+                last_maintenance = now
+            self._reap()
+            if self.stopping_since is None:
+                self._claim()
+            elif not self.active:
+                break
+            elif now - self.stopping_since > self.grace_seconds:
+                for _, token, _ in self.active.values():
+                    token.cancel(SHUTTING_DOWN)
+            if now - last_heartbeat >= self.heartbeat_seconds:
+                self._heartbeat()
+                last_heartbeat = now
+            time.sleep(self.poll_seconds)
+        self.text_executor.shutdown(wait=True)
+        logger.info(f"Worker {self.id} stopped")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.worker", description="Build queued exports")
+    parser.add_argument("--concurrency", type=int, default=api.MAX_ACTIVE_EXPORTS, help="Jobs run at once")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between looks at the queue")
+    parser.add_argument("--grace", type=float, default=30.0, help="Seconds running jobs get to finish on SIGTERM")
+    args = parser.parse_args(argv)
+
+    init_db()
+    with Session(engine) as db:
+        api.cost_model.fit(db)
+        for priority in db.exec(select(TenantPriority)).all():
+            api._apply_tenant_priority(priority)
+
+    # The export scheduler's threads are the worker's job slots
+    concurrency = min(args.concurrency, api.export_scheduler.workers)
+    if concurrency < args.concurrency:
+        logger.warning(f"Concurrency capped at MAX_ACTIVE_EXPORTS={api.export_scheduler.workers}")
+    worker = Worker(concurrency, poll_seconds=args.poll, grace_seconds=args.grace)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
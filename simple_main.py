@@ -2,15 +2,23 @@
 """
 Simple version of main.py for Railway deployment testing
 """
+import io
 import os
+import hmac
+import time
+import shutil
+import asyncio
 import logging
 import uuid
 import tempfile
-from typing import List
+import threading
+import tracemalloc
+from collections import OrderedDict
+from typing import BinaryIO, List, Dict, Optional, Tuple, Union
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 import pypdf
 from PIL import Image
 import subprocess
@@ -25,6 +33,161 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Memory instrumentation
+# Token for the /api/admin endpoints; they are disabled without it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Stack depth tracemalloc records once an admin takes the first snapshot
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", 10))
+MAX_SNAPSHOTS = 8
+TOP_LINES = 5
+
+def _status_kb(field: str) -> Optional[int]:
+    """A kB field of /proc/self/status, None where there is no procfs"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def rss_mb() -> Optional[float]:
+    kb = _status_kb("VmRSS")
+    return kb / 1024 if kb is not None else None
+
+def peak_rss_mb() -> Optional[float]:
+    kb = _status_kb("VmHWM")
+    if kb is not None:
+        return kb / 1024
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return None
+
+def memory_gauges() -> dict:
+    """RSS, open file descriptors and child processes (LibreOffice)"""
+    try:
+        open_fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        open_fds = None
+    try:
+        children = set()
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children", "r") as f:
+                children.update(f.read().split())
+        child_processes = len(children)
+    except OSError:
+        child_processes = None
+    rss, peak = rss_mb(), peak_rss_mb()
+    return {
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "open_fds": open_fds,
+        "child_processes": child_processes,
+        "threads": threading.active_count()
+    }
+
+class MemoryRecorder:
+    """Totals of the RSS and peak RSS growth per route and per export"""
+
+    def __init__(self):
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def probe(self) -> Tuple[Optional[float], Optional[float]]:
+        return rss_mb(), peak_rss_mb()
+
+    def record(self, name: str, before: Tuple[Optional[float], Optional[float]]) -> Optional[float]:
+        """Record the growth since probe() returned before; returns the RSS growth"""
+        (rss_before, peak_before), (rss, peak) = before, self.probe()
+        if rss is None or rss_before is None:
+            return None
+        with self._lock:
+            entry = self.totals.setdefault(name, {"count": 0, "rss_delta_mb": 0.0, "max_rss_delta_mb": 0.0, "peak_delta_mb": 0.0})
+            entry["count"] += 1
+            entry["rss_delta_mb"] += rss - rss_before
+            entry["max_rss_delta_mb"] = max(entry["max_rss_delta_mb"], rss - rss_before)
+            entry["peak_delta_mb"] += (peak - peak_before) if peak is not None and peak_before is not None else 0.0
+        return rss - rss_before
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "count": entry["count"],
+                    "avg_rss_delta_mb": round(entry["rss_delta_mb"] / entry["count"], 2),
+                    "max_rss_delta_mb": round(entry["max_rss_delta_mb"], 1),
+                    "total_peak_delta_mb": round(entry["peak_delta_mb"], 1)
+                }
+                for name, entry in sorted(self.totals.items())
+            }
+
+memory_recorder = MemoryRecorder()
+memory_snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+
+def _line_groups() -> List[Tuple[int, int, str]]:
+    """Line spans of this file's converter, merger and session store code"""
+    import inspect
+    spans = []
+    for name, group in (
+        ("convert_docx_to_pdf", "converter"), ("convert_image_to_pdf", "converter"),
+        ("merge_pdfs", "merger"), ("SessionStore", "session_store")
+    ):
+        lines, start = inspect.getsourcelines(globals()[name])
+        spans.append((start, start + len(lines), group))
+    return spans
+
+def _attribute(traceback: "tracemalloc.Traceback", spans: List[Tuple[int, int, str]]) -> Tuple[str, str]:
+    """
+    (module, "file:line") an allocation is charged to
+
+    The innermost frame in this file wins, so a pypdf object allocated for
+    a merge is charged to merger; anything else goes to the package of its
+    innermost frame.
+    """
+    fallback = None
+    for frame in reversed(traceback):
+        path = Path(frame.filename)
+        if path.name == Path(__file__).name:
+            group = next((group for start, end, group in spans if start <= frame.lineno < end), "routes")
+            return group, f"{path.name}:{frame.lineno}"
+        if fallback is None:
+            parts = path.parts
+            if "site-packages" in parts and parts.index("site-packages") + 1 < len(parts):
+                fallback = (parts[parts.index("site-packages") + 1].split(".")[0], f"{path.name}:{frame.lineno}")
+    if fallback is not None:
+        return fallback
+    if not len(traceback):
+        return "other", "?"
+    return "other", f"{Path(traceback[-1].filename).name}:{traceback[-1].lineno}"
+
+def _group_snapshot(snapshot: "tracemalloc.Snapshot") -> Dict[str, Dict[str, List[int]]]:
+    """Bytes and blocks per module and allocation site"""
+    spans = _line_groups()
+    groups: Dict[str, Dict[str, List[int]]] = {}
+    for stat in snapshot.statistics("traceback"):
+        module, site = _attribute(stat.traceback, spans)
+        entry = groups.setdefault(module, {}).setdefault(site, [0, 0])
+        entry[0] += stat.size
+        entry[1] += stat.count
+    return groups
+
+@app.middleware("http")
+async def record_memory_deltas(request, call_next):
+    before = memory_recorder.probe()
+    try:
+        return await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        if route is not None:
+            memory_recorder.record(f"{request.method} {route.path}", before)
+
+def require_admin(token: Optional[str] = Header(default=None, alias="X-Admin-Token")) -> None:
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -44,10 +207,185 @@ async def startup_event():
     logger.info("=== VKR Export System Starting ===")
     logger.info(f"Python path: {os.environ.get('PYTHONPATH', 'Not set')}")
     logger.info(f"Current working directory: {os.getcwd()}")
+    asyncio.create_task(evict_sessions_periodically())
     logger.info("VKR Export System started successfully")
 
+# Session store limits
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", 6 * 60 * 60))
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 500))
+SESSION_STORE_MAX_MB = int(os.environ.get("SESSION_STORE_MAX_MB", 2048))
+EVICTION_INTERVAL_SECONDS = 60
+# Uploads are kept as buffers until a session's total passes this, and such
+# sessions convert images and merge in memory and serve the export from
+# memory (0 disables); later uploads are read to disk in UPLOAD_CHUNK_SIZE
+# chunks, and DOCX files always are, LibreOffice needs a file
+IN_MEMORY_MAX_MB = float(os.environ.get("IN_MEMORY_MAX_MB", 16))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class SessionStore:
+    """
+    Bounded in-process session store.
+
+    Sessions are kept in LRU order and evicted (temp dir included) when they
+    have been idle for longer than the TTL, or when the number of sessions or
+    the bytes they hold exceed their caps. Exports are indexed by export_id
+    so downloads don't have to scan every session.
+    """
+
+    def __init__(self, ttl_seconds: int, max_sessions: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._exports: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evicted = {"ttl": 0, "lru": 0, "memory": 0}
+        self.exports_built = {"in_memory": 0, "disk": 0}
+
+    def create(self, temp_dir: Optional[str] = None) -> str:
+        session_id = str(uuid.uuid4())
+        with self._lock:
+            self._sessions[session_id] = {
+                "temp_dir": temp_dir,
+                "files": [],
+                "exports": {},
+                "parts": {},
+                "bytes": 0,
+                "last_access": time.monotonic()
+            }
+            self._enforce_limits()
+        return session_id
+
+    def temp_dir(self, session_id: str) -> str:
+        """The session's temp dir, created on first use (in-memory sessions may never need one)"""
+        with self._lock:
+            session = self._sessions[session_id]
+            if session["temp_dir"] is None:
+                session["temp_dir"] = tempfile.mkdtemp()
+            return session["temp_dir"]
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["last_access"] = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def add_bytes(self, session_id: str, size: int) -> None:
+        """Account bytes held by a session (files on disk or buffers)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session["bytes"] += size
+            self.total_bytes += size
+            self._enforce_limits(keep=session_id)
+
+    def add_file(self, session_id: str, path: str) -> None:
+        """Account a file written for a session; rewriting a path replaces its earlier size"""
+        size = os.path.getsize(path)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            delta = size - session["parts"].get(path, 0)
+            session["parts"][path] = size
+            session["bytes"] += delta
+            self.total_bytes += delta
+            self._enforce_limits(keep=session_id)
+
+    def add_export(self, session_id: str, export_id: str, export: dict) -> None:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session["exports"][export_id] = export
+            self._exports[export_id] = session_id
+
+    def count_export(self, kind: str) -> None:
+        """Count an export built in memory or on disk"""
+        with self._lock:
+            self.exports_built[kind] += 1
+
+    def find_export(self, export_id: str) -> Optional[dict]:
+        with self._lock:
+            session_id = self._exports.get(export_id)
+            if session_id is None:
+                return None
+            session = self._sessions[session_id]
+            session["last_access"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session["exports"].get(export_id)
+
+    def evict_expired(self) -> int:
+        with self._lock:
+            return self._evict_expired()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "files": sum(len(session["files"]) for session in self._sessions.values()),
+                "parts": sum(len(session["parts"]) for session in self._sessions.values()),
+                "exports": len(self._exports),
+                "bytes": self.total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evicted": dict(self.evicted),
+                "exports_built": dict(self.exports_built)
+            }
+
+    def _evict_expired(self) -> int:
+        # LRU order means the idle-longest sessions come first
+        cutoff = time.monotonic() - self.ttl_seconds
+        count = 0
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["last_access"] > cutoff:
+                break
+            self._evict(session_id, "ttl")
+            count += 1
+        return count
+
+    def _enforce_limits(self, keep: Optional[str] = None) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._evict(next(iter(self._sessions)), "lru")
+        while self.total_bytes > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._evict(oldest, "memory")
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        session = self._sessions.pop(session_id)
+        for export_id in session["exports"]:
+            self._exports.pop(export_id, None)
+        self.total_bytes -= session["bytes"]
+        self.evicted[reason] += 1
+        if session["temp_dir"] is not None:
+            shutil.rmtree(session["temp_dir"], ignore_errors=True)
+        logger.info(f"Evicted session {session_id} ({reason})")
+
 # Global storage for sessions and files
-sessions = {}
+session_store = SessionStore(
+    ttl_seconds=SESSION_TTL_SECONDS,
+    max_sessions=MAX_SESSIONS,
+    max_bytes=SESSION_STORE_MAX_MB * 1024 * 1024
+)
+
+async def evict_sessions_periodically():
+    """Expire idle sessions even when no requests come in"""
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL_SECONDS)
+        try:
+            session_store.evict_expired()
+        except Exception as e:
+            logger.error(f"Session eviction failed: {str(e)}")
 
 def get_file_type(filename: str) -> str:
     """Determine file type from extension"""
@@ -102,8 +440,8 @@ def convert_docx_to_pdf(docx_path: str, output_dir: str) -> str:
         logger.error(f"Failed to convert DOCX to PDF: {str(e)}", exc_info=True)
         raise Exception(f"Failed to convert DOCX: {str(e)}")
 
-def convert_image_to_pdf(image_path: str, output_pdf: str):
-    """Convert image to PDF"""
+def convert_image_to_pdf(image_path: Union[str, BinaryIO], output_pdf: Union[str, BinaryIO]):
+    """Convert image to PDF; either side may be a path or a binary file object"""
     try:
         logger.info(f"Converting image: {image_path} -> {output_pdf}")
         
@@ -121,22 +459,25 @@ def convert_image_to_pdf(image_path: str, output_pdf: str):
         logger.error(f"Failed to convert image to PDF: {str(e)}", exc_info=True)
         raise Exception(f"Failed to convert image: {str(e)}")
 
-def merge_pdfs(pdf_paths: List[str], output_path: str):
-    """Merge multiple PDFs into one"""
+def merge_pdfs(pdf_paths: List[Union[str, BinaryIO]], output_path: Union[str, BinaryIO]):
+    """Merge multiple PDFs into one; inputs and output may be paths or binary file objects"""
     try:
         logger.info(f"Merging PDFs: {pdf_paths} -> {output_path}")
         
         merger = pypdf.PdfMerger()
         
         for i, pdf_path in enumerate(pdf_paths):
-            if os.path.exists(pdf_path):
+            if not isinstance(pdf_path, str) or os.path.exists(pdf_path):
                 logger.info(f"Adding PDF {i+1}/{len(pdf_paths)}: {pdf_path}")
                 merger.append(pdf_path)
             else:
                 logger.warning(f"PDF file not found: {pdf_path}")
         
-        with open(output_path, 'wb') as output_file:
-            merger.write(output_file)
+        if isinstance(output_path, str):
+            with open(output_path, 'wb') as output_file:
+                merger.write(output_file)
+        else:
+            merger.write(output_path)
         
         merger.close()
         logger.info(f"Successfully merged PDFs to: {output_path}")
@@ -163,42 +504,157 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/api/stats")
+async def get_stats():
+    """Session store statistics"""
+    return {**session_store.stats(), "memory": memory_gauges()}
+
+@app.get("/api/admin/memory", dependencies=[Depends(require_admin)])
+async def memory_overview():
+    """RSS, descriptors, child processes, session store size and memory growth per route and export"""
+    return {
+        "gauges": memory_gauges(),
+        "session_store": session_store.stats(),
+        "tracing": tracemalloc.is_tracing(),
+        "snapshots": list(memory_snapshots),
+        "deltas": memory_recorder.stats()
+    }
+
+@app.post("/api/admin/memory/snapshots/{name}", dependencies=[Depends(require_admin)])
+async def take_memory_snapshot(name: str):
+    """
+    Take a named tracemalloc snapshot, starting tracing with the first one
+
+    Tracing slows the server down; DELETE /api/admin/memory/snapshots stops it.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+        logger.info(f"tracemalloc started with {MEMORY_TRACE_FRAMES} frames")
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    memory_snapshots.pop(name, None)
+    memory_snapshots[name] = snapshot
+    while len(memory_snapshots) > MAX_SNAPSHOTS:
+        memory_snapshots.popitem(last=False)
+    traced, peak = tracemalloc.get_traced_memory()
+    modules = {module: sum(size for size, _ in sites.values()) for module, sites in _group_snapshot(snapshot).items()}
+    return {
+        "name": name,
+        "traced_mb": round(traced / (1024 * 1024), 2),
+        "traced_peak_mb": round(peak / (1024 * 1024), 2),
+        "session_store": session_store.stats(),
+        "modules": {m: round(size / (1024 * 1024), 3) for m, size in sorted(modules.items(), key=lambda i: -i[1])}
+    }
+
+@app.get("/api/admin/memory/diff", dependencies=[Depends(require_admin)])
+async def diff_memory_snapshots(before: str, after: Optional[str] = None):
+    """Memory growth from snapshot before to snapshot after (a fresh one if omitted), by module"""
+    if before not in memory_snapshots:
+        raise HTTPException(status_code=404, detail=f"Snapshot not found: {before}")
+    if after is None:
+        after = "latest"
+        await take_memory_snapshot(after)
+    if after not in memory_snapshots:
+        raise HTTPException(status_code=404, detail=f"Snapshot not found: {after}")
+    old, new = _group_snapshot(memory_snapshots[before]), _group_snapshot(memory_snapshots[after])
+    result = []
+    for module in set(old) | set(new):
+        sites = []
+        for site in set(old.get(module, {})) | set(new.get(module, {})):
+            size_before, count_before = old.get(module, {}).get(site, (0, 0))
+            size_after, count_after = new.get(module, {}).get(site, (0, 0))
+            if (size_after, count_after) != (size_before, count_before):
+                sites.append((site, size_after - size_before, count_after - count_before))
+        if not sites:
+            continue
+        sites.sort(key=lambda site: site[1], reverse=True)
+        result.append({
+            "module": module,
+            "size_delta_kb": round(sum(site[1] for site in sites) / 1024, 1),
+            "blocks_delta": sum(site[2] for site in sites),
+            "top_lines": [
+                {"line": site, "size_delta_kb": round(size / 1024, 1), "blocks_delta": count}
+                for site, size, count in sites[:TOP_LINES]
+            ]
+        })
+    result.sort(key=lambda entry: entry["size_delta_kb"], reverse=True)
+    return {"before": before, "after": after, "modules": result}
+
+@app.delete("/api/admin/memory/snapshots", dependencies=[Depends(require_admin)])
+async def stop_memory_tracing():
+    """Stop tracemalloc and drop all snapshots"""
+    memory_snapshots.clear()
+    tracemalloc.stop()
+    return {"tracing": False}
+
+async def _receive_upload(file: UploadFile, session_id: str, keep_bytes: int) -> Tuple[Optional[bytes], Optional[str], int]:
+    """
+    Read an upload chunk by chunk, keeping it as a buffer while it fits in keep_bytes
+
+    Returns:
+        Tuple of (data, path, size): the buffer, or the path it was written
+        to in the session's temp dir once it outgrew keep_bytes
+    """
+    buffer = bytearray()
+    out = None
+    path = None
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if out is None and size > keep_bytes:
+                path = os.path.join(session_store.temp_dir(session_id), Path(file.filename).name)
+                out = open(path, "wb")
+                out.write(buffer)
+                buffer = bytearray()
+            if out is None:
+                buffer += chunk
+            else:
+                out.write(chunk)
+        if out is None and keep_bytes <= 0:
+            # An empty file that still has to be on disk
+            path = os.path.join(session_store.temp_dir(session_id), Path(file.filename).name)
+            out = open(path, "wb")
+    finally:
+        if out is not None:
+            out.close()
+    return (None, path, size) if path else (bytes(buffer), None, size)
+
 @app.post("/api/upload")
 async def upload_files(files: List[UploadFile] = File(...)):
     """Upload endpoint - simplified version"""
-    session_id = str(uuid.uuid4())
+    session_id = session_store.create()
+    session = session_store.get(session_id)
     
-    # Create temporary directory for this session
-    temp_dir = tempfile.mkdtemp()
-    sessions[session_id] = {
-        "temp_dir": temp_dir,
-        "files": []
-    }
-    
-    # Process uploaded files
+    # Process uploaded files one at a time; buffers are kept while the session
+    # stays within IN_MEMORY_MAX_MB and the temp dir is only created when
+    # something is written
+    memory_budget = int(IN_MEMORY_MAX_MB * 1024 * 1024)
     uploaded_files = []
     for file in files:
-        # Read file content
-        content = await file.read()
-        
-        # Save file to temporary directory
-        file_path = os.path.join(temp_dir, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
+        filename = file.filename
         # Determine file type
-        file_type = get_file_type(file.filename)
+        file_type = get_file_type(filename)
+        
+        keep_bytes = max(memory_budget, 0) if file_type != "docx" else 0
+        data, file_path, size = await _receive_upload(file, session_id, keep_bytes)
+        memory_budget -= size
         
         file_info = {
             "id": str(uuid.uuid4()),
-            "name": file.filename,
+            "name": filename,
             "type": file_type,
-            "size": len(content),
+            "size": size,
             "path": file_path
         }
+        if data is not None:
+            file_info["data"] = data
         
-        uploaded_files.append(file_info)
-        sessions[session_id]["files"].append(file_info)
+        uploaded_files.append({key: value for key, value in file_info.items() if key != "data"})
+        session["files"].append(file_info)
+        session_store.add_bytes(session_id, size)
     
     return {
         "session_id": session_id,
@@ -212,6 +668,7 @@ async def prepare_export(request_data: dict):
     """Prepare export endpoint - process files and create PDF"""
     try:
         logger.info(f"Prepare export request: {request_data}")
+        memory_before = memory_recorder.probe()
         
         session_id = request_data.get("session_id")
         # Frontend sends 'order' as an array of file ids in the desired order
@@ -222,20 +679,17 @@ async def prepare_export(request_data: dict):
         
         logger.info(f"Session ID: {session_id}")
         logger.info(f"Order count: {len(order_ids)} | Files payload count: {len(files)}")
-        logger.info(f"Available sessions: {list(sessions.keys())}")
         
-        if session_id not in sessions:
-            logger.error(f"Session {session_id} not found in {list(sessions.keys())}")
+        session = session_store.get(session_id)
+        if session is None:
+            logger.error(f"Session {session_id} not found")
             raise HTTPException(status_code=404, detail="Session not found")
         
-        session = sessions[session_id]
-        temp_dir = session["temp_dir"]
-        logger.info(f"Using temp directory: {temp_dir}")
-        
-        # Create output directory
-        output_dir = os.path.join(temp_dir, "output")
-        os.makedirs(output_dir, exist_ok=True)
-        logger.info(f"Created output directory: {output_dir}")
+        def output_dir() -> str:
+            """Directory for converted files, created only when something is written to disk"""
+            path = os.path.join(session_store.temp_dir(session_id), "output")
+            os.makedirs(path, exist_ok=True)
+            return path
         
         # Build an ordered list of file dicts from the stored session using the provided order_ids
         ordered_files: List[dict] = []
@@ -263,39 +717,42 @@ async def prepare_export(request_data: dict):
         pdf_paths = []
         
         for i, file_info in enumerate(ordered_files):
-            logger.info(f"Processing file {i+1}/{len(ordered_files)}: {file_info}")
+            logger.info(f"Processing file {i+1}/{len(ordered_files)}: {file_info['name']}")
             
-            file_id = file_info["id"]
-            file_path = None
-            file_type = None
+            file_path = file_info.get("path")
+            file_data = file_info.get("data")
+            file_type = file_info.get("type")
             
-            # Find file path
-            file_record = id_to_file.get(file_id)
-            if file_record:
-                file_path = file_record.get("path")
-                file_type = file_record.get("type")
+            logger.info(f"File path: {file_path or 'in memory'}, type: {file_type}")
             
-            logger.info(f"File path: {file_path}, type: {file_type}")
-            
-            if not file_path or not os.path.exists(file_path):
+            if file_data is None and (not file_path or not os.path.exists(file_path)):
                 logger.warning(f"File not found or doesn't exist: {file_path}")
                 continue
             
             try:
                 if file_type == "pdf":
                     # PDF files - use directly
-                    logger.info(f"Using PDF directly: {file_path}")
-                    pdf_paths.append(file_path)
+                    logger.info(f"Using PDF directly: {file_info['name']}")
+                    pdf_paths.append(io.BytesIO(file_data) if file_data is not None else file_path)
                 elif file_type == "docx":
                     # Convert DOCX to PDF
                     logger.info(f"Converting DOCX to PDF: {file_path}")
-                    pdf_path = convert_docx_to_pdf(file_path, output_dir)
+                    pdf_path = convert_docx_to_pdf(file_path, output_dir())
+                    session_store.add_file(session_id, pdf_path)
                     pdf_paths.append(pdf_path)
+                elif file_type == "image" and file_data is not None:
+                    # Convert image to PDF in memory
+                    logger.info(f"Converting image to PDF in memory: {file_info['name']}")
+                    pdf_buffer = io.BytesIO()
+                    convert_image_to_pdf(io.BytesIO(file_data), pdf_buffer)
+                    pdf_buffer.seek(0)
+                    pdf_paths.append(pdf_buffer)
                 elif file_type == "image":
                     # Convert image to PDF
                     logger.info(f"Converting image to PDF: {file_path}")
-                    pdf_path = os.path.join(output_dir, f"{Path(file_path).stem}.pdf")
+                    pdf_path = os.path.join(output_dir(), f"{Path(file_path).stem}.pdf")
                     convert_image_to_pdf(file_path, pdf_path)
+                    session_store.add_file(session_id, pdf_path)
                     pdf_paths.append(pdf_path)
                 else:
                     logger.warning(f"Unknown file type: {file_type}")
@@ -303,25 +760,45 @@ async def prepare_export(request_data: dict):
                 logger.error(f"Error processing file {file_path}: {str(e)}")
                 continue
         
-        logger.info(f"Successfully processed {len(pdf_paths)} files: {pdf_paths}")
+        logger.info(f"Successfully processed {len(pdf_paths)} files")
         
-        # Merge all PDFs
+        if not pdf_paths:
+            logger.error("No valid files to process")
+            raise HTTPException(status_code=400, detail="No valid files to process")
+        
+        # Merge all PDFs; small exports are merged into a buffer and kept in memory
         export_id = str(uuid.uuid4())
-        final_pdf_path = os.path.join(output_dir, f"export_{export_id}.pdf")
+        input_bytes = sum(f["size"] for f in ordered_files)
+        if input_bytes <= IN_MEMORY_MAX_MB * 1024 * 1024:
+            output = io.BytesIO()
+            logger.info(f"Merging {len(pdf_paths)} PDFs in memory")
+            merge_pdfs(pdf_paths, output)
+            pdf_bytes = output.getvalue()
+        else:
+            pdf_bytes = None
         
-        if pdf_paths:
-            logger.info(f"Merging PDFs to: {final_pdf_path}")
-            merge_pdfs(pdf_paths, final_pdf_path)
+        if pdf_bytes is not None and len(pdf_bytes) <= IN_MEMORY_MAX_MB * 1024 * 1024:
+            export = {"pdf_bytes": pdf_bytes, "metadata": metadata}
+            session_store.add_bytes(session_id, len(pdf_bytes))
+            session_store.count_export("in_memory")
         else:
-            logger.error("No valid files to process")
-            raise HTTPException(status_code=400, detail="No valid files to process")
+            final_pdf_path = os.path.join(output_dir(), f"export_{export_id}.pdf")
+            if pdf_bytes is not None:
+                # Merged in memory but too large to keep there
+                with open(final_pdf_path, "wb") as f:
+                    f.write(pdf_bytes)
+            else:
+                logger.info(f"Merging PDFs to: {final_pdf_path}")
+                merge_pdfs(pdf_paths, final_pdf_path)
+            export = {"final_pdf_path": final_pdf_path, "metadata": metadata}
+            session_store.add_file(session_id, final_pdf_path)
+            session_store.count_export("disk")
         
         # Store export info
-        session["export_id"] = export_id
-        session["final_pdf_path"] = final_pdf_path
-        session["metadata"] = metadata
+        session_store.add_export(session_id, export_id, export)
         
-        logger.info(f"Export prepared successfully: {export_id}")
+        rss_delta = memory_recorder.record("export", memory_before)
+        logger.info(f"Export prepared successfully: {export_id}" + (f" (RSS {rss_delta:+.1f}MB)" if rss_delta is not None else ""))
         
         return {
             "export_id": export_id,
@@ -339,13 +816,19 @@ async def prepare_export(request_data: dict):
 async def download_pdf(export_id: str):
     """Download PDF endpoint - return real PDF"""
     try:
-        # Find session with this export_id
-        pdf_path = None
-        for session_id, session in sessions.items():
-            if session.get("export_id") == export_id:
-                pdf_path = session.get("final_pdf_path")
-                break
-        
+        export = session_store.find_export(export_id)
+        headers = {"Content-Disposition": f"attachment; filename=export_{export_id}.pdf"}
+        
+        if export is not None and export.get("pdf_bytes") is not None:
+            data = export["pdf_bytes"]
+            headers["Content-Length"] = str(len(data))
+            return StreamingResponse(
+                (data[start:start + DOWNLOAD_CHUNK_SIZE] for start in range(0, len(data), DOWNLOAD_CHUNK_SIZE)),
+                media_type="application/pdf",
+                headers=headers
+            )
+        
+        pdf_path = export.get("final_pdf_path") if export else None
         if not pdf_path or not os.path.exists(pdf_path):
             raise HTTPException(status_code=404, detail="PDF not found")
         
@@ -353,9 +836,11 @@ async def download_pdf(export_id: str):
             path=pdf_path,
             media_type="application/pdf",
             filename=f"export_{export_id}.pdf",
-            headers={"Content-Disposition": f"attachment; filename=export_{export_id}.pdf"}
+            headers=headers
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Download PDF error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to download PDF: {str(e)}")
@@ -364,17 +849,13 @@ async def download_pdf(export_id: str):
 async def download_metadata(export_id: str):
     """Download metadata endpoint - return real metadata"""
     try:
-        # Find session with this export_id
-        metadata = None
-        for session_id, session in sessions.items():
-            if session.get("export_id") == export_id:
-                metadata = session.get("metadata", {})
-                break
+        export = session_store.find_export(export_id)
         
-        if metadata is None:
+        if export is None:
             raise HTTPException(status_code=404, detail="Metadata not found")
         
         # Add export_id to metadata
+        metadata = dict(export.get("metadata") or {})
         metadata["export_id"] = export_id
         
         from fastapi.responses import JSONResponse
@@ -383,6 +864,8 @@ async def download_metadata(export_id: str):
             headers={"Content-Disposition": f"attachment; filename=metadata_{export_id}.json"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Download metadata error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to download metadata: {str(e)}")